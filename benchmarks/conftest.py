@@ -0,0 +1,75 @@
+"""Micro-benchmarks of the project's CPU-bound hot paths, run with pytest-benchmark on synthetic data sized like real
+usage. They are not part of the test suite (see pytest.ini); run them explicitly:
+
+    python -m pytest benchmarks --benchmark-save=baseline
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=min:20%
+
+The first command records a baseline under .benchmarks/; the second one fails if any benchmark is more than 20% slower
+than the latest saved run. Timings only compare on the machine which recorded them, so baselines are not committed
+(.benchmarks/ is ignored): record one, e.g. on the main branch, before measuring a change on the same machine.
+"""
+import datetime
+import random
+
+import pytest
+
+_EXERCISE_WORDS = [
+    "bench", "press", "incline", "decline", "overhead", "shoulder", "tricep", "extension", "dip", "push",
+    "row", "pull", "up", "chin", "curl", "bicep", "lat", "pulldown", "face", "deadlift", "romanian",
+    "squat", "front", "goblet", "lunge", "leg", "calf", "raise", "fly", "cable", "dumbbell", "barbell",
+]
+
+
+def synthetic_catalog(rng: random.Random, n_keywords: int = 2000) -> dict:
+    catalog = {"push": [], "pull": [], "legs": []}
+    categories = list(catalog)
+    for i in range(n_keywords):
+        words = rng.sample(_EXERCISE_WORDS, rng.randint(1, 3))
+        catalog[categories[i % len(categories)]].append(" ".join(words))
+    return catalog
+
+
+def synthetic_workout(rng: random.Random, n_exercises: int = 6) -> str:
+    lines = []
+    for _ in range(n_exercises):
+        name = " ".join(rng.sample(_EXERCISE_WORDS, rng.randint(1, 3))).capitalize()
+        lines.append(
+            f"{name}: {rng.randint(5, 150)} kg. {rng.randint(2, 5)} sets, {rng.randint(3, 12)} repetitions in each set."
+        )
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+@pytest.fixture
+def cfg_dict() -> dict:
+    return {
+        "version": "0.0.0",
+        "schema_version": 2,
+        "open_weather_cfg": {"lat": 45.5, "long": -73.6, "api_key": "k" * 32},
+        "google_calendar_cfg": {"calender_id": "x" * 26 + "@group.calendar.google.com"},
+        "google_ai_cfg": {"google_ai_id": "g" * 39},
+        "timezone_cfg": {"timezone": "America/Toronto"},
+        "baseline_weights_cfg": {"bp_weight": 80.0, "sq_weight": 100.0, "dl_weight": 120.0},
+    }
+
+
+@pytest.fixture
+def events(rng) -> list:
+    """5000 events, about one every 30 minutes from now on, 5% of them workouts."""
+    start = datetime.datetime.now(datetime.timezone.utc)
+    events = []
+    for i in range(5000):
+        t = start + datetime.timedelta(minutes=30 * i + rng.randint(0, 29))
+        events.append(
+            {
+                "id": f"event{i}",
+                "summary": "WORKOUT" if rng.random() < 0.05 else f"Meeting {i}",
+                "description": synthetic_workout(rng, 3),
+                "start": {"dateTime": t.isoformat()},
+            }
+        )
+    return events
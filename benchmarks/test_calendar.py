@@ -0,0 +1,24 @@
+import datetime
+
+import pytest
+
+from device_modules.calendar_event_store import CalendarEventStore, parse_event_time
+from device_modules.googlecalendar_manager import GcalendarManager
+
+pytestmark = pytest.mark.benchmark(group="calendar")
+
+
+def test_check_for_workout_filter_5000_events(benchmark, events):
+    # No workout and a window ending after the last event: the filter scans all 5000 events
+    no_workout_events = [dict(e, summary="Meeting") for e in events]
+    end_ts = parse_event_time(events[-1]["start"]) + 1
+
+    assert benchmark(GcalendarManager._contains_workout, no_workout_events, end_ts) is False
+
+
+def test_event_store_events_between_5000_events(benchmark, events):
+    event_store = CalendarEventStore(":memory:", calendar_id="benchmark")
+    event_store.upsert(events)
+    first_ts = datetime.datetime.fromisoformat(events[0]["start"]["dateTime"]).timestamp()
+
+    benchmark(event_store.events_between, first_ts, first_ts + 86400, summary_contains="WORKOUT")
@@ -0,0 +1,25 @@
+import random
+
+import pytest
+
+from conftest import synthetic_catalog, synthetic_workout
+from device_modules.exercise_classifier import ExerciseClassifier
+
+pytestmark = pytest.mark.benchmark(group="classifier")
+
+
+def test_classifier_compile_2000_keywords(benchmark):
+    benchmark(lambda: ExerciseClassifier(synthetic_catalog(random.Random(0))))
+
+
+def test_classifier_score(benchmark, rng):
+    classifier = ExerciseClassifier(synthetic_catalog(rng))
+
+    benchmark(classifier.score, synthetic_workout(rng))
+
+
+def test_classifier_classify_many_500(benchmark, rng):
+    classifier = ExerciseClassifier(synthetic_catalog(rng))
+    workouts = [synthetic_workout(rng) for _ in range(500)]
+
+    benchmark(classifier.classify_many, workouts)
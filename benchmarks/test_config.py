@@ -0,0 +1,15 @@
+import json
+
+import pytest
+
+from configurations.config_dataclasses import UserCfg
+
+pytestmark = pytest.mark.benchmark(group="config")
+
+
+def test_usercfg_from_dict(benchmark, cfg_dict):
+    benchmark(UserCfg.from_dict, cfg_dict)
+
+
+def test_usercfg_update_cfg_dict(benchmark, cfg_dict):
+    benchmark(lambda: UserCfg.update_cfg_dict(json.loads(json.dumps(cfg_dict))))
@@ -0,0 +1,12 @@
+import pytest
+
+from configurations.config_dataclasses import UserCfg
+from device_modules.googleai_caller import GoogleAICaller
+
+pytestmark = pytest.mark.benchmark(group="prompt")
+
+
+def test_prompt_assembly(benchmark, cfg_dict):
+    gai_caller = GoogleAICaller(user_id=None, usercfg=UserCfg.from_dict(cfg_dict))
+
+    benchmark(gai_caller.build_prompt, "push")
@@ -0,0 +1,17 @@
+import pytest
+
+from device_modules.weather_series import WeatherSeries
+from fakes import synthetic_onecall
+
+pytestmark = pytest.mark.benchmark(group="weather")
+
+
+def test_onecall_parse(benchmark, rng):
+    benchmark(WeatherSeries.from_response, synthetic_onecall(rng))
+
+
+def test_onecall_max_temp_in_window(benchmark, rng):
+    onecall = synthetic_onecall(rng)
+    series = WeatherSeries.from_response(onecall)
+
+    benchmark(series.max_temp, onecall["hourly"][3]["dt"], onecall["hourly"][20]["dt"])
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import copy
 import dataclasses
 from dataclasses import dataclass
 import json
 
+# Version of the layout of the configuration dict; see MIGRATIONS
+CFG_SCHEMA_VERSION = 2
+
 
 def cleanup(path):
     """Removes JSON files with API keys.
@@ -15,7 +19,29 @@ def cleanup(path):
     pass
 
 
-@dataclass
+def coerce_value(value, type_: type):
+    """Converts `value`, e.g. a string typed at a prompt, to `type_`.
+
+    Raises:
+        ValueError: `value` can't be converted.
+    """
+    if isinstance(value, type_) and not isinstance(value, bool):
+        return value
+    if type_ is str:
+        return str(value)
+    return type_(str(value).strip())
+
+
+def _prompt(message: str, type_: type = str):
+    """Asks the user for a value until one converts to `type_`."""
+    while True:
+        try:
+            return coerce_value(input(message), type_)
+        except ValueError:
+            print(f"Expected a {type_.__name__}, try again.")
+
+
+@dataclass(slots=True)
 class UserCfg:
     open_weather_cfg: OpenWeatherCfg
     google_calendar_cfg: GoogleCalendarCfg
@@ -23,55 +49,64 @@ class UserCfg:
     timezone_cfg: TimezoneCfg
     version: str
     baseline_weights_cfg: BaselineWeightsCfg
+    schema_version: int = CFG_SCHEMA_VERSION
 
     @classmethod
     def from_dict(cls, dict_obj: dict) -> UserCfg:
-        open_weather_cfg = OpenWeatherCfg(**dict_obj["open_weather_cfg"])
-        google_calendar_cfg = GoogleCalendarCfg(**dict_obj["google_calendar_cfg"])
-        google_ai_cfg = GoogleAICfg(**dict_obj["google_ai_cfg"])
-        timezone_cfg = TimezoneCfg(**dict_obj["timezone_cfg"])
-        baseline_weights_cfg = BaselineWeightsCfg(**dict_obj["baseline_weights_cfg"])
+        if dict_obj.get("schema_version") != CFG_SCHEMA_VERSION:
+            dict_obj = migrate(copy.deepcopy(dict_obj))
+        sections = {
+            name: section_cls(**dict_obj[name])
+            for name, (section_cls, _) in CFG_SCHEMA.items()
+        }
         return cls(
-            open_weather_cfg=open_weather_cfg,
-            google_calendar_cfg=google_calendar_cfg,
-            google_ai_cfg=google_ai_cfg,
-            timezone_cfg=timezone_cfg,
             version=dict_obj["version"],
-            baseline_weights_cfg=baseline_weights_cfg,
+            schema_version=dict_obj["schema_version"],
+            **sections,
         )
 
-    @staticmethod
-    def _get_field_update_method(dataclass_name: str, args):
-        if dataclass_name == "OpenWeatherCfg":
-            return OpenWeatherCfg.update_param_dict(args)
-        elif dataclass_name == "GoogleCalendarCfg":
-            return GoogleCalendarCfg.update_param_dict(args)
-        elif dataclass_name == "GoogleAICfg":
-            return GoogleAICfg.update_param_dict(args)
-        elif dataclass_name == "TimezoneCfg":
-            return TimezoneCfg.update_param_dict(args)
-        elif dataclass_name == "BaselineWeightsCfg":
-            return BaselineWeightsCfg.update_param_dict(args)
-
     @classmethod
     def list_cfg_parameters(cls) -> list:
         """Provides a list of all fields of the UserCfg class plus all the fields of each UserCfg field which is a dataclass.
-        Assumes all fields of UserCfg are either dataclasses or strings.
 
         Returns:
             list: all fields of UserCfg and all fields of each dataclass within UserCfg
         """
         attributes_list = [field.name for field in dataclasses.fields(UserCfg)]
-        parameters_list = []
-        for a in attributes_list:
-            if type(a) is not str:
-                for field in dataclasses.fields(a):
-                    parameters_list.append(field)
+        parameters_list = [
+            name for _, field_types in CFG_SCHEMA.values() for name in field_types
+        ]
         return attributes_list + parameters_list
 
+    @classmethod
+    def missing_parameters(cls, cfg_dict: dict) -> list:
+        """Lists the parameters of the schema absent from `cfg_dict`, as "section.parameter" (or "parameter" for top level ones)."""
+        missing = [
+            f.name
+            for f in dataclasses.fields(UserCfg)
+            if f.name not in CFG_SCHEMA and f.name not in cfg_dict
+        ]
+        for name, (_, field_types) in CFG_SCHEMA.items():
+            section = cfg_dict.get(name)
+            if not isinstance(section, dict):
+                missing.append(name)
+                continue
+            missing += [f"{name}.{p}" for p in field_types if p not in section]
+        return missing
+
+    @classmethod
+    def is_up_to_date(cls, cfg_dict: dict) -> bool:
+        """Checks if `cfg_dict` uses the current schema version and has every parameter of the schema."""
+        return (
+            cfg_dict.get("schema_version") == CFG_SCHEMA_VERSION
+            and not cls.missing_parameters(cfg_dict)
+        )
+
     @classmethod
     def update_cfg_dict(cls, old_cfg_dict: dict) -> dict:
         """Updates a configuration dict with new values as needed, keeping old values from old_cfg_dict.
+        old_cfg_dict is migrated to the current schema version first, and every value is converted to the type of its field.
+        old_cfg_dict itself is left unchanged.
 
         Args:
             old_cfg_dict (dict): A dictionary of old configuration values.
@@ -79,20 +114,27 @@ class UserCfg:
         Returns:
             dict: A new configuration dictionary.
         """
-        new_cfg_dict = {}
-        # Update non-dataclass fields first
         from _version import __version__
 
-        new_cfg_dict.update({"version": __version__})
+        new_cfg_dict = migrate(copy.deepcopy(old_cfg_dict))
         # Update dataclass fields
-        for f in dataclasses.fields(UserCfg):
-            if f.type != "str":
-                new_param_dict = cls._get_field_update_method(f.type, old_cfg_dict)
-                new_cfg_dict.update({f.name: new_param_dict[f.name]})
-        return new_cfg_dict
+        for name, (section_cls, field_types) in CFG_SCHEMA.items():
+            section_cls.update_param_dict(new_cfg_dict)
+            section = new_cfg_dict[name]
+            for param, type_ in field_types.items():
+                section[param] = coerce_value(section[param], type_)
+        # Update non-dataclass fields
+        new_cfg_dict["version"] = __version__
+        new_cfg_dict["schema_version"] = CFG_SCHEMA_VERSION
+        return {f.name: new_cfg_dict[f.name] for f in dataclasses.fields(UserCfg)}
+
+    @staticmethod
+    def encode(cfg_dict: dict) -> str:
+        """Compact JSON encoding of a configuration dict, as stored in Secret Manager."""
+        return json.dumps(cfg_dict, separators=(",", ":"), sort_keys=True)
 
 
-@dataclass
+@dataclass(slots=True)
 class OpenWeatherCfg:
     lat: float
     long: float
@@ -114,10 +156,10 @@ class OpenWeatherCfg:
             old_dict.update({param_dict_name: {}})
         # User defined inputs:
         if "lat" not in old_dict[param_dict_name].keys():
-            lat = input("Enter your latitude: ")
+            lat = _prompt("Enter your latitude: ", float)
             old_dict[param_dict_name].update({"lat": lat})
         if "long" not in old_dict[param_dict_name].keys():
-            long = input("Enter your longitude: ")
+            long = _prompt("Enter your longitude: ", float)
             old_dict[param_dict_name].update({"long": long})
         # JSON files
         if "api_key" not in old_dict[param_dict_name].keys():
@@ -130,7 +172,7 @@ class OpenWeatherCfg:
         return old_dict
 
 
-@dataclass
+@dataclass(slots=True)
 class GoogleCalendarCfg:
     calender_id: str
 
@@ -162,7 +204,7 @@ class GoogleCalendarCfg:
         return old_dict
 
 
-@dataclass
+@dataclass(slots=True)
 class GoogleAICfg:
     google_ai_id: str
 
@@ -194,7 +236,7 @@ class GoogleAICfg:
         return old_dict
 
 
-@dataclass
+@dataclass(slots=True)
 class TimezoneCfg:
     timezone: str
 
@@ -213,7 +255,7 @@ class TimezoneCfg:
             old_dict.update({param_dict_name: {}})
         # User defined inputs:
         if "timezone" not in old_dict[param_dict_name].keys():
-            timezone = input(
+            timezone = _prompt(
                 "Enter your timezone (allowable names are from https://data.iana.org/time-zones/tzdb-2021a/zone1970.tab): "
             )
             old_dict[param_dict_name].update({"timezone": timezone})
@@ -224,14 +266,14 @@ class TimezoneCfg:
         return old_dict
 
 
-@dataclass
+@dataclass(slots=True)
 class SenseMonitorCfg:
     """Unused for now"""
 
     token: str
 
 
-@dataclass
+@dataclass(slots=True)
 class BaselineWeightsCfg:
     bp_weight: float  # Bench Press weight (kg)
     sq_weight: float  # Squat weight (kg)
@@ -252,15 +294,68 @@ class BaselineWeightsCfg:
             old_dict.update({param_dict_name: {}})
         # User defined inputs:
         if "bp_weight" not in old_dict[param_dict_name].keys():
-            bp_weight = input("Enter your 80% Bench Press weight in kilograms: ")
+            bp_weight = _prompt("Enter your 80% Bench Press weight in kilograms: ", float)
             old_dict[param_dict_name].update({"bp_weight": bp_weight})
         if "sq_weight" not in old_dict[param_dict_name].keys():
-            sq_weight = input("Enter your 80% Squat weight in kilograms: ")
+            sq_weight = _prompt("Enter your 80% Squat weight in kilograms: ", float)
             old_dict[param_dict_name].update({"sq_weight": sq_weight})
         if "dl_weight" not in old_dict[param_dict_name].keys():
-            dl_weight = input("Enter your 80% Deadlift weight in kilograms: ")
+            dl_weight = _prompt("Enter your 80% Deadlift weight in kilograms: ", float)
             old_dict[param_dict_name].update({"dl_weight": dl_weight})
 
         # JSON files
         #   None
         return old_dict
+
+
+def _migrate_1_to_2(cfg_dict: dict):
+    """Version 1 configurations have no schema_version, and store the numbers typed at the prompts as strings."""
+    for name, (_, field_types) in CFG_SCHEMA.items():
+        section = cfg_dict.get(name, {})
+        for param, type_ in field_types.items():
+            if param in section:
+                section[param] = coerce_value(section[param], type_)
+    cfg_dict["schema_version"] = 2
+
+
+# Migration from each schema version to the next one, applied in place
+MIGRATIONS = {1: _migrate_1_to_2}
+
+
+def migrate(cfg_dict: dict) -> dict:
+    """Upgrades `cfg_dict` in place to CFG_SCHEMA_VERSION and returns it.
+
+    Raises:
+        ValueError: `cfg_dict` was written by a newer schema version.
+    """
+    version = cfg_dict.get("schema_version", 1)
+    if version > CFG_SCHEMA_VERSION:
+        raise ValueError(
+            f"configuration schema version {version} is newer than {CFG_SCHEMA_VERSION}"
+        )
+    while version < CFG_SCHEMA_VERSION:
+        MIGRATIONS[version](cfg_dict)
+        version = cfg_dict["schema_version"]
+    return cfg_dict
+
+
+def _build_schema() -> dict:
+    """Maps the name of every dataclass field of UserCfg to its class and the type of each of its parameters."""
+    classes = {
+        c.__name__: c
+        for c in (OpenWeatherCfg, GoogleCalendarCfg, GoogleAICfg, TimezoneCfg, BaselineWeightsCfg)
+    }
+    types = {"str": str, "float": float, "int": int}
+    schema = {}
+    for f in dataclasses.fields(UserCfg):
+        if f.type in classes:
+            section_cls = classes[f.type]
+            schema[f.name] = (
+                section_cls,
+                {g.name: types[g.type] for g in dataclasses.fields(section_cls)},
+            )
+    return schema
+
+
+# Computed once: {section name: (cfg class, {parameter: type})}
+CFG_SCHEMA = _build_schema()
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import datetime
+import heapq
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import telemetry
+
+
+@dataclass
+class UserSession:
+    """A user served by the daemon. Each user has a directory holding their credentials.json and local state.
+
+    Attributes:
+        name (str): Name of the user's directory.
+        user_dir (Path): The user's directory.
+        run_at (datetime.time): Local time at which the user's daily job runs.
+        timezone (Optional[str]): IANA timezone of the user, in which run_at is interpreted; known from the user's
+            configuration after the first job, the host's timezone is used until then.
+        user_id (Optional[IdentityManager]): The user's identity, created at the first job and kept for the next ones.
+        journal (Optional[WriteJournal]): The user's write journal, opened at the first job and shared by the next ones.
+        stores (dict): The user's local stores by name (calendar event store, Gemini response cache, workout history
+            and embedding index), opened by the first jobs and shared by the next ones; see scripts.run_user_job.
+        flusher (Optional[JournalFlusher]): Inserts the calendar events queued in the journal by the user's jobs,
+            started after the first job.
+        watcher (Optional[CalendarWatcher]): Keeps a watch channel open on the user's calendar, when the daemon
+            receives push notifications; created after the first job.
+    """
+
+    name: str
+    user_dir: Path
+    run_at: datetime.time
+    timezone: Optional[str] = None
+    user_id: Optional[object] = field(default=None, repr=False)
+    journal: Optional[object] = field(default=None, repr=False)
+    stores: dict = field(default_factory=dict, repr=False)
+    flusher: Optional[object] = field(default=None, repr=False)
+    watcher: Optional[object] = field(default=None, repr=False)
+
+
+class SchedulerDaemon:
+    def __init__(
+        self,
+        users_dir: Path | str,
+        run_at: str = "06:00",
+        max_workers: int = 4,
+        upstream_limits: Optional[dict] = None,
+        stats_interval: float = 60,
+        watch_address: Optional[str] = None,
+        watch_port: int = 8080,
+    ):
+        """Long-running scheduler which runs every user's daily check-and-generate job in one process.
+
+        Every sub-directory of `users_dir` containing a credentials.json file is a user. A user can override the daily
+        run time with a schedule.json file such as {"run_at": "07:30"}. Jobs run on a bounded worker pool, and calls to
+        each upstream service are limited to a number of concurrent calls across all jobs.
+
+        Args:
+            users_dir (Path | str): Directory with one sub-directory per user.
+            run_at (str, optional): Default local time of the daily job, as HH:MM. Defaults to "06:00".
+            max_workers (int, optional): Number of jobs running at the same time. Defaults to 4.
+            upstream_limits (Optional[dict], optional): Maximum concurrent calls by upstream name ("calendar",
+                "secret_manager", "gemini"). Upstreams which are not listed are not limited. Defaults to None.
+            stats_interval (float, optional): Seconds between two printed stats reports. Defaults to 60.
+            watch_address (Optional[str], optional): Public HTTPS URL forwarded to the notification receiver. If set,
+                every user's calendar is watched and their event store is only synced after a change was notified.
+                Defaults to None, which syncs at every job.
+            watch_port (int, optional): Local port of the notification receiver. Defaults to 8080.
+        """
+        self.users_dir = Path(users_dir)
+        self.default_run_at = datetime.time.fromisoformat(run_at)
+        self.max_workers = max_workers
+        self.stats_interval = stats_interval
+        self._limits = {
+            name: threading.BoundedSemaphore(n)
+            for name, n in (upstream_limits or {}).items()
+        }
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._heap = []  # (next run timestamp, user name)
+        self._replan = set()  # names of the users whose timezone changed since their next run was planned
+        self._sessions = {}
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._latencies = []  # (queue wait, run time) of recent jobs
+        self.watch_address = watch_address
+        self._receiver = None
+        if watch_address is not None:
+            from device_modules.calendar_watch import NotificationReceiver
+
+            self._receiver = NotificationReceiver(host="0.0.0.0", port=watch_port)
+
+    def load_users(self):
+        """Discovers users in users_dir and schedules their next daily job. Already known users are left unchanged."""
+        for user_dir in sorted(p for p in self.users_dir.iterdir() if p.is_dir()):
+            if not (user_dir / "credentials.json").exists():
+                continue
+            if user_dir.name in self._sessions:
+                continue
+            run_at = self.default_run_at
+            schedule_path = user_dir / "schedule.json"
+            if schedule_path.exists():
+                with open(schedule_path) as f:
+                    run_at = datetime.time.fromisoformat(json.load(f)["run_at"])
+            session = UserSession(name=user_dir.name, user_dir=user_dir, run_at=run_at)
+            self._sessions[session.name] = session
+            heapq.heappush(self._heap, (self._next_run(session), session.name))
+
+    @staticmethod
+    def _next_run(session: UserSession, after: Optional[datetime.datetime] = None) -> float:
+        """Timestamp of the next daily run of `session` strictly after `after` (timezone-aware, defaults to now).
+        run_at is a wall clock time in the user's timezone, so runs follow its daylight saving time changes."""
+        from zoneinfo import ZoneInfo
+
+        tz = ZoneInfo(session.timezone) if session.timezone else datetime.datetime.now().astimezone().tzinfo
+        after = datetime.datetime.now(tz) if after is None else after.astimezone(tz)
+        run = datetime.datetime.combine(after.date(), session.run_at, tzinfo=tz)
+        if run <= after:
+            run = datetime.datetime.combine(after.date() + datetime.timedelta(days=1), session.run_at, tzinfo=tz)
+        return run.timestamp()
+
+    def _replan_runs(self):
+        """Plans again the next run of the users whose timezone became known or changed."""
+        with self._lock:
+            names, self._replan = self._replan, set()
+        if names:
+            self._heap = [(ts, name) for ts, name in self._heap if name not in names]
+            self._heap += [(self._next_run(self._sessions[name]), name) for name in names]
+            heapq.heapify(self._heap)
+
+    @contextmanager
+    def limit(self, upstream: str):
+        """Holds one of the concurrent call slots of `upstream` for the duration of the with block."""
+        semaphore = self._limits.get(upstream)
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def _run_job(self, session: UserSession, enqueued_at: float):
+        from scripts import _write_journal, run_user_job
+        from device_modules.identity_manager import IdentityManager
+
+        started_at = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        ok = False
+        try:
+            if session.user_id is None:
+                session.user_id = IdentityManager.google_oauth2_login(
+                    credential_json_path=session.user_dir / "credentials.json"
+                )
+                session.user_id.start_background_refresh()
+            if session.journal is None:
+                session.journal = _write_journal(session.user_dir)
+            gcm = run_user_job(
+                session.user_id,
+                data_dir=session.user_dir,
+                limit=self.limit,
+                journal=session.journal,
+                stores=session.stores,
+            )
+            if gcm.cfg.timezone_cfg.timezone != session.timezone:
+                session.timezone = gcm.cfg.timezone_cfg.timezone
+                with self._lock:
+                    self._replan.add(session.name)
+            if session.flusher is None:
+                session.flusher = gcm.flusher().start()
+            if self._receiver is not None and session.watcher is None:
+                from device_modules.calendar_watch import CalendarWatcher
+
+                session.watcher = CalendarWatcher(
+                    gcm, self._receiver, self.watch_address, session.user_dir / "watch_channel.json"
+                )
+                self._renew_watch(session)
+            ok = True
+        except Exception as e:
+            print(f"Job of user {session.name} failed: {e!r}")
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._latencies.append(
+                    (started_at - enqueued_at, finished_at - started_at)
+                )
+                del self._latencies[:-1000]
+
+    @staticmethod
+    def _renew_watch(session: UserSession):
+        """Opens or renews the watch channel of `session` if it expires soon. Failures only cost polling."""
+        try:
+            session.watcher.renew_if_due()
+        except Exception as e:
+            print(f"Watch channel of user {session.name} not renewed: {e!r}")
+
+    def submit(self, session: UserSession):
+        """Queues a job for `session` on the worker pool."""
+        with self._lock:
+            self._queued += 1
+        self._pool.submit(self._run_job, session, time.perf_counter())
+
+    def stats(self) -> dict:
+        """Queue depth, running jobs, job counts and job latency (queue wait and run time, in seconds) of the last 1000 jobs.
+        With telemetry enabled, also the request latency percentiles of each upstream."""
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                "users": len(self._sessions),
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+            flushers = [s.flusher for s in self._sessions.values() if s.flusher is not None]
+        stats["queued_calendar_inserts"] = sum(len(f.journal.pending()) for f in flushers)
+        for i, name in enumerate(("queue_wait", "run_time")):
+            values = sorted(latency[i] for latency in latencies)
+            if values:
+                stats[f"{name}_p50"] = values[len(values) // 2]
+                stats[f"{name}_p95"] = values[int(len(values) * 0.95)]
+                stats[f"{name}_max"] = values[-1]
+        if self._receiver is not None:
+            stats["calendar_notifications"] = dict(self._receiver.stats)
+        if telemetry.get() is not None:
+            stats["latency_by_upstream"] = telemetry.get().summary()
+        return stats
+
+    def run_forever(self, run_now: bool = False):
+        """Runs jobs as they become due until stop is called or the process is interrupted.
+
+        Args:
+            run_now (bool, optional): Run every user's job once immediately, then follow the daily schedule. Defaults to False.
+        """
+        self.load_users()
+        if self._receiver is not None:
+            self._receiver.start()
+        if run_now:
+            for session in self._sessions.values():
+                self.submit(session)
+        next_stats = time.time() + self.stats_interval
+        try:
+            while not self._stop.is_set():
+                now = time.time()
+                self._replan_runs()
+                while self._heap and self._heap[0][0] <= now:
+                    _, name = heapq.heappop(self._heap)
+                    session = self._sessions[name]
+                    self.submit(session)
+                    heapq.heappush(self._heap, (self._next_run(session), name))
+                if now >= next_stats:
+                    self.load_users()
+                    for session in self._sessions.values():
+                        if session.watcher is not None:
+                            self._renew_watch(session)
+                    print(json.dumps(self.stats()))
+                    if telemetry.get() is not None:
+                        telemetry.get().flush()
+                    next_stats = now + self.stats_interval
+                wake_up = min(self._heap[0][0] if self._heap else next_stats, next_stats)
+                self._stop.wait(max(0.0, wake_up - time.time()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            for session in self._sessions.values():
+                if session.flusher is not None:
+                    session.flusher.stop()
+                if session.journal is not None:
+                    session.journal.close()
+                if session.watcher is not None:
+                    # The channels stay open for the next run of the daemon
+                    session.watcher.detach()
+                for store in session.stores.values():
+                    if hasattr(store, "close"):
+                        store.close()
+            if self._receiver is not None:
+                self._receiver.stop()
+
+    def stop(self):
+        """Asks run_forever to return once the running jobs are done."""
+        self._stop.set()
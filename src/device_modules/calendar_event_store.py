@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import datetime
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+import resilience
+
+
+def parse_event_time(time_dict: dict) -> float:
+    """Converts the `start`/`end` object of a Calendar event to a POSIX timestamp.
+
+    Args:
+        time_dict (dict): Event time object containing either a RFC3339 `dateTime` or an all-day `date`.
+
+    Returns:
+        float: seconds since the epoch. All-day events are placed at midnight UTC.
+    """
+    if "dateTime" in time_dict:
+        value = time_dict["dateTime"].replace("Z", "+00:00")
+        return datetime.datetime.fromisoformat(value).timestamp()
+    date = datetime.date.fromisoformat(time_dict["date"])
+    return datetime.datetime(
+        date.year, date.month, date.day, tzinfo=datetime.timezone.utc
+    ).timestamp()
+
+
+class CalendarEventStore:
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            id TEXT PRIMARY KEY,
+            summary TEXT,
+            description TEXT,
+            start_ts REAL NOT NULL,
+            start_raw TEXT
+        );
+        CREATE INDEX IF NOT EXISTS events_start_ts ON events (start_ts);
+        -- Summaries are matched by substring (instr), which no index serves; drop the one earlier versions created
+        DROP INDEX IF EXISTS events_summary_start_ts;
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, db_path: Path | str, calendar_id: str):
+        """Local copy of the events of one Google Calendar, kept current with the Calendar API incremental sync.
+
+        Args:
+            db_path (Path | str): Path to the SQLite database file. Created if it doesn't exist.
+            calendar_id (str): ID of the calendar mirrored by this store.
+        """
+        self.db_path = Path(db_path)
+        self.calendar_id = calendar_id
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.executescript(self._SCHEMA)
+        # A database file belongs to a single calendar; start over if it was synced against another one.
+        if self._get_meta("calendar_id") not in (None, calendar_id):
+            self.clear()
+        self._set_meta("calendar_id", calendar_id)
+        self._conn.commit()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, key: str, value: Optional[str]):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    @property
+    def sync_token(self) -> Optional[str]:
+        """The Calendar API sync token of the last successful sync, or None if the store was never synced."""
+        with self._lock:
+            return self._get_meta("sync_token")
+
+    def clear(self):
+        """Deletes every stored event and the sync token, forcing a full sync on the next call to sync."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM events")
+            self._conn.execute("DELETE FROM meta WHERE key = 'sync_token'")
+
+    def _apply(self, events: list):
+        """Inserts, updates or deletes (cancelled events) stored events. Caller holds the lock."""
+        for event in events:
+            if event.get("status") == "cancelled" or "start" not in event:
+                self._conn.execute("DELETE FROM events WHERE id = ?", (event["id"],))
+                continue
+            start = event["start"]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO events (id, summary, description, start_ts, start_raw) VALUES (?, ?, ?, ?, ?)",
+                (
+                    event["id"],
+                    event.get("summary"),
+                    event.get("description"),
+                    parse_event_time(start),
+                    start.get("dateTime", start.get("date")),
+                ),
+            )
+
+    def upsert(self, events: list):
+        """Adds events written by this client to the store without waiting for the next sync.
+
+        Args:
+            events (list): Event resources as returned by the Calendar API.
+        """
+        with self._lock, self._conn:
+            self._apply(events)
+
+    def _fetch_changes(self, service, sync_token: Optional[str]):
+        """Lists every page of changes since sync_token (all events if None). Returns (events, next_sync_token)."""
+        from device_modules.googlecalendar_manager import iter_event_pages
+
+        list_kwargs = {"calendarId": self.calendar_id, "singleEvents": True}
+        if sync_token is not None:
+            list_kwargs["syncToken"] = sync_token
+        events = []
+        page = {}
+        for page in iter_event_pages(
+            service,
+            fields="items(id,status,summary,description,start),nextPageToken,nextSyncToken",
+            maxResults=2500,
+            **list_kwargs,
+        ):
+            events.extend(page.get("items", []))
+        return events, page.get("nextSyncToken")
+
+    def sync(self, service) -> int:
+        """Brings the store up to date with the calendar.
+        Only the changes since the last sync are downloaded; if the sync token was invalidated by the server (HTTP 410)
+        the store is emptied and every event is downloaded again.
+
+        Args:
+            service (Resource): Google Calendar API service object.
+
+        Returns:
+            int: The number of changed events that were applied.
+        """
+        sync_token = self.sync_token
+        full_resync = sync_token is None
+        # Cleared before listing, so that a change notified during the sync leaves the store marked as changed
+        with self._lock, self._conn:
+            self._set_meta("changed", "0")
+        try:
+            try:
+                events, next_sync_token = self._fetch_changes(service, sync_token)
+            except Exception as e:
+                if resilience.http_status(e) != 410:
+                    raise
+                full_resync = True
+                events, next_sync_token = self._fetch_changes(service, None)
+        except Exception:
+            self.mark_changed()
+            raise
+
+        with self._lock, self._conn:
+            if full_resync:
+                self._conn.execute("DELETE FROM events")
+            self._apply(events)
+            self._set_meta("sync_token", next_sync_token)
+        return len(events)
+
+    def mark_changed(self):
+        """Records that the calendar changed since the last sync, e.g. when a push notification arrives."""
+        with self._lock, self._conn:
+            self._set_meta("changed", "1")
+
+    def set_watched_until(self, expiration: Optional[float]):
+        """Records until when (POSIX timestamp) a watch channel notifies the changes of the calendar; None if none does."""
+        with self._lock, self._conn:
+            self._set_meta("watched_until", None if expiration is None else str(expiration))
+
+    @property
+    def up_to_date(self) -> bool:
+        """True if a watch channel is active and notified no change since the last sync, so syncing can be skipped."""
+        import time
+
+        with self._lock:
+            watched_until = self._get_meta("watched_until")
+            changed = self._get_meta("changed")
+            synced = self._get_meta("sync_token") is not None
+        return synced and changed == "0" and watched_until is not None and float(watched_until) > time.time()
+
+    @staticmethod
+    def _row_to_event(row) -> dict:
+        return {
+            "id": row[0],
+            "summary": row[1],
+            "description": row[2],
+            "start_ts": row[3],
+            "start": row[4],
+        }
+
+    def last_event(
+        self, before: Optional[float] = None, summary_contains: Optional[str] = None
+    ) -> Optional[dict]:
+        """Returns the latest event starting before `before`.
+
+        Args:
+            before (Optional[float], optional): POSIX timestamp. Defaults to now.
+            summary_contains (Optional[str], optional): Only consider events whose summary contains this (case sensitive) string. Defaults to None.
+
+        Returns:
+            Optional[dict]: Stored event with keys id, summary, description, start_ts and start; None if no event matches.
+        """
+        if before is None:
+            before = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        query = "SELECT id, summary, description, start_ts, start_raw FROM events WHERE start_ts < ?"
+        params = [before]
+        if summary_contains is not None:
+            query += " AND instr(summary, ?) > 0"
+            params.append(summary_contains)
+        query += " ORDER BY start_ts DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return None if row is None else self._row_to_event(row)
+
+    def events_between(
+        self, start: float, end: float, summary_contains: Optional[str] = None
+    ) -> list:
+        """Returns the events starting in [start, end), ordered by start time.
+
+        Args:
+            start (float): POSIX timestamp of the start of the window.
+            end (float): POSIX timestamp of the end of the window.
+            summary_contains (Optional[str], optional): Only return events whose summary contains this (case sensitive) string. Defaults to None.
+
+        Returns:
+            list: Stored events with keys id, summary, description, start_ts and start.
+        """
+        query = "SELECT id, summary, description, start_ts, start_raw FROM events WHERE start_ts >= ? AND start_ts < ?"
+        params = [start, end]
+        if summary_contains is not None:
+            query += " AND instr(summary, ?) > 0"
+            params.append(summary_contains)
+        query += " ORDER BY start_ts"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_event(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+
+class IntervalIndex:
+    def __init__(self, intervals=()):
+        """Set of time intervals, merged into sorted disjoint intervals so that lookups are binary searches.
+
+        Args:
+            intervals (Iterable, optional): (start, end) POSIX timestamps; empty and inverted intervals are ignored.
+                Defaults to ().
+        """
+        self.starts = []
+        self.ends = []
+        for start, end in sorted((s, e) for s, e in intervals if e > s):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def overlaps(self, start: float, end: float) -> bool:
+        """True if any interval intersects [start, end)."""
+        # First interval ending after start; it overlaps if it also begins before end
+        i = bisect.bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def first_gap(self, start: float, end: float, duration: float) -> Optional[float]:
+        """Earliest time t in [start, end - duration] such that [t, t + duration) intersects no interval.
+
+        Returns:
+            Optional[float]: POSIX timestamp; None if there is no such gap.
+        """
+        t = start
+        i = bisect.bisect_right(self.ends, t)
+        while t + duration <= end:
+            if i == len(self.starts) or self.starts[i] >= t + duration:
+                return t
+            # [t, t + duration) hits interval i: try right after it
+            t = max(t, self.ends[i])
+            i += 1
+        return None
+
+
+class CalendarSchedule:
+    def __init__(self, busy: IntervalIndex, workouts: IntervalIndex, timezone: str, time_min: float, time_max: float):
+        """Busy times of a user's calendars and their scheduled workouts over [time_min, time_max), in memory.
+        Built by GcalendarManager.schedule; all queries are answered locally.
+
+        Args:
+            busy (IntervalIndex): Busy intervals of every calendar queried.
+            workouts (IntervalIndex): Intervals of the workout events.
+            timezone (str): IANA timezone of the user, in which day hours are interpreted.
+            time_min (float): Start of the period covered, POSIX timestamp.
+            time_max (float): End of the period covered, POSIX timestamp.
+        """
+        self.busy = busy
+        self.workouts = workouts
+        self.tz = ZoneInfo(timezone)
+        self.time_min = time_min
+        self.time_max = time_max
+
+    def has_workout(self, start: datetime.datetime, end: datetime.datetime) -> bool:
+        """True if a workout overlaps the window [start, end) (timezone-aware datetimes)."""
+        return self.workouts.overlaps(start.timestamp(), end.timestamp())
+
+    def first_free_slot(
+        self,
+        after: Optional[datetime.datetime] = None,
+        days: int = 1,
+        duration: datetime.timedelta = datetime.timedelta(hours=1),
+        day_start: datetime.time = datetime.time(7),
+        day_end: datetime.time = datetime.time(21),
+    ) -> Optional[datetime.datetime]:
+        """Earliest start of a free slot of `duration` within the next `days` days, during the user's waking hours.
+
+        Args:
+            after (Optional[datetime.datetime], optional): Timezone-aware earliest start. Defaults to now.
+            days (int, optional): Number of days searched, counting the day of `after`. Defaults to 1.
+            duration (datetime.timedelta, optional): Length of the slot. Defaults to one hour.
+            day_start (datetime.time, optional): Local time before which no slot starts. Defaults to 07:00.
+            day_end (datetime.time, optional): Local time by which the slot must end. Defaults to 21:00.
+
+        Returns:
+            Optional[datetime.datetime]: Start of the slot in the user's timezone; None if every day is full.
+        """
+        if after is None:
+            after = datetime.datetime.now(self.tz)
+        after = after.astimezone(self.tz)
+        for d in range(days):
+            day = after.date() + datetime.timedelta(days=d)
+            # Local wall clock times, so the window follows daylight saving time changes
+            start = max(datetime.datetime.combine(day, day_start, tzinfo=self.tz).timestamp(), after.timestamp())
+            end = datetime.datetime.combine(day, day_end, tzinfo=self.tz).timestamp()
+            start, end = max(start, self.time_min), min(end, self.time_max)
+            slot = self.busy.first_gap(start, end, duration.total_seconds())
+            if slot is not None:
+                return datetime.datetime.fromtimestamp(slot, self.tz)
+        return None
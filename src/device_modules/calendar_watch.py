@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+
+import telemetry
+
+
+@dataclass
+class WatchChannel:
+    """A Calendar API notification channel watching the events of one calendar.
+
+    Attributes:
+        id (str): Channel id, chosen by the client.
+        resource_id (str): Id of the watched resource, returned by the API; needed to stop the channel.
+        token (str): Secret sent back in the X-Goog-Channel-Token header of every notification.
+        calendar_id (str): The watched calendar.
+        expiration (float): POSIX timestamp after which the API stops sending notifications.
+    """
+
+    id: str
+    resource_id: str
+    token: str
+    calendar_id: str
+    expiration: float
+
+
+class NotificationReceiver:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """HTTP endpoint receiving Calendar push notifications, usually behind the HTTPS address registered with the
+        channels (the API only delivers to HTTPS addresses with a valid certificate).
+
+        Notifications of a registered channel carrying its token are acknowledged and passed to the channel's callback;
+        the initial "sync" message of a channel is only acknowledged. Anything else is refused with 403.
+
+        Args:
+            host (str, optional): Interface to listen on. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on; 0 picks a free one. Defaults to 0.
+        """
+        self._lock = threading.Lock()
+        self._channels = {}  # channel id -> (WatchChannel, callback)
+        self.stats = {"notifications": 0, "sync": 0, "rejected": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def register(self, channel: WatchChannel, on_change: Callable[[WatchChannel], None]):
+        """Accepts the notifications of `channel`, calling on_change(channel) for each change."""
+        with self._lock:
+            self._channels[channel.id] = (channel, on_change)
+
+    def unregister(self, channel_id: str):
+        with self._lock:
+            self._channels.pop(channel_id, None)
+
+    def _dispatch(self, headers) -> int:
+        """Handles one notification; returns the HTTP status to answer."""
+        with self._lock:
+            entry = self._channels.get(headers.get("X-Goog-Channel-ID", ""))
+        token = headers.get("X-Goog-Channel-Token", "")
+        if entry is None or not hmac.compare_digest(token.encode(), entry[0].token.encode()):
+            self.stats["rejected"] += 1
+            return 403
+        channel, on_change = entry
+        state = headers.get("X-Goog-Resource-State")
+        if state == "sync":
+            self.stats["sync"] += 1
+            return 200
+        self.stats["notifications"] += 1
+        telemetry.cache_lookup("calendar", "events", "invalidated")
+        on_change(channel)
+        return 200
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                # Notifications have no meaningful body; drain it so the connection can be reused
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    status = receiver._dispatch(self.headers)
+                except Exception as e:
+                    print(f"Calendar notification handling failed: {e!r}")
+                    status = 500
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> NotificationReceiver:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> NotificationReceiver:
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class CalendarWatcher:
+    def __init__(
+        self,
+        gcm,
+        receiver: NotificationReceiver,
+        address: str,
+        state_path: Path | str,
+        ttl: float = 7 * 24 * 3600,
+        renew_before: float = 3600,
+    ):
+        """Keeps a watch channel open on the calendar of a GcalendarManager, so that its event store is only synced
+        after the calendar changed instead of at every lookup.
+
+        Every notification marks the event store as changed. While the channel is open and no change was notified
+        since the last sync, GcalendarManager.sync_event_store doesn't call the API. The channel is persisted to
+        `state_path`, so that a restarted process keeps receiving (and can stop) it.
+
+        Args:
+            gcm (GcalendarManager): Calendar manager with an event store.
+            receiver (NotificationReceiver): Receiver of the notifications.
+            address (str): HTTPS URL at which Google delivers the notifications, forwarded to the receiver.
+            state_path (Path | str): JSON file holding the open channel.
+            ttl (float, optional): Requested channel lifetime in seconds; the API may shorten it. Defaults to 7 days.
+            renew_before (float, optional): Seconds before expiration at which the channel is replaced. Defaults to 3600.
+        """
+        if gcm.event_store is None:
+            raise ValueError("watching a calendar requires an event store")
+        self.gcm = gcm
+        self.receiver = receiver
+        self.address = address
+        self.state_path = Path(state_path)
+        self.ttl = ttl
+        self.renew_before = renew_before
+        self.channel = None
+        if self.state_path.exists():
+            self.channel = WatchChannel(**json.loads(self.state_path.read_text()))
+            if self.channel.calendar_id != gcm.CALENDAR_ID or self.channel.expiration <= time.time():
+                self.channel = None
+            else:
+                self.receiver.register(self.channel, self._on_change)
+                # Notifications sent while no receiver was running are lost
+                self.gcm.event_store.mark_changed()
+                self.gcm.event_store.set_watched_until(self.channel.expiration)
+
+    def _on_change(self, channel: WatchChannel):
+        self.gcm.event_store.mark_changed()
+
+    def _save(self):
+        if self.channel is None:
+            self.state_path.unlink(missing_ok=True)
+            return
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        # The channel token authenticates notifications: readable by the user only, like the credentials
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps(asdict(self.channel)))
+        os.replace(tmp_path, self.state_path)
+
+    def watch(self) -> WatchChannel:
+        """Opens a new channel, then stops the previous one if any, so that no change goes unnotified in between."""
+        body = {
+            "id": uuid.uuid4().hex,
+            "type": "web_hook",
+            "address": self.address,
+            "token": secrets.token_urlsafe(32),
+            "params": {"ttl": str(int(self.ttl))},
+        }
+        # Register first: the API sends a "sync" message as soon as the channel exists
+        pending = WatchChannel(body["id"], "", body["token"], self.gcm.CALENDAR_ID, time.time() + self.ttl)
+        self.receiver.register(pending, self._on_change)
+        try:
+            response = self.gcm.service.events().watch(calendarId=self.gcm.CALENDAR_ID, body=body).execute()
+        except Exception:
+            self.receiver.unregister(pending.id)
+            raise
+        pending.resource_id = response["resourceId"]
+        pending.expiration = int(response["expiration"]) / 1000  # milliseconds
+        previous, self.channel = self.channel, pending
+        self._save()
+        # Changes made before the channel existed were not notified
+        self.gcm.event_store.mark_changed()
+        self.gcm.event_store.set_watched_until(pending.expiration)
+        if previous is not None:
+            self._stop_channel(previous)
+        return pending
+
+    def _stop_channel(self, channel: WatchChannel):
+        self.receiver.unregister(channel.id)
+        try:
+            self.gcm.service.channels().stop(body={"id": channel.id, "resourceId": channel.resource_id}).execute()
+        except Exception as e:
+            # It expires by itself; its notifications are refused meanwhile
+            print(f"Could not stop watch channel {channel.id}: {e!r}")
+
+    def renew_if_due(self) -> bool:
+        """Opens a channel if there is none or the current one expires within renew_before seconds.
+
+        Returns:
+            bool: True if a new channel was opened.
+        """
+        if self.channel is not None and self.channel.expiration - time.time() > self.renew_before:
+            return False
+        self.watch()
+        return True
+
+    def detach(self):
+        """Stops receiving the notifications but leaves the channel open, for a later process to pick it up; the event
+        store is synced at every lookup meanwhile."""
+        if self.channel is not None:
+            self.receiver.unregister(self.channel.id)
+        self.gcm.event_store.set_watched_until(None)
+
+    def stop(self):
+        """Stops the channel; the event store is synced at every lookup again."""
+        if self.channel is not None:
+            self._stop_channel(self.channel)
+            self.channel = None
+            self._save()
+        self.gcm.event_store.set_watched_until(None)
+
+
+def post_notification(url: str, channel: WatchChannel, state: str = "exists", token: Optional[str] = None,
+                      message_number: int = 1) -> int:
+    """Posts a notification like the Calendar API does, e.g. to a NotificationReceiver in tests.
+
+    Args:
+        url (str): Address of the receiver.
+        channel (WatchChannel): Channel the notification belongs to.
+        state (str, optional): X-Goog-Resource-State: "sync", "exists" or "not_exists". Defaults to "exists".
+        token (Optional[str], optional): Token sent instead of the channel's. Defaults to None.
+        message_number (int, optional): X-Goog-Message-Number. Defaults to 1.
+
+    Returns:
+        int: HTTP status of the answer.
+    """
+    import urllib.error
+    import urllib.request
+
+    request = urllib.request.Request(
+        url,
+        data=b"",
+        method="POST",
+        headers={
+            "X-Goog-Channel-ID": channel.id,
+            "X-Goog-Channel-Token": channel.token if token is None else token,
+            "X-Goog-Channel-Expiration": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(channel.expiration)),
+            "X-Goog-Resource-ID": channel.resource_id,
+            "X-Goog-Resource-State": state,
+            "X-Goog-Message-Number": str(message_number),
+        },
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
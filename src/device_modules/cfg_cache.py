@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+
+class CfgCache:
+    def __init__(self, path: Path | str, key_material: str, ttl: float = 3600):
+        """Local, encrypted-at-rest cache of the decoded configuration stored on Google Secret Manager.
+        Entries are keyed by the resource name and etag of the secret version they were read from.
+
+        Args:
+            path (Path | str): Path to the cache file.
+            key_material (str): User specific secret from which the encryption key is derived, e.g. the OAuth refresh token.
+                A cache written with different key material can't be read and is treated as missing.
+            ttl (float, optional): Number of seconds during which an entry is used without revalidation. Defaults to 3600.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        key = hashlib.sha256(key_material.encode("UTF-8")).digest()
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+
+    def load(self) -> Optional[dict]:
+        """Reads the cache entry.
+
+        Returns:
+            Optional[dict]: Entry with keys name, etag, fetched_at and cfg; None if there is no readable entry.
+        """
+        try:
+            token = self.path.read_bytes()
+            return json.loads(self._fernet.decrypt(token))
+        except (OSError, InvalidToken, ValueError):
+            return None
+
+    def save(self, name: str, etag: Optional[str], cfg_dict: dict):
+        """Encrypts and writes a cache entry, replacing the file atomically.
+
+        Args:
+            name (str): Resource name of the secret version, e.g. projects/X/secrets/cfg/versions/3
+            etag (Optional[str]): Etag of the secret version, if known.
+            cfg_dict (dict): The decoded configuration.
+        """
+        entry = {"name": name, "etag": etag, "fetched_at": time.time(), "cfg": cfg_dict}
+        token = self._fernet.encrypt(json.dumps(entry).encode("UTF-8"))
+        tmp_path = self.path.with_suffix(".tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(token)
+        os.replace(tmp_path, self.path)
+
+    def is_fresh(self, entry: dict) -> bool:
+        """Returns True if `entry` was fetched or revalidated less than `ttl` seconds ago."""
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def invalidate(self):
+        """Deletes the cache file."""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import datetime
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+
+import telemetry
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are synchronized
+    fcntl = None
+
+
+class CredentialStore:
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, token_json_path: Path | str):
+        """token.json file shared by every thread and process using the same Google account.
+        Readers and writers coordinate through an exclusive lock on a sibling .lock file.
+        Use for_path to get the process-wide instance of a file, so that the lock is reentrant across callers.
+
+        Args:
+            token_json_path (Path | str): Path to the token.json file.
+        """
+        self.path = Path(token_json_path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+
+    @classmethod
+    def for_path(cls, token_json_path: Path | str) -> CredentialStore:
+        """Returns the process-wide store of the token.json file at `token_json_path`."""
+        key = Path(token_json_path).resolve()
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(key)
+            return cls._instances[key]
+
+    @contextmanager
+    def locked(self):
+        """Holds the store's lock, across threads and processes, for the duration of the with block. Reentrant."""
+        with self._thread_lock:
+            if self._depth == 0:
+                self._lock_file = open(self.lock_path, "a")
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def load(self) -> Optional[Credentials]:
+        """Reads the stored credentials; None if there are none. Call while holding the lock."""
+        from google.oauth2.credentials import Credentials
+
+        if not self.path.exists():
+            return None
+        return Credentials.from_authorized_user_file(self.path)
+
+    def save(self, creds: Credentials):
+        """Atomically replaces the stored credentials. Call while holding the lock."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(creds.to_json())
+        os.replace(tmp_path, self.path)
+
+
+class CredentialRefresher:
+    def __init__(
+        self,
+        creds: Credentials,
+        store: CredentialStore,
+        refresh_margin: float = 600,
+        retry_interval: float = 30,
+    ):
+        """Refreshes `creds` in a background thread ahead of expiry and shares the new token through `store`.
+
+        The new access token is obtained on a separate Credentials object and then copied onto `creds`, so API calls
+        using `creds` are never blocked by a refresh; since the token is renewed before google-auth considers it
+        expired, they never refresh synchronously either. If another thread or process already refreshed the token,
+        it is read from the store instead of being refreshed again.
+
+        Args:
+            creds (Credentials): The credentials used by API clients.
+            store (CredentialStore): Store shared with other threads and processes.
+            refresh_margin (float, optional): Seconds before expiry at which the token is refreshed. Defaults to 600.
+            retry_interval (float, optional): Seconds to wait before retrying a failed refresh. Defaults to 30.
+        """
+        self.creds = creds
+        self.store = store
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.refresh_count = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _seconds_until_refresh(self) -> float:
+        if self.creds.expiry is None:
+            return float("inf")
+        # google-auth stores expiry as a naive UTC datetime
+        remaining = (self.creds.expiry - datetime.datetime.now(datetime.UTC).replace(tzinfo=None)).total_seconds()
+        return remaining - self.refresh_margin
+
+    def _adopt(self, fresh: Credentials):
+        self.creds.token = fresh.token
+        self.creds.expiry = fresh.expiry
+
+    def refresh_if_needed(self):
+        """Refreshes the token now if it expires within the refresh margin."""
+        if self._seconds_until_refresh() > 0:
+            return
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+
+        with self.store.locked():
+            fresh = self.store.load()
+            if (
+                fresh is not None
+                and fresh.expiry is not None
+                and fresh.expiry > self.creds.expiry
+            ):
+                self._adopt(fresh)
+                if self._seconds_until_refresh() > 0:
+                    # Another thread or process refreshed it already
+                    return
+            if fresh is None:
+                fresh = Credentials(
+                    token=self.creds.token,
+                    refresh_token=self.creds.refresh_token,
+                    token_uri=self.creds.token_uri,
+                    client_id=self.creds.client_id,
+                    client_secret=self.creds.client_secret,
+                    scopes=self.creds.scopes,
+                )
+            with telemetry.span("oauth", "token_refresh") as span:
+                span.attrs["background"] = True
+                fresh.refresh(Request())
+            self.store.save(fresh)
+            self._adopt(fresh)
+            self.refresh_count += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_if_needed()
+                self.last_error = None
+                wait = max(self._seconds_until_refresh(), 1)
+            except Exception as e:
+                # Any error, e.g. a corrupt token file, must not end the thread: tokens would silently stop refreshing
+                self.last_error = e
+                wait = self.retry_interval
+            self._stop.wait(min(wait, 3600))
+
+    def start(self):
+        """Starts the background refresh thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="credential-refresher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background refresh thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
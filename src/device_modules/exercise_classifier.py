@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import functools
+import json
+import re
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _singular(word: str) -> str:
+    """Strips common English plural endings, e.g. presses -> press, curls -> curl, flies -> fly."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "ches", "shes", "xes")):
+        return word[:-2]
+    if len(word) > 2 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize(text: str) -> str:
+    """Lower-cases `text`, singularizes every word and joins the words with single spaces.
+    The result is padded with a space on both sides so that patterns can be matched on whole words only.
+
+    Args:
+        text (str): Free text, e.g. a workout description.
+
+    Returns:
+        str: The normalized text.
+    """
+    words = _WORD_RE.findall(text.lower())
+    return " " + " ".join(_singular(w) for w in words) + " "
+
+
+class ExerciseClassifier:
+    def __init__(self, catalog: dict):
+        """Scores free text against categories of exercise keywords in a single pass over the text.
+        The keywords of every category are compiled into one Aho-Corasick automaton, so the cost of scoring is linear in
+        the length of the text plus the number of matches, whatever the size of the catalog.
+
+        Args:
+            catalog (dict): Keywords of every category, e.g. {"push": ["bench press", ...], "pull": ["row", ...]}.
+        """
+        self.categories = list(catalog)
+        # Automaton state: goto transitions, failure link and indices of the categories matched when reaching the state
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for category_index, category in enumerate(self.categories):
+            for keyword in catalog[category]:
+                self._add(normalize(keyword), category_index)
+        self._build_failure_links()
+
+    def _add(self, pattern: str, category_index: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        if category_index not in self._out[state]:
+            self._out[state].append(category_index)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # Patterns ending at the failure state also end here
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def score(self, text: str) -> dict:
+        """Counts keyword matches of every category in `text`.
+
+        Args:
+            text (str): Free text, e.g. a workout description.
+
+        Returns:
+            dict: Number of keyword matches by category.
+        """
+        counts = [0] * len(self.categories)
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for char in normalize(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for category_index in out[state]:
+                counts[category_index] += 1
+        return dict(zip(self.categories, counts))
+
+    def classify(self, text: str, default: Optional[str] = None) -> Optional[str]:
+        """Returns the category with the most keyword matches in `text`, or `default` if there is no unique best category.
+
+        Args:
+            text (str): Free text, e.g. a workout description.
+            default (Optional[str], optional): Returned when no category matched or several categories tie. Defaults to None.
+        """
+        scores = self.score(text)
+        best = max(scores.values(), default=0)
+        winners = [c for c, s in scores.items() if s == best]
+        if best == 0 or len(winners) > 1:
+            return default
+        return winners[0]
+
+    def score_many(self, texts) -> list:
+        """Scores many texts, e.g. a user's whole workout history. See score."""
+        return [self.score(text) for text in texts]
+
+    def classify_many(self, texts, default: Optional[str] = None) -> list:
+        """Classifies many texts, e.g. a user's whole workout history. See classify."""
+        return [self.classify(text, default=default) for text in texts]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_classifier(path: str, mtime: float) -> ExerciseClassifier:
+    with open(path) as f:
+        return ExerciseClassifier(json.load(f))
+
+
+def load_classifier(db_path: Optional[Path | str] = None) -> ExerciseClassifier:
+    """Returns the classifier compiled from the exercise catalog at `db_path`.
+    The catalog is read and compiled once per process, and again only if the file changes.
+
+    Args:
+        db_path (Optional[Path | str], optional): Path to the JSON exercise catalog. Defaults to None, which uses
+            src/exercises.json wherever the process is started from.
+
+    Raises:
+        FileNotFoundError: There is no catalog at `db_path`.
+    """
+    if db_path is None:
+        db_path = Path(__file__).parent.parent / "exercises.json"
+    path = Path(db_path).resolve()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"Exercise catalog {path} not found: it is a JSON object of exercise names by workout type, "
+            'e.g. {"push": ["bench press", ...], "pull": ["barbell row", ...]}'
+        ) from None
+    return _load_classifier(str(path), mtime)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import threading
+
+import resilience
+import telemetry
+
+
+def _counting_http(registry: GoogleServiceRegistry, timeout: float):
+    """Creates a keep-alive httplib2 transport which counts how often an already open connection is reused."""
+    import httplib2
+
+    class CountingHttp(httplib2.Http):
+        def request(self, uri, *args, **kwargs):
+            scheme, authority = httplib2.urlnorm(uri)[:2]
+            registry._count("requests")
+            if scheme + ":" + authority in self.connections:
+                registry._count("connection_reuses")
+            else:
+                registry._count("connections_opened")
+            # Every attempt of a request (e.g. again after a 401 and a token refresh) goes through here
+            span = telemetry.current_span()
+            span.attempts += 1
+            body = kwargs.get("body")
+            if body:
+                span.bytes_sent += len(body)
+            response, content = super().request(uri, *args, **kwargs)
+            span.bytes_received += len(content or b"")
+            return response, content
+
+    return CountingHttp(timeout=timeout)
+
+
+class GoogleServiceRegistry:
+    """Process-wide registry of Google API service objects.
+
+    Service objects are built once per (API, version, credentials) from the static discovery document bundled with
+    google-api-python-client, so no discovery request is made and the document is parsed only once per process.
+    Requests are sent over a keep-alive HTTP transport which is kept per thread (httplib2 is not thread safe) and
+    shared between every service using the same credentials, e.g. between several GcalendarManager instances.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._services = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {
+            "builds": 0,
+            "service_reuses": 0,
+            "requests": 0,
+            "connections_opened": 0,
+            "connection_reuses": 0,
+        }
+
+    @classmethod
+    def default(cls) -> GoogleServiceRegistry:
+        """Returns the registry shared by the whole process."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    @property
+    def stats(self) -> dict:
+        """Counters for service builds, service reuses, requests and HTTP connection reuse."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _thread_http(self, creds):
+        """Returns the authorized keep-alive transport of the calling thread for `creds`."""
+        import google_auth_httplib2
+
+        transports = getattr(self._local, "transports", None)
+        if transports is None:
+            transports = self._local.transports = {}
+        entry = transports.get(id(creds))
+        # Keep a reference to creds so that its id cannot be reused by another object
+        if entry is None or entry[0] is not creds:
+            http = _counting_http(self, self.timeout)
+            entry = (creds, google_auth_httplib2.AuthorizedHttp(creds, http=http))
+            transports[id(creds)] = entry
+        return entry[1]
+
+    def get_service(self, api: str, version: str, creds):
+        """Returns the service object for `api` and `version` authorized with `creds`, building it on first use.
+
+        Args:
+            api (str): Name of the Google API, e.g. "calendar".
+            version (str): Version of the API, e.g. "v3".
+            creds (Credentials): google.oauth2.Credentials using OAuth 2.0 access and refresh tokens.
+
+        Returns:
+            Resource: googleapiclient service object.
+        """
+        key = (api, version, id(creds))
+        with self._lock:
+            entry = self._services.get(key)
+            if entry is not None and entry[0] is creds:
+                self._stats["service_reuses"] += 1
+                return entry[1]
+
+        from googleapiclient.discovery import build
+        from googleapiclient.http import HttpRequest
+
+        class TracedHttpRequest(HttpRequest):
+            def execute(self, http=None, num_retries=0):
+                # Rate limited, retried and circuit broken with every other request to the same API in the process
+                with telemetry.span(api, self.methodId or self.method):
+                    return resilience.call(api, super().execute, http=http, num_retries=num_retries)
+
+        def request_builder(http, *args, **kwargs):
+            # Route every request over the calling thread's keep-alive transport
+            return TracedHttpRequest(self._thread_http(creds), *args, **kwargs)
+
+        service = build(
+            api,
+            version,
+            http=self._thread_http(creds),
+            requestBuilder=request_builder,
+            static_discovery=True,
+            cache_discovery=False,
+        )
+        with self._lock:
+            self._stats["builds"] += 1
+            entry = self._services.setdefault(key, (creds, service))
+            if entry[0] is not creds:
+                entry = self._services[key] = (creds, service)
+        return entry[1]
+
+    def clear(self):
+        """Drops every cached service object. Transports are dropped lazily as threads exit."""
+        with self._lock:
+            self._services.clear()
+        self._local = threading.local()
+
+
+def get_service(api: str, version: str, creds):
+    """Shortcut for GoogleServiceRegistry.default().get_service(api, version, creds)."""
+    return GoogleServiceRegistry.default().get_service(api, version, creds)
@@ -1,63 +1,297 @@
-import google.generativeai as genai
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Optional
+import json
+
+import resilience
+import telemetry
+from lazy_import import lazy_import
 from configurations.config_dataclasses import UserCfg
 from device_modules.identity_manager import IdentityManager
+from device_modules.response_cache import ResponseCache
+
+# Heavy SDK, only loaded when Gemini is actually called (not on response cache hits)
+genai = lazy_import("google.generativeai")
+
+# Schema of the structured workouts requested from Gemini (OpenAPI subset supported by response_schema)
+WORKOUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "exercises": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "weight_kg": {"type": "number"},
+                    "sets": {"type": "integer"},
+                    "reps": {"type": "integer"},
+                },
+                "required": ["name", "weight_kg", "sets", "reps"],
+            },
+        },
+    },
+    "required": ["exercises"],
+}
+
+
+def format_workout(workout: dict) -> str:
+    """Formats a structured workout (see WORKOUT_SCHEMA) like the example workout of the prompt, one exercise per line."""
+    return "\n".join(
+        f"{e['name']}: {e['weight_kg']:g} kg. {e['sets']} sets, {e['reps']} repetitions in each set."
+        for e in workout["exercises"]
+    )
+
+
+@dataclass
+class WorkoutRequest:
+    """A workout to generate in a batch.
+
+    Attributes:
+        caller (GoogleAICaller): Caller of the user the workout is for; provides the user's prompt context.
+        date (datetime.date | datetime.datetime): Day of the workout.
+        workout_type (str): "push" or "pull".
+    """
+
+    caller: GoogleAICaller
+    date: Any
+    workout_type: str
+
+
+@dataclass
+class WorkoutResult:
+    """Outcome of a WorkoutRequest.
+
+    Attributes:
+        request (WorkoutRequest): The request.
+        workout (Optional[dict]): Structured workout (see WORKOUT_SCHEMA); None if the request failed.
+        latency (float): Seconds from sending the request to the complete response, retries included.
+        prompt_tokens (int): Tokens of the prompt.
+        output_tokens (int): Tokens of the response.
+        error (Optional[Exception]): Error of the last attempt; None on success.
+    """
+
+    request: WorkoutRequest
+    workout: Optional[dict] = None
+    latency: float = 0.0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    error: Optional[Exception] = field(default=None, repr=False)
+
+    @property
+    def text(self) -> Optional[str]:
+        """The workout formatted as text for the calendar event description."""
+        return None if self.workout is None else format_workout(self.workout)
+
+
+async def generate_workouts_async(requests: list, max_concurrency: int = 4) -> list:
+    """Generates many structured workouts concurrently with the async Gemini client.
+    At most `max_concurrency` requests are in flight, and every request goes through the process-wide Gemini rate limit.
+
+    The SDK configures its API key for the whole process, so every caller of a batch must use the same key.
+
+    Args:
+        requests (list): WorkoutRequest objects.
+        max_concurrency (int, optional): Maximum number of requests in flight. Defaults to 4.
+
+    Raises:
+        ValueError: The callers of the batch use different API keys.
+
+    Returns:
+        list: One WorkoutResult per request, in input order. Failed requests have their error set instead of raising.
+    """
+    import asyncio
+
+    if len({r.caller.GOOGLE_AI_ID for r in requests}) > 1:
+        raise ValueError("every request of a batch must use the same Google AI API key")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(request):
+        async with semaphore:
+            return await request.caller.generate_structured_async(request.workout_type, request.date)
+
+    return await asyncio.gather(*(run(r) for r in requests))
+
+
+def generate_workouts(requests: list, max_concurrency: int = 4) -> list:
+    """Blocking version of generate_workouts_async, for callers outside of an event loop."""
+    import asyncio
+
+    return asyncio.run(generate_workouts_async(requests, max_concurrency))
 
 
 class GoogleAICaller:
-    def __init__(self, user_id: IdentityManager, usercfg: UserCfg):
+    MODEL_NAME = "gemini-1.5-flash"
+
+    def __init__(
+        self,
+        user_id: IdentityManager,
+        usercfg: UserCfg,
+        response_cache: Optional[ResponseCache] = None,
+        workout_history=None,
+        workout_index=None,
+        context_token_budget: int = 300,
+        count_tokens_remotely: bool = False,
+    ):
+        """Generates workouts with Gemini.
+
+        Args:
+            user_id (IdentityManager): Identity of the user.
+            usercfg (UserCfg): The user's configuration.
+            response_cache (Optional[ResponseCache], optional): Cache of responses to identical prompts. Defaults to None.
+            workout_history (Optional[WorkoutHistory], optional): Past workouts. When it has sessions of the requested
+                type, their progression replaces the baseline weights of the configuration in the prompt. Defaults to None.
+            workout_index (Optional[WorkoutEmbeddingIndex], optional): Embeddings of past workouts. If provided, the type
+                of the last workout is detected from its most similar past workouts, with the keyword detection as a
+                fallback. Defaults to None.
+            context_token_budget (int, optional): Maximum tokens of the history part of the prompt. Defaults to 300.
+            count_tokens_remotely (bool, optional): Check the size of the history part with Gemini's count_tokens instead
+                of only estimating it locally; one extra request when the history changed. Defaults to False.
+        """
         # Public attributes
         self.usercfg = usercfg
         self.user_id = user_id
         self.GOOGLE_AI_ID = usercfg.google_ai_cfg.google_ai_id
-        genai.configure(api_key=self.GOOGLE_AI_ID)
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
+        self._model = None
+        self.response_cache = response_cache
+        self.workout_history = workout_history
+        self.workout_index = workout_index
+        self.prompt_context = None
+        if workout_history is not None:
+            from device_modules.prompt_context import PromptContextBuilder
+
+            self.prompt_context = PromptContextBuilder(
+                workout_history,
+                token_budget=context_token_budget,
+                count_tokens=self.count_tokens if count_tokens_remotely else None,
+            )
+        self.last_batch_results = []
+        self.last_time_to_first_chunk = None
+
+    @property
+    def model(self):
+        """Gemini model, configured on first use."""
+        if self._model is None:
+            genai.configure(api_key=self.GOOGLE_AI_ID)
+            self._model = genai.GenerativeModel(self.MODEL_NAME)
+        return self._model
+
+    def get_response(self, prompt: str, use_cache: bool = True) -> str:
+        """Returns Gemini's response to `prompt`, from the response cache if an identical prompt was answered recently.
 
-    def get_response(self, prompt: str) -> str:
-        response = self.model.generate_content(prompt)
+        Args:
+            prompt (str): The prompt.
+            use_cache (bool, optional): Set to False to always call the model (the response is still cached). Defaults to True.
+        """
+        if self.response_cache is not None and use_cache:
+            cached = self.response_cache.get(self.MODEL_NAME, prompt)
+            telemetry.cache_lookup("gemini", "generate_content", "miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+        with telemetry.span("gemini", "generate_content") as span:
+            span.cache = None if self.response_cache is None or not use_cache else "miss"
+            span.bytes_sent = len(prompt.encode("utf-8"))
+            response = resilience.call("gemini", self.model.generate_content, prompt)
+            span.bytes_received = len(response.text.encode("utf-8"))
+        if self.response_cache is not None:
+            self.response_cache.put(self.MODEL_NAME, prompt, response.text)
         return response.text
 
-    def get_new_workout(self):
-        """Generates a workout using Gemini AI. The prompt is designed to produce a relevant workout."""
+    def stream_response(self, prompt: str, use_cache: bool = True):
+        """Yields Gemini's response to `prompt` in chunks as they are generated.
+        The time from the request to the first chunk is stored in `last_time_to_first_chunk` (seconds).
+        A cached response is yielded as a single chunk; a fully streamed response is added to the cache.
 
-        # Get past workouts from Google Calendar
-        from device_modules.googlecalendar_manager import GcalendarManager
+        Args:
+            prompt (str): The prompt.
+            use_cache (bool, optional): Set to False to always call the model. Defaults to True.
 
-        gcm = GcalendarManager(user_id=self.user_id, usercfg=self.usercfg)
-        last_workout = gcm.get_last_workout()
+        Yields:
+            str: Text chunk.
+        """
+        import time
 
-        # Handle the case for the first time generating a workout
-        no_last_workout = False
-        if last_workout is None or last_workout == "":
-            no_last_workout = True
-
-        # Identify the type of the most recent workout (push OR pull) by similarity search with database
-        # For now, similarity is measured by keyword frequency counts. A cosine similarity metric from a vector embedding would be more sophisticated.
-        if not no_last_workout:
-            import json
-
-            db_path = "src/exercises.json"
-            with open(db_path) as f:
-                exercise_db = json.load(f)
-            push_score, pull_score = 0, 0
-            for kw in exercise_db["push"]:
-                push_score += last_workout.count(kw)
-            for kw in exercise_db["pull"]:
-                pull_score += last_workout.count(kw)
-            if push_score > pull_score:
-                workout_type = "push"
-            else:
-                workout_type = "pull"
+        start = time.perf_counter()
+        self.last_time_to_first_chunk = None
+        if self.response_cache is not None and use_cache:
+            cached = self.response_cache.get(self.MODEL_NAME, prompt)
+            telemetry.cache_lookup("gemini", "stream_generate_content", "miss" if cached is None else "hit")
+            if cached is not None:
+                self.last_time_to_first_chunk = time.perf_counter() - start
+                yield cached
+                return
+
+        chunks = []
+        # The span stays open while the caller consumes the chunks, so it measures the whole stream. It is detached from
+        # the thread's current span, since the caller runs (and may open spans) between two chunks.
+        with telemetry.span("gemini", "stream_generate_content", detached=True) as span:
+            span.bytes_sent = len(prompt.encode("utf-8"))
+            # Only opening the stream is retried; chunks already yielded can't be taken back. Its own span, closed
+            # before the first chunk is yielded, counts the retries.
+            with telemetry.span("gemini", "stream_generate_content.open"):
+                stream = resilience.call("gemini", self.model.generate_content, prompt, stream=True)
+            for chunk in stream:
+                if self.last_time_to_first_chunk is None:
+                    self.last_time_to_first_chunk = time.perf_counter() - start
+                    span.attrs["time_to_first_chunk"] = self.last_time_to_first_chunk
+                chunks.append(chunk.text)
+                span.bytes_received += len(chunk.text.encode("utf-8"))
+                yield chunk.text
+        if self.response_cache is not None:
+            self.response_cache.put(self.MODEL_NAME, prompt, "".join(chunks))
+
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens of `text` for the model, counted by Gemini."""
+        with telemetry.span("gemini", "count_tokens"):
+            return resilience.call("gemini", self.model.count_tokens, text).total_tokens
+
+    @staticmethod
+    def _detect_workout_type(last_workout: str) -> str:
+        """Identifies the type of a workout (push OR pull) by similarity search with the exercise database.
+
+        Args:
+            last_workout (str): Description of the workout.
+
+        Returns:
+            str: "push" or "pull".
+
+        Raises:
+            FileNotFoundError: The exercise catalog, src/exercises.json, is missing.
+        """
+        # Similarity is measured by keyword frequency counts; see WorkoutEmbeddingIndex for cosine similarity with past workouts
+        from device_modules.exercise_classifier import load_classifier
+
+        scores = load_classifier().score(last_workout)
+        if scores.get("push", 0) > scores.get("pull", 0):
+            return "push"
         else:
-            workout_type = "push"
-        # Retrieve user's strength information to provide as context to LLM
-        bp_weight = self.usercfg.baseline_weights_cfg.bp_weight
-        sq_weight = self.usercfg.baseline_weights_cfg.sq_weight
-        dl_weight = self.usercfg.baseline_weights_cfg.dl_weight
+            return "pull"
+
+    def build_prompt(self, workout_type: str) -> str:
+        """Builds the prompt asking for a workout of type `workout_type`.
 
+        Args:
+            workout_type (str): "push" or "pull".
+
+        Returns:
+            str: The prompt.
+        """
         # Build prompt
         prompt = "Generate a workout plan incorporating three weight lifting exercises. The plan should include the name of the exercise, the weight to lift, the number of sets to perform, and the number of repeitions in each set."
         prompt += f" The workout should be a {workout_type}-type workout, meaning that it should incorporate exercises that require {workout_type}ing motions."
-        prompt += f""" For context, the following are reasonable weights for some example exercises:
+
+        # Provide the user's strength information as context to the LLM: their training history (within a token
+        # budget) if it is known, otherwise the baseline weights of the configuration
+        history_context = None
+        if self.prompt_context is not None:
+            history_context = self.prompt_context.build(workout_type)
+        if history_context is not None:
+            prompt += " " + history_context
+        else:
+            bp_weight = self.usercfg.baseline_weights_cfg.bp_weight
+            sq_weight = self.usercfg.baseline_weights_cfg.sq_weight
+            dl_weight = self.usercfg.baseline_weights_cfg.dl_weight
+            prompt += f""" For context, the following are reasonable weights for some example exercises:
             Bench Press: {bp_weight} kg.
             Squat: {sq_weight} kg.
             Deadlift: {dl_weight} kg."""
@@ -68,5 +302,123 @@ class GoogleAICaller:
         Shoulder press: 15 kg. 3 sets, 8 repetions in each set.
         Tricep extensions: 5 kg. 5 sets, 5 repetions in each set.
         """
+        return prompt
+
+    def build_structured_prompt(self, workout_type: str, date=None) -> str:
+        """Builds the prompt asking for a workout of type `workout_type` as JSON (see WORKOUT_SCHEMA).
+
+        Args:
+            workout_type (str): "push" or "pull".
+            date (datetime.date, optional): Day of the workout, mentioned so that the workouts of a batch differ. Defaults to None.
+        """
+        prompt = self.build_prompt(workout_type)
+        if date is not None:
+            prompt += f"\nThe workout is for {date:%A %B %d, %Y}."
+        prompt += "\nAnswer with the exercises of the workout only, as JSON; weights are in kilograms."
+        return prompt
+
+    async def generate_structured_async(self, workout_type: str, date=None) -> WorkoutResult:
+        """Generates one structured workout with the async Gemini client, constrained to WORKOUT_SCHEMA.
+
+        Args:
+            workout_type (str): "push" or "pull".
+            date (datetime.date, optional): Day of the workout. Defaults to None.
 
-        return self.get_response(prompt=prompt)
+        Returns:
+            WorkoutResult: The workout, or the error, with the latency and token counts of the request.
+        """
+        import time
+
+        result = WorkoutResult(request=WorkoutRequest(self, date, workout_type))
+        prompt = self.build_structured_prompt(workout_type, date)
+        generation_config = {
+            "response_mime_type": "application/json",
+            "response_schema": WORKOUT_SCHEMA,
+        }
+        start = time.perf_counter()
+        try:
+            with telemetry.span("gemini", "generate_content_async") as span:
+                span.bytes_sent = len(prompt.encode("utf-8"))
+                response = await resilience.get_upstream("gemini").call_async(
+                    self.model.generate_content_async,
+                    prompt,
+                    generation_config=generation_config,
+                )
+                span.bytes_received = len(response.text.encode("utf-8"))
+                usage = response.usage_metadata
+                result.prompt_tokens = usage.prompt_token_count
+                result.output_tokens = usage.candidates_token_count
+                span.attrs["prompt_tokens"] = result.prompt_tokens
+                span.attrs["output_tokens"] = result.output_tokens
+            result.workout = json.loads(response.text)
+        except Exception as e:
+            result.error = e
+        result.latency = time.perf_counter() - start
+        return result
+
+    def _last_workout_type(self, gcm=None) -> str:
+        """Looks up the last workout in Google Calendar and returns its type ("push" if there is none)."""
+        if gcm is None:
+            from device_modules.googlecalendar_manager import GcalendarManager
+
+            gcm = GcalendarManager(user_id=self.user_id, usercfg=self.usercfg)
+        event_dict = gcm.get_last_workout_event()
+        if event_dict is None:
+            return self._workout_type_after(None)
+        return self._workout_type_after(event_dict.get("description"), event_dict.get("id"))
+
+    def _workout_type_after(self, last_workout: Optional[str], last_workout_id: Optional[str] = None) -> str:
+        """Returns the type of workout to generate given the description of the last workout, and its event id so that
+        the workout index leaves it out of the vote on its own type."""
+        # Handle the case for the first time generating a workout
+        if last_workout is None or last_workout == "":
+            return "push"
+        if self.workout_index is not None:
+            workout_type = self.workout_index.detect_workout_type(last_workout, exclude_id=last_workout_id)
+            if workout_type is not None:
+                return workout_type
+        return self._detect_workout_type(last_workout)
+
+    def get_new_workout(self, gcm=None):
+        """Generates a workout using Gemini AI. The prompt is designed to produce a relevant workout.
+
+        Args:
+            gcm (GcalendarManager, optional): Calendar manager used to look up past workouts. A new one is created if not provided.
+        """
+        workout_type = self._last_workout_type(gcm)
+        return self.get_response(prompt=self.build_prompt(workout_type))
+
+    def get_workout_after(self, last_workout: Optional[str], last_workout_id: Optional[str] = None) -> str:
+        """Generates a workout like get_new_workout, given the already fetched description of the last workout.
+        The response is streamed (see stream_response), so the time to its first chunk is recorded in
+        `last_time_to_first_chunk` and in the trace of the request.
+
+        Args:
+            last_workout (Optional[str]): Description of the last workout; None if there is none.
+            last_workout_id (Optional[str], optional): Event id of the last workout. Defaults to None.
+        """
+        workout_type = self._workout_type_after(last_workout, last_workout_id)
+        return "".join(self.stream_response(prompt=self.build_prompt(workout_type)))
+
+    def plan_workout_block(self, start_times: list, gcm=None, max_concurrency: int = 4) -> list:
+        """Generates one workout per start time. The first workout is chosen like in get_new_workout, the following ones alternate between push and pull.
+        The workouts are generated concurrently, as structured JSON (see generate_workouts). A workout which couldn't be
+        generated doesn't prevent scheduling the others: it is left out of the returned list, and its error is kept in
+        last_batch_results with the outcome of every start time.
+
+        Args:
+            start_times (list): Timezone-aware datetimes at which the workouts will be scheduled.
+            gcm (GcalendarManager, optional): Calendar manager used to look up past workouts. A new one is created if not provided.
+            max_concurrency (int, optional): Maximum number of requests in flight. Defaults to 4.
+
+        Returns:
+            list: List of (start, workout_info) tuples of the generated workouts, ready for
+                GcalendarManager.create_workout_events.
+        """
+        workout_type = self._last_workout_type(gcm)
+        requests = []
+        for start in start_times:
+            requests.append(WorkoutRequest(self, start, workout_type))
+            workout_type = "pull" if workout_type == "push" else "push"
+        self.last_batch_results = generate_workouts(requests, max_concurrency)
+        return [(r.request.date, r.text) for r in self.last_batch_results if r.error is None]
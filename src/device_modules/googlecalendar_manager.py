@@ -1,17 +1,102 @@
+from __future__ import annotations
+from typing import Optional
+
+import resilience
+import telemetry
 from configurations.config_dataclasses import UserCfg
 from device_modules.identity_manager import IdentityManager
+from device_modules.calendar_event_store import CalendarEventStore, parse_event_time
+
+# Length of a workout event
+WORKOUT_SECONDS = 3600
+
+
+def iter_event_pages(service, fields: Optional[str] = None, **list_kwargs):
+    """Requests pages of events().list(**list_kwargs) with gzip compression, following nextPageToken.
+
+    Args:
+        service (Resource): Google Calendar API service object.
+        fields (Optional[str], optional): Partial-response field mask for the whole page; must include nextPageToken
+            for pagination to work. Defaults to None.
+
+    Yields:
+        dict: One page of the events().list response.
+    """
+    if fields is not None:
+        list_kwargs["fields"] = fields
+    page_token = None
+    while True:
+        if page_token is not None:
+            list_kwargs["pageToken"] = page_token
+        request = service.events().list(**list_kwargs)
+        # Google APIs only compress responses if the user agent also mentions gzip.
+        # googleapiclient's JsonModel normally sets both headers; make sure they are present.
+        request.headers.setdefault("accept-encoding", "gzip, deflate")
+        user_agent = request.headers.get("user-agent", "")
+        if "gzip" not in user_agent:
+            request.headers["user-agent"] = (user_agent + " (gzip)").strip()
+        page = request.execute()
+        yield page
+        page_token = page.get("nextPageToken")
+        if page_token is None:
+            return
 
 
 class GcalendarManager:
-    def __init__(self, user_id: IdentityManager, usercfg: UserCfg):
+    def __init__(
+        self,
+        user_id: IdentityManager,
+        usercfg: UserCfg,
+        event_store: Optional[CalendarEventStore] = None,
+        journal=None,
+        offline_first: bool = False,
+    ):
         """Manages accessing and creating events in user's Google calendar as well as checking for scheduled workouts.
 
         Args:
-            creds (Credentials): google.oauth2.Credentials using OAuth 2.0 access and refresh tokens.
+            user_id (IdentityManager): Identity of the user whose calendar is managed.
+            usercfg (UserCfg): The user's configuration.
+            event_store (Optional[CalendarEventStore], optional): Local incrementally synced copy of the calendar.
+                If provided, workout lookups are answered from the store after a delta sync instead of listing events. Defaults to None.
+            journal (Optional[WriteJournal], optional): Durable queue of inserts. If provided, create_workout_event queues
+                the event and returns at once; a JournalFlusher (see flusher) inserts it. Defaults to None.
+            offline_first (bool, optional): Answer workout lookups from the event store as last synced, without syncing
+                it first; sync_event_store(force=True) brings it up to date. Defaults to False.
         """
         self.user_id = user_id
         self.cfg = usercfg
         self.CALENDAR_ID = self.cfg.google_calendar_cfg.calender_id
+        self.event_store = event_store
+        self.journal = journal
+        self.offline_first = offline_first
+        self._event_store_synced = False
+
+    @property
+    def service(self):
+        """Google Calendar API service object, shared with every other GcalendarManager using the same credentials."""
+        from device_modules.google_service_registry import get_service
+
+        return get_service("calendar", "v3", self.user_id.creds)
+
+    def sync_event_store(self, force: bool = False):
+        """Applies the calendar changes since the last sync to the local event store. Syncs at most once per
+        GcalendarManager unless `force` is set, since events created through this object are added to the store directly.
+
+        Args:
+            force (bool, optional): Sync even if the store was already synced by this object. Defaults to False.
+        """
+        if self.event_store is None:
+            return
+        if self.offline_first and not force:
+            return
+        if not force and self.event_store.up_to_date:
+            # A watch channel (see CalendarWatcher) reported no change since the last sync
+            telemetry.cache_lookup("calendar", "events", "hit")
+            self._event_store_synced = True
+            return
+        if force or not self._event_store_synced:
+            self.event_store.sync(self.service)
+            self._event_store_synced = True
 
     @staticmethod
     def _summarize_events(events_result):
@@ -24,100 +109,275 @@ class GcalendarManager:
         for es in event_summaries:
             print(es)
 
-    def list_events(self, n_events, future=True):
+    def iter_events(
+        self,
+        future: bool = True,
+        fields: Optional[str] = None,
+        page_size: int = 250,
+        time_limit: Optional[str] = None,
+    ):
+        """Streams events from Google Calendar page by page, ordered by start time.
+        Pages are only requested as the generator is consumed, so callers can stop early once they have what they need.
+
+        Args:
+            future (bool, optional): If True then streams upcoming events; if False then streams past events. Defaults to True.
+            fields (Optional[str], optional): Partial-response field mask for the event resources, e.g. "summary,start".
+                Defaults to None, which returns full event resources.
+            page_size (int, optional): Number of events requested per page. Defaults to 250 (the API maximum is 2500).
+            time_limit (Optional[str], optional): RFC3339 timestamp bounding the other side of the window
+                (latest start for future events, earliest start for past events). Defaults to None.
+
+        Yields:
+            dict: Event resource.
+        """
+        import datetime
+
+        now = datetime.datetime.now(datetime.UTC).isoformat()
+        list_kwargs = {
+            "calendarId": self.CALENDAR_ID,
+            "singleEvents": True,
+            "orderBy": "startTime",
+        }
+        if future:
+            list_kwargs.update({"timeMin": now, "timeMax": time_limit})
+        else:
+            list_kwargs.update({"timeMin": time_limit, "timeMax": now})
+        list_kwargs = {k: v for k, v in list_kwargs.items() if v is not None}
+
+        page_fields = None if fields is None else f"items({fields}),nextPageToken"
+        for page in iter_event_pages(
+            self.service, fields=page_fields, maxResults=page_size, **list_kwargs
+        ):
+            yield from page.get("items", [])
+
+    def list_events(self, n_events, future=True, fields: Optional[str] = None):
         """List events in Google Calendar. Can be either past events or future events (defaults to future events).
 
         Args:
-            n_events (_type_): The maximum number of events to retrieve.
+            n_events (int): The maximum number of events to retrieve. Pages are followed until this many events are collected.
             future (bool, optional): If True then lists upcoming events; if False then lists past events. Defaults to True.
+            fields (Optional[str], optional): Partial-response field mask for the event resources. Defaults to None.
 
         Returns:
-            list: List of events
+            dict: Dictionary with the list of events under "items"
+        """
+        import itertools
+
+        events = self.iter_events(
+            future=future, fields=fields, page_size=min(n_events, 2500)
+        )
+        return {"items": list(itertools.islice(events, n_events))}
+
+    def check_for_workout(self, end_check_time: int = 24, schedule=None) -> bool:
+        """Checks to see if a workout is scheduled between now and `end_check_time`.
+
+        Args:
+            end_check_time (int, optional): number of hours into the future to check for a scheduled workout. Defaults to 24.
+            schedule (Optional[CalendarSchedule], optional): Schedule covering the window, answered from without any
+                request; a workout still in progress counts. Defaults to None, which looks up the workouts starting in
+                the window.
+
+        Returns:
+            bool: True if a workout is scheduled in the window.
         """
         import datetime
-        from googleapiclient.discovery import build
 
-        # Instantiate Google Calendar API
-        gcalendar_service = build("calendar", "v3", credentials=self.user_id.creds)
-        now = (
-            datetime.datetime.now(datetime.UTC).isoformat()
-        )  # online documentation uses deprecated datetime method; code updated
+        now = datetime.datetime.now(datetime.timezone.utc)
+        end = now + datetime.timedelta(hours=end_check_time)
+        if schedule is not None:
+            return schedule.has_workout(now, end)
+        if self.event_store is not None:
+            self.sync_event_store()
+            workouts = self.event_store.events_between(
+                now.timestamp(), end.timestamp(), summary_contains="WORKOUT"
+            )
+            return len(workouts) > 0
 
-        if future:
-            events_result = (
-                gcalendar_service.events()
-                .list(
-                    calendarId=self.CALENDAR_ID,
-                    timeMin=now,
-                    maxResults=n_events,
-                    singleEvents=True,
-                    orderBy="startTime",
-                )
-                .execute()
+        events = self.iter_events(
+            fields="summary,start", page_size=50, time_limit=end.isoformat()
+        )
+        return self._contains_workout(events, end.timestamp())
+
+    def schedule(self, days: int = 1, calendar_ids: Optional[list] = None):
+        """Fetches the busy times of the user's calendars and their workouts from now to `days` days ahead, for local
+        queries (see CalendarSchedule). The busy times of every calendar come from a single freeBusy query.
+
+        Args:
+            days (int, optional): Number of days covered. Defaults to 1.
+            calendar_ids (Optional[list], optional): Calendars whose events make the user busy.
+                Defaults to None, which queries the workout calendar and the user's primary calendar.
+
+        Returns:
+            CalendarSchedule: The schedule over the period.
+        """
+        import datetime
+        from device_modules.calendar_schedule import CalendarSchedule, IntervalIndex
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        end = now + datetime.timedelta(days=days)
+        if calendar_ids is None:
+            calendar_ids = list(dict.fromkeys([self.CALENDAR_ID, "primary"]))
+        response = (
+            self.service.freebusy()
+            .query(
+                body={
+                    "timeMin": now.isoformat(),
+                    "timeMax": end.isoformat(),
+                    "timeZone": "UTC",
+                    "items": [{"id": calendar_id} for calendar_id in calendar_ids],
+                }
             )
-        else:
-            events_result = (
-                gcalendar_service.events()
-                .list(
-                    calendarId=self.CALENDAR_ID,
-                    timeMax=now,
-                    maxResults=n_events,
-                    singleEvents=True,
-                    orderBy="startTime",
+            .execute()
+        )
+        busy = []
+        for calendar_id, calendar in response.get("calendars", {}).items():
+            if calendar.get("errors"):
+                # e.g. notFound for a calendar the user can't see; its busy times are unknown
+                print(f"Free/busy of calendar {calendar_id} unavailable: {calendar['errors']}")
+            for interval in calendar.get("busy", []):
+                busy.append(
+                    (
+                        parse_event_time({"dateTime": interval["start"]}),
+                        parse_event_time({"dateTime": interval["end"]}),
+                    )
                 )
-                .execute()
+
+        # Workouts which started before now may still be in progress
+        window_start = now.timestamp() - WORKOUT_SECONDS
+        if self.event_store is not None:
+            self.sync_event_store()
+            starts = [
+                e["start_ts"]
+                for e in self.event_store.events_between(window_start, end.timestamp(), summary_contains="WORKOUT")
+            ]
+        else:
+            pages = iter_event_pages(
+                self.service,
+                fields="items(summary,start),nextPageToken",
+                maxResults=250,
+                calendarId=self.CALENDAR_ID,
+                singleEvents=True,
+                orderBy="startTime",
+                q="WORKOUT",
+                timeMin=datetime.datetime.fromtimestamp(window_start, datetime.timezone.utc).isoformat(),
+                timeMax=end.isoformat(),
             )
-        return events_result
+            starts = [
+                parse_event_time(e["start"])
+                for page in pages
+                for e in page.get("items", [])
+                if "WORKOUT" in e.get("summary", "")
+            ]
+        workouts = IntervalIndex((start, start + WORKOUT_SECONDS) for start in starts)
 
-    def check_for_workout(self, end_check_time: int = 24) -> bool:
-        """Checks to see if a workout is scheduled between now and `end_check_time`.
+        return CalendarSchedule(
+            IntervalIndex(busy), workouts, self.cfg.timezone_cfg.timezone, now.timestamp(), end.timestamp()
+        )
+
+    def find_free_slot(self, days: int = 1, schedule=None, **kwargs):
+        """Start of the first free one hour slot of the user's calendars within the next `days` days.
 
         Args:
-            end_check_time (int, optional): number of hours into the future to check for a scheduled workout. Defaults to 24.
+            days (int, optional): Number of days searched. Defaults to 1.
+            schedule (Optional[CalendarSchedule], optional): Schedule to search, covering those days. Defaults to None,
+                which fetches it (see schedule).
+            **kwargs: Passed to CalendarSchedule.first_free_slot, e.g. day_start and day_end.
 
         Returns:
-            bool: _description_
+            Optional[datetime.datetime]: Start of the slot in the user's timezone; None if there is no free slot.
         """
         import datetime
 
-        events_result = self.list_events(
-            end_check_time * 2
-        )  # Reasonable to guess that this is enough events to get.
-        events = events_result.get("items", [])
+        if schedule is None:
+            schedule = self.schedule(days)
+        kwargs.setdefault("duration", datetime.timedelta(seconds=WORKOUT_SECONDS))
+        # The next `days` days span one more calendar day; the end of the schedule bounds the last one
+        return schedule.first_free_slot(days=days + 1, **kwargs)
 
-        if not events:
-            return False
-        else:
-            for event in events:
-                start = event["start"].get("dateTime", event["start"].get("date"))
-                time_diff = start - datetime.datetime.now()
-                if time_diff.days * 24 + time_diff.seconds / 3600 >= end_check_time:
-                    break
-                else:
-                    if "WORKOUT" in event.get("summary"):
-                        return True
+    @staticmethod
+    def _contains_workout(events, end_ts: float) -> bool:
+        """Checks events ordered by start time for a workout starting before `end_ts`, stopping at the first event past it.
+
+        Args:
+            events (Iterable): Event resources ordered by start time.
+            end_ts (float): POSIX timestamp of the end of the window.
+        """
+        for event in events:
+            if parse_event_time(event["start"]) >= end_ts:
+                break
+            if "WORKOUT" in event.get("summary", ""):
+                return True
         return False  # If True has not been returned, no workouts scheduled
 
-    def get_last_workout(self) -> str:
-        """Finds the last workout in the calendar and returns a description of the event."""
-        event_list = self.list_events(n_events=250, future=False)
-        event_dict = event_list.get("items", [])[-1]
-        return event_dict["description"]
+    def get_last_workout(self, lookback_days: int = 30, max_lookback_days: int = 3 * 365) -> str:
+        """Finds the last workout in the calendar and returns a description of the event. See get_last_workout_event."""
+        event_dict = self.get_last_workout_event(lookback_days, max_lookback_days)
+        return None if event_dict is None else event_dict.get("description")
 
-    def create_workout_event(self, workout_info: str):
-        from googleapiclient.discovery import build
+    def get_last_workout_event(self, lookback_days: int = 30, max_lookback_days: int = 3 * 365) -> Optional[dict]:
+        """Finds the last workout in the calendar.
+
+        Without an event store, past events can only be listed oldest first, so the last `lookback_days` days are
+        listed; the window is only widened further back, doubling each time, while it holds no workout.
+
+        Args:
+            lookback_days (int, optional): Days listed by the first request. Defaults to 30.
+            max_lookback_days (int, optional): Days after which the search gives up. Defaults to 3 years.
+
+        Returns:
+            Optional[dict]: The event, with at least its id and description; None if there is none.
+        """
+        import datetime
+
+        if self.event_store is not None:
+            self.sync_event_store()
+            return self.event_store.last_event(summary_contains="WORKOUT")
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        window_end, lookback = now, datetime.timedelta(days=lookback_days)
+        while window_end > now - datetime.timedelta(days=max_lookback_days):
+            window_start = max(now - lookback, now - datetime.timedelta(days=max_lookback_days))
+            event_dict = None
+            for page in iter_event_pages(
+                self.service,
+                fields="items(id,summary,description,start),nextPageToken",
+                calendarId=self.CALENDAR_ID,
+                singleEvents=True,
+                orderBy="startTime",
+                q="WORKOUT",
+                timeMin=window_start.isoformat(),
+                timeMax=window_end.isoformat(),
+                maxResults=2500,
+            ):
+                for event in page.get("items", []):
+                    if "WORKOUT" in event.get("summary", ""):
+                        event_dict = event
+            if event_dict is not None:
+                return event_dict
+            # Only the older part is listed again
+            window_end, lookback = window_start, lookback * 2
+        return None
+
+    def _build_workout_event(self, workout_info: str, start=None) -> dict:
+        """Builds the body of a one hour workout event.
+
+        Args:
+            workout_info (str): Description of the workout.
+            start (datetime.datetime, optional): Timezone-aware start of the workout. Defaults to now.
+
+        Returns:
+            dict: Event resource to insert.
+        """
         import datetime
 
         local_timezone = self.cfg.timezone_cfg.timezone  # Formatted as IANA timezone
-        start_time = datetime.datetime.now(
-            datetime.timezone.utc
-        ).isoformat()  # formatted according to RFC3339
-        end_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
-            seconds=3600
-        )
+        if start is None:
+            start = datetime.datetime.now(datetime.timezone.utc)
+        start_time = start.isoformat()  # formatted according to RFC3339
+        end_time = start + datetime.timedelta(seconds=WORKOUT_SECONDS)
         end_time = end_time.isoformat()  # formatted according to RFC3339
 
-        new_workout_event = {
+        return {
             "summary": "WORKOUT",
             "description": workout_info,
             "start": {
@@ -130,15 +390,152 @@ class GcalendarManager:
             },
         }
 
-        # Instantiate Google Calendar API
-        gcalendar_service = build("calendar", "v3", credentials=self.user_id.creds)
+    def insert_event(self, calendar_id: str, body: dict) -> dict:
+        """Inserts event `body`, which has a client generated id, in calendar `calendar_id`.
+        A conflict on the id means that an earlier attempt whose response was lost succeeded, and counts as a success.
 
-        event = (
-            gcalendar_service.events()
-            .insert(
-                calendarId=self.cfg.google_calendar_cfg.calender_id,
-                body=new_workout_event,
-            )
-            .execute()
-        )
+        Returns:
+            dict: The inserted event resource.
+        """
+        try:
+            return self.service.events().insert(calendarId=calendar_id, body=body).execute()
+        except Exception as e:
+            if resilience.http_status(e) != 409:
+                raise
+            # Inserted by an earlier attempt whose response was lost
+            return body
+
+    def create_workout_event(self, workout_info: str, start=None):
+        """Inserts a one hour workout event in the calendar, or queues it in the journal if there is one.
+        The event gets a client generated id, so that an insert retried after a lost response can't create a duplicate.
+
+        Args:
+            workout_info (str): Description of the workout.
+            start (datetime.datetime, optional): Timezone-aware start of the workout. Defaults to now.
+        """
+        import uuid
+
+        new_workout_event = self._build_workout_event(workout_info, start=start)
+        new_workout_event["id"] = uuid.uuid4().hex  # hex digits are valid base32hex event ids
+
+        if self.journal is not None:
+            self.journal.append(self.CALENDAR_ID, new_workout_event)
+            event = new_workout_event
+        else:
+            event = self.insert_event(self.CALENDAR_ID, new_workout_event)
         print(event)
+        if self.event_store is not None:
+            # Visible to the next lookups even before a queued insert is flushed
+            self.event_store.upsert([event])
+        return event
+
+    def flusher(self, interval: float = 30):
+        """JournalFlusher inserting the events queued in this object's journal. Events whose insert fails permanently
+        are removed from the event store again.
+
+        Args:
+            interval (float, optional): Seconds between two passes when nothing is queued. Defaults to 30.
+        """
+        from device_modules.write_journal import JournalFlusher
+
+        def insert(calendar_id, body):
+            try:
+                return self.insert_event(calendar_id, body)
+            except Exception as e:
+                retryable, _ = resilience.classify_error(e)
+                if not retryable and self.event_store is not None and not isinstance(e, resilience.CircuitOpenError):
+                    self.event_store.upsert([{"id": body["id"], "status": "cancelled"}])
+                raise
+
+        return JournalFlusher(self.journal, insert, interval=interval)
+
+    def create_workout_events(
+        self,
+        workouts: list,
+        batch_uri: Optional[str] = None,
+        max_retries: int = 3,
+        batch_size: int = 50,
+    ) -> list:
+        """Inserts many workout events using the Calendar batch endpoint, a few HTTP requests for the whole list.
+        Sub-requests which fail with a transient error (see resilience.classify_error) are retried, and only those, with
+        jittered exponential backoff; other failures are reported at once. Every sub-request
+        counts against the Calendar rate limit shared by the process. Every event gets a client
+        generated id, so a retried insert which had in fact succeeded is reported as a conflict instead of creating a duplicate.
+        A batch request which fails as a whole, after the retries of the Calendar upstream, counts as a failed attempt
+        of each of its inserts; it doesn't raise.
+
+        Args:
+            workouts (list): List of (start, workout_info) tuples, start being a timezone-aware datetime.
+            batch_uri (Optional[str], optional): Batch endpoint to use instead of the Calendar API one, e.g. a local stand-in. Defaults to None.
+            max_retries (int, optional): Number of times failed sub-requests are retried. Defaults to 3.
+            batch_size (int, optional): Maximum number of sub-requests per batch request. Defaults to 50.
+
+        Returns:
+            list: One dict per workout, in input order, with keys "event" (inserted event resource or None),
+                "error" (exception of the last attempt or None) and "attempts".
+        """
+        import time
+        import uuid
+        bodies = []
+        for start, workout_info in workouts:
+            body = self._build_workout_event(workout_info, start=start)
+            body["id"] = uuid.uuid4().hex  # hex digits are valid base32hex event ids
+            bodies.append(body)
+        results = [{"event": None, "error": None, "attempts": 0} for _ in bodies]
+
+        def callback(request_id, response, exception):
+            result = results[int(request_id)]
+            result["attempts"] += 1
+            if exception is None:
+                result["event"], result["error"] = response, None
+            elif resilience.http_status(exception) == 409:
+                # Inserted by an earlier attempt whose response was lost
+                result["event"], result["error"] = bodies[int(request_id)], None
+            else:
+                result["error"] = exception
+
+        upstream = resilience.get_upstream("calendar")
+        pending = list(range(len(bodies)))
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                retry_after = max(
+                    (resilience.classify_error(results[i]["error"])[1] or 0 for i in pending),
+                    default=0,
+                )
+                time.sleep(upstream.retry_policy.delay(attempt, retry_after or None))
+            for i in range(0, len(pending), batch_size):
+                if batch_uri is None:
+                    batch = self.service.new_batch_http_request(callback=callback)
+                else:
+                    from googleapiclient.http import BatchHttpRequest
+
+                    batch = BatchHttpRequest(callback=callback, batch_uri=batch_uri)
+                for index in pending[i : i + batch_size]:
+                    batch.add(
+                        self.service.events().insert(
+                            calendarId=self.CALENDAR_ID, body=bodies[index]
+                        ),
+                        request_id=str(index),
+                    )
+                try:
+                    with telemetry.span("calendar", "calendar.events.batchInsert") as span:
+                        span.retries = attempt
+                        # upstream.call takes the token of the batch request itself
+                        upstream.bucket.acquire(len(pending[i : i + batch_size]) - 1)
+                        upstream.call(batch.execute)
+                except Exception as e:
+                    # The batch request itself failed: none of its inserts got an answer
+                    for index in pending[i : i + batch_size]:
+                        if results[index]["event"] is None:
+                            results[index]["attempts"] += 1
+                            results[index]["error"] = e
+            # Permanent errors, e.g. an invalid event, would fail the same way again
+            pending = [
+                i for i in pending if results[i]["event"] is None and resilience.classify_error(results[i]["error"])[0]
+            ]
+            if not pending:
+                break
+
+        if self.event_store is not None:
+            self.event_store.upsert([r["event"] for r in results if r["event"]])
+        return results
@@ -1,23 +1,31 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 import json
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.exceptions import RefreshError
+import telemetry
+from device_modules.credential_store import CredentialRefresher, CredentialStore
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 
 class IdentityManager:
-    def __init__(self, creds: Credentials):
+    def __init__(self, creds: Credentials, credential_json_path: Optional[Path] = None):
         """Contains identification details needed to verify a user.
          Use google_oauth2_login method to handle object creation.
 
         Args:
             creds (Credentials): google.oauth2.Credentials using OAuth 2.0 access and refresh tokens.
+            credential_json_path (Optional[Path], optional): Path to the credentials.json file of the user's Google project.
+                Defaults to None, which uses src/credentials.json.
         """
         self.creds = creds
+        if credential_json_path is None:
+            credential_json_path = Path(__file__).parent.parent / "credentials.json"
+        self.credential_json_path = Path(credential_json_path)
+        self.token_json_path = self.credential_json_path.parent / "token.json"
+        self._refresher = None
         self.secrets = self._fetch_secrets()
         self.PROJECT_ID = self._fetch_project_id()
 
@@ -46,37 +54,50 @@ class IdentityManager:
             # TODO: add custom errors
             raise ValueError(f"{credential_json_path=} doesn't exist")
 
-        if token_json_path is None:
-            creds = IdentityManager._fetch_google_credentials(
-                credential_json_path=credential_json_path
-            )
+        creds = IdentityManager._fetch_google_credentials(
+            credential_json_path=credential_json_path,
+            token_json_path=token_json_path,
+        )
 
-        return cls(creds=creds)
+        user_id = cls(creds=creds, credential_json_path=credential_json_path)
+        if token_json_path is not None:
+            user_id.token_json_path = Path(token_json_path)
+        return user_id
 
     @staticmethod
     def _fetch_google_credentials(
         credential_json_path: Path,
+        token_json_path: Optional[Path | str] = None,
     ) -> Credentials:
-        token_json_path = credential_json_path.parent / "token.json"
-        creds = None
-        if (token_json_path).exists():
-            creds = Credentials.from_authorized_user_file(token_json_path)
-
-        if not creds or (creds and not creds.valid):
-            creds = IdentityManager._login_flow(credential_json_path, token_json_path)
-
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except RefreshError:
-                creds = IdentityManager._login_flow(
-                    credential_json_path, token_json_path
-                )
+        if token_json_path is None:
+            token_json_path = credential_json_path.parent / "token.json"
+        token_json_path = Path(token_json_path)
+        store = CredentialStore.for_path(token_json_path)
+
+        # Holding the store's lock, concurrent processes wait for the one refreshing or logging in and reuse its token
+        with store.locked():
+            creds = store.load()
+
+            if creds and creds.expired and creds.refresh_token:
+                from google.auth.exceptions import RefreshError
+                from google.auth.transport.requests import Request
+
+                try:
+                    with telemetry.span("oauth", "token_refresh"):
+                        creds.refresh(Request())
+                    store.save(creds)
+                except RefreshError:
+                    creds = None
+
+            if not creds or (creds and not creds.valid):
+                creds = IdentityManager._login_flow(credential_json_path, token_json_path)
 
         return creds
 
     @staticmethod
     def _login_flow(credential_json_path: Path | str, token_json_path: Path | str):
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         flow = InstalledAppFlow.from_client_secrets_file(
             client_secrets_file=credential_json_path,
             scopes=[
@@ -84,20 +105,43 @@ class IdentityManager:
                 "https://www.googleapis.com/auth/cloud-platform",
             ],
         )
-        creds = flow.run_local_server(port=0)
+        # Includes the time the user takes to consent in the browser
+        with telemetry.span("oauth", "login_flow"):
+            creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
-        with open(token_json_path, "w") as f:
-            f.write(creds.to_json())
+        store = CredentialStore.for_path(token_json_path)
+        with store.locked():
+            store.save(creds)
 
         return creds
 
+    def start_background_refresh(self, refresh_margin: float = 600):
+        """Keeps the access token fresh from a background thread, ahead of expiry, sharing it with other processes
+        through token.json. Useful for long-running processes; API calls then never wait on a token refresh.
+
+        Args:
+            refresh_margin (float, optional): Seconds before expiry at which the token is refreshed. Defaults to 600.
+        """
+        if self._refresher is None:
+            self._refresher = CredentialRefresher(
+                self.creds,
+                CredentialStore.for_path(self.token_json_path),
+                refresh_margin=refresh_margin,
+            )
+            self._refresher.start()
+
+    def stop_background_refresh(self):
+        """Stops the background refresh thread started by start_background_refresh."""
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
+
     def _fetch_secrets(self):
         # TODO: check creds and use creds to access secrets and acquire them
         secrets = {"openweather_api_key": "API_KEY"}
         return secrets
 
     def _fetch_project_id(self):
-        credentials_path = Path(__file__).parent.parent / "credentials.json"
-        with open(credentials_path, "r") as f:
+        with open(self.credential_json_path, "r") as f:
             data = json.load(f)
         return data["installed"]["project_id"]
@@ -1,22 +1,178 @@
 import requests
 import datetime
+import threading
+import time
+
+import resilience
+import telemetry
+from device_modules.weather_series import WeatherSeries, convert_temperature
+
+
+class _WeatherCache:
+    """Process-wide cache of One Call responses shared by every OpenWeatherCaller.
+
+    Entries are keyed by a coordinate grid bucket, so nearby locations share them, and concurrent requests for the same
+    bucket are coalesced into a single upstream call (single flight).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # bucket -> (fetched_at, response, etag)
+        self._inflight = {}  # bucket -> threading.Event
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "not_modified": 0}
+
+    def get(self, bucket, ttl: float, fetch):
+        """Returns a response for `bucket` younger than `ttl` seconds, calling fetch(etag) at most once per bucket at a time.
+        fetch returns (response, etag), with response None if the upstream answered 304 Not Modified.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(bucket)
+                if entry is not None and time.time() - entry[0] < ttl:
+                    self.stats["hits"] += 1
+                    telemetry.cache_lookup("openweather", "onecall", "hit")
+                    return entry[1]
+                event = self._inflight.get(bucket)
+                if event is None:
+                    event = self._inflight[bucket] = threading.Event()
+                    self.stats["misses"] += 1
+                    telemetry.cache_lookup("openweather", "onecall", "miss")
+                    break
+                self.stats["coalesced"] += 1
+                telemetry.cache_lookup("openweather", "onecall", "coalesced")
+            # Another thread is fetching this bucket; use its result (or retry if it failed)
+            event.wait()
+
+        try:
+            response, etag = fetch(None if entry is None else entry[2])
+            with self._lock:
+                if response is None:
+                    self.stats["not_modified"] += 1
+                    response, etag = entry[1], entry[2]
+                self._entries[bucket] = (time.time(), response, etag)
+            return response
+        finally:
+            with self._lock:
+                del self._inflight[bucket]
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
 
 class OpenWeatherCaller():
-    def __init__(self, api_key: str, lat: float, lon: float):
+    # One connection pool for every caller in the process
+    session = requests.Session()
+    cache = _WeatherCache()
+
+    def __init__(
+        self,
+        api_key: str,
+        lat: float,
+        lon: float,
+        ttl: float = 600,
+        grid: float = 0.1,
+        timeout: float = 10,
+        base_url: str = "https://api.openweathermap.org",
+        snapshot_path=None,
+        offline_first: bool = False,
+    ):
+        """Reads weather data from the OpenWeather One Call API.
+
+        Args:
+            api_key (str): OpenWeather API key.
+            lat (float): Latitude of the location.
+            lon (float): Longitude of the location.
+            ttl (float, optional): Seconds during which a response is reused. Defaults to 600, OpenWeather's update interval.
+            grid (float, optional): Size in degrees of the coordinate grid cells sharing a cached response. Defaults to 0.1 (about 11 km).
+            timeout (float, optional): Request timeout in seconds. Defaults to 10.
+            base_url (str, optional): Root URL of the API, e.g. to use a local fake server. Defaults to "https://api.openweathermap.org".
+            snapshot_path (Optional[Path | str], optional): .npz file keeping the latest forecast across runs. It is
+                used when the API can't be reached. Defaults to None.
+            offline_first (bool, optional): Use the snapshot, if there is one, without calling the API. Defaults to False.
+        """
         self.api_key = api_key
-        self.lat = lat
-        self.lon = lon
+        self.lat = float(lat)
+        self.lon = float(lon)
+        self.ttl = ttl
+        self.grid = grid
+        self.timeout = timeout
+        self.base_url = base_url.rstrip("/")
+        self.snapshot_path = snapshot_path
+        self.offline_first = offline_first
 
         self.last_refresh_date = None
-        self.latest_response = None
+        self.latest_series = None
         self._make_call()
 
+    @property
+    def bucket(self) -> tuple:
+        """Coordinate grid cell of this caller's location."""
+        return (round(self.lat / self.grid), round(self.lon / self.grid), self.grid)
+
+    def _fetch(self, etag):
+        """Requests the One Call API at the center of the grid cell. Returns (WeatherSeries, etag); the series is None on 304."""
+        lat = round(self.lat / self.grid) * self.grid
+        lon = round(self.lon / self.grid) * self.grid
+        url = f"{self.base_url}/data/3.0/onecall"
+        headers = {} if etag is None else {"If-None-Match": etag}
+
+        def get():
+            response = self.session.get(
+                url,
+                params={
+                    "lat": f"{lat:.4f}",
+                    "lon": f"{lon:.4f}",
+                    "appid": self.api_key,
+                    "exclude": WeatherSeries.EXCLUDED_BLOCKS,
+                },
+                headers=headers,
+                timeout=self.timeout,
+            )
+            if response.status_code != 304:
+                response.raise_for_status()
+            return response
+
+        with telemetry.span("openweather", "onecall") as span:
+            span.cache = "miss" if etag is None else "revalidate"
+            response = resilience.call("openweather", get)
+            span.bytes_received = len(response.content)
+            span.attrs["http_status"] = response.status_code
+        if response.status_code == 304:
+            return None, etag
+        return WeatherSeries.from_response(response.json()), response.headers.get("ETag")
+
+    def _load_snapshot(self):
+        """The forecast of the snapshot; None if there is none."""
+        if self.snapshot_path is None:
+            return None
+        try:
+            return WeatherSeries.load(self.snapshot_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
     def _make_call(self):
         self.last_refresh_date = datetime.datetime.now().date()
-        url = f"https://api.openweathermap.org/data/3.0/onecall?lat={self.lat}&lon={self.lon}&appid={self.api_key}"
-
-        self.latest_response = requests.get(url).json()
+        if self.offline_first:
+            snapshot = self._load_snapshot()
+            if snapshot is not None:
+                telemetry.cache_lookup("openweather", "onecall", "stale")
+                self.latest_series = snapshot
+                return
+        try:
+            series = self.cache.get(self.bucket, self.ttl, self._fetch)
+        except Exception as e:
+            snapshot = self._load_snapshot()
+            if snapshot is None:
+                raise
+            print(f"OpenWeather unavailable ({e!r}); using the forecast of {datetime.datetime.fromtimestamp(snapshot.current_dt)}")
+            telemetry.cache_lookup("openweather", "onecall", "stale")
+            self.latest_series = snapshot
+            return
+        if self.snapshot_path is not None and series is not self.latest_series:
+            series.save(self.snapshot_path)
+        self.latest_series = series
 
     def update_current_day(self):
         current_date = datetime.datetime.now()
@@ -27,11 +183,21 @@ class OpenWeatherCaller():
     def get_daily_max(self) -> float:
         self.update_current_day()
 
-        max_temp = self.latest_response['daily'][0]['temp']['max'] - 273.15
+        max_temp = convert_temperature(float(self.latest_series.daily_temp_max[0]))
 
         return max_temp
 
     def get_current_temp(self) -> float:
         self._make_call()
-        current_temp = self.latest_response['current']['temp'] - 273.15
+        current_temp = convert_temperature(self.latest_series.current_temp)
         return current_temp
+
+    def get_max_temp_in_window(self, start: float, end: float, unit: str = "C"):
+        """Maximum hourly forecast temperature between the POSIX timestamps start and end."""
+        self._make_call()
+        return self.latest_series.max_temp(start, end, unit=unit)
+
+    def get_hours_above(self, threshold: float, unit: str = "C"):
+        """POSIX timestamps of the forecast hours warmer than `threshold` (in `unit`)."""
+        self._make_call()
+        return self.latest_series.hours_above(threshold, unit=unit)
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import datetime
+import json
+import math
+import os
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+
+from device_modules.workout_history import WorkoutHistory, estimated_one_rep_max
+
+# Number of per-session estimates kept in the rolling summary of each exercise
+_RECENT_SESSIONS = 5
+# Layout of summary.json; a summary written with another layout is rebuilt
+_SUMMARY_FORMAT = 2
+# Maximum number of count_tokens calls made to fit a context in its budget
+_MAX_TOKEN_COUNTS = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """Local estimate of the number of Gemini tokens of `text` (about 4 characters per token for English)."""
+    return math.ceil(len(text) / 4)
+
+
+class RollingSummary:
+    def __init__(self, history: WorkoutHistory):
+        """Per exercise aggregates of a WorkoutHistory, stored next to it in summary.json and updated incrementally:
+        only the sessions ingested since the last update are read.
+
+        Args:
+            history (WorkoutHistory): The history summarized.
+        """
+        self.history = history
+        self.path = history.dir_path / "summary.json"
+        self._lock = threading.Lock()
+        data = json.loads(self.path.read_text()) if self.path.exists() else {}
+        if data.get("format") != _SUMMARY_FORMAT:
+            data = {}
+        self.through = data.get("through", 0)  # sessions summarized
+        self.exercises = data.get("exercises", {})
+
+    def update(self) -> int:
+        """Folds the sessions ingested since the last update into the summary.
+
+        Returns:
+            int: Number of sessions added to the summary.
+        """
+        with self._lock:
+            c = self.history.columns
+            n_sessions = len(self.history)
+            if n_sessions <= self.through:
+                return 0
+            # Sessions are appended in order, so their rows are at the end of the columns
+            first_row = int(np.searchsorted(c["session"], self.through, "left"))
+            # An exercise can take several rows of a session: each session counts once, with its best set
+            best_sets = {}  # (exercise code, session) -> (e1rm, weight, sets, reps)
+            for row in range(first_row, len(c["session"])):
+                weight, sets, reps = float(c["weight"][row]), int(c["sets"][row]), int(c["reps"][row])
+                e1rm = float(estimated_one_rep_max(weight, reps))
+                key = (int(c["exercise"][row]), int(c["session"][row]))
+                if key not in best_sets or e1rm > best_sets[key][0]:
+                    best_sets[key] = (e1rm, weight, sets, reps)
+            for (code, session), (e1rm, weight, sets, reps) in best_sets.items():
+                ts = float(c["ts"][session])
+                name = self.history.exercises[code]
+                entry = self.exercises.setdefault(
+                    name, {"sessions": 0, "last_ts": 0.0, "last": None, "best_e1rm": 0.0, "recent_e1rm": [], "types": {}}
+                )
+                entry["sessions"] += 1
+                entry["best_e1rm"] = max(entry["best_e1rm"], e1rm)
+                # [start time, estimate] of the latest sessions; older events can be ingested after newer ones
+                entry["recent_e1rm"] = sorted(entry["recent_e1rm"] + [[ts, round(e1rm, 1)]])[-_RECENT_SESSIONS:]
+                workout_type = ("push", "pull")[int(c["workout_type"][session])]
+                entry["types"][workout_type] = entry["types"].get(workout_type, 0) + 1
+                if ts >= entry["last_ts"]:
+                    entry["last_ts"] = ts
+                    entry["last"] = [round(weight, 1), sets, reps]
+            added = n_sessions - self.through
+            self.through = n_sessions
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(
+                json.dumps(
+                    {"format": _SUMMARY_FORMAT, "through": self.through, "exercises": self.exercises},
+                    separators=(",", ":"),
+                )
+            )
+            os.replace(tmp_path, self.path)
+        return added
+
+    def lines(self, workout_type: str) -> list:
+        """One line per exercise done in workouts of `workout_type`, most recently done first."""
+        entries = [
+            (name, entry)
+            for name, entry in self.exercises.items()
+            if entry["types"].get(workout_type)
+        ]
+        entries.sort(key=lambda item: item[1]["last_ts"], reverse=True)
+        lines = []
+        for name, entry in entries:
+            weight, sets, reps = entry["last"]
+            date = datetime.date.fromtimestamp(entry["last_ts"]).isoformat()
+            trend = " -> ".join(f"{v:.0f}" for _, v in entry["recent_e1rm"])
+            lines.append(
+                f"{name.capitalize()}: {entry['sessions']} sessions, last {date} with {weight:g} kg, {sets}x{reps}; "
+                f"estimated 1RM trend {trend} kg (best {entry['best_e1rm']:.0f})."
+            )
+        return lines
+
+
+class PromptContextBuilder:
+    def __init__(
+        self,
+        history: WorkoutHistory,
+        token_budget: int = 300,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ):
+        """Builds the training history part of the prompt within a fixed number of tokens.
+
+        Exercises are added from the rolling summary, most recently done first, until the budget is reached, so the
+        prompt size (and so the generation latency) stays bounded however long the history is. The context is cached
+        until new sessions are ingested.
+
+        Args:
+            history (WorkoutHistory): The user's workout history.
+            token_budget (int, optional): Maximum number of tokens of the context. Defaults to 300.
+            count_tokens (Optional[Callable[[str], int]], optional): Counts the tokens of a text, e.g. with Gemini's
+                count_tokens. Lines are selected with estimate_tokens, then the assembled context is counted with this
+                and trimmed by the measured overshoot, with at most a few calls whatever the number of lines. Defaults to
+                None, which only uses estimate_tokens (no request).
+        """
+        self.history = history
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.summary = RollingSummary(history)
+        self._cache = {}  # (workout type, sessions summarized) -> context
+
+    def build(self, workout_type: str) -> Optional[str]:
+        """Returns the context for a workout of `workout_type`; None if no such workout is in the history."""
+        self.summary.update()
+        key = (workout_type, self.summary.through)
+        if key in self._cache:
+            return self._cache[key]
+
+        header = (
+            f"For context, this is the user's training history on the exercises of their {workout_type}-type "
+            "workouts, most recent first; choose weights which keep their progression going:"
+        )
+        lines = self.summary.lines(workout_type)
+        context = None
+        if lines:
+            used = estimate_tokens(header)
+            kept = []
+            for line in lines:
+                cost = estimate_tokens(line) + 1
+                if used + cost > self.token_budget:
+                    break
+                kept.append(line)
+                used += cost
+            if self.count_tokens is not None:
+                for _ in range(_MAX_TOKEN_COUNTS):
+                    if not kept:
+                        break
+                    text = "\n".join([header] + kept)
+                    measured = self.count_tokens(text)
+                    overshoot = measured - self.token_budget
+                    if overshoot <= 0:
+                        break
+                    # Drop the last lines until their estimated cost, corrected by how much the estimate of the
+                    # whole context was off, covers the overshoot
+                    ratio = measured / estimate_tokens(text)
+                    while kept and overshoot > 0:
+                        overshoot -= (estimate_tokens(kept.pop()) + 1) * ratio
+            if kept:
+                context = "\n".join([header] + kept)
+        self._cache = {k: v for k, v in self._cache.items() if k[1] == self.summary.through}
+        self._cache[key] = context
+        return context
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class ResponseCache:
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model_name TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+    """
+
+    def __init__(self, db_path: Path | str, max_entries: int = 256, ttl: float = 86400):
+        """Disk-backed, content-addressed cache of generative model responses.
+        Entries are keyed by a hash of the model name and the prompt, expire `ttl` seconds after they were created,
+        and the least recently used entries are evicted beyond `max_entries`.
+
+        Args:
+            db_path (Path | str): Path to the SQLite database file. Created if it doesn't exist.
+            max_entries (int, optional): Maximum number of cached responses. Defaults to 256.
+            ttl (float, optional): Lifetime of an entry in seconds. Defaults to 86400 (one day).
+        """
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.executescript(self._SCHEMA)
+        self._stats = {"hits": 0, "misses": 0, "expirations": 0, "evictions": 0}
+
+    @staticmethod
+    def key(model_name: str, prompt: str) -> str:
+        """Content address of a (model, prompt) pair."""
+        digest = hashlib.sha256()
+        digest.update(model_name.encode("UTF-8"))
+        digest.update(b"\0")
+        digest.update(prompt.encode("UTF-8"))
+        return digest.hexdigest()
+
+    @property
+    def stats(self) -> dict:
+        """Counters of hits, misses, expired entries and evicted entries since the cache was opened."""
+        with self._lock:
+            return dict(self._stats)
+
+    def get(self, model_name: str, prompt: str) -> Optional[str]:
+        """Returns the cached response to `prompt` by `model_name`, or None on a miss.
+
+        Args:
+            model_name (str): Name of the generative model.
+            prompt (str): The prompt.
+        """
+        key = self.key(model_name, prompt)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] >= self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._stats["expirations"] += 1
+                row = None
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._stats["hits"] += 1
+            return row[0]
+
+    def put(self, model_name: str, prompt: str, response: str):
+        """Stores a response, evicting expired entries and then the least recently used ones beyond max_entries.
+
+        Args:
+            model_name (str): Name of the generative model.
+            prompt (str): The prompt.
+            response (str): The model's complete response.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model_name, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (self.key(model_name, prompt), model_name, response, now, now),
+            )
+            expired = self._conn.execute(
+                "DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,)
+            ).rowcount
+            self._stats["expirations"] += expired
+            evicted = self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._stats["evictions"] += evicted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
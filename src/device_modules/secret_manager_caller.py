@@ -1,17 +1,71 @@
-from google.cloud import secretmanager
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import threading
+from typing import Optional
+
+import resilience
+import telemetry
+from lazy_import import lazy_import
 from device_modules.identity_manager import IdentityManager
+from device_modules.cfg_cache import CfgCache
 import json
 from configurations.config_dataclasses import UserCfg
 
+# Heavy SDKs, only loaded when Secret Manager is actually called (not when the cached configuration is used)
+secretmanager = lazy_import("google.cloud.secretmanager")
+api_exceptions = lazy_import("google.api_core.exceptions")
+
 
 class SecretManagerCaller:
-    def __init__(self, user_id: IdentityManager):
+    # One client, i.e. one gRPC channel, per set of credentials for the whole process
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(
+        self,
+        user_id: IdentityManager,
+        cfg_cache_path: Optional[Path | str] = Path(__file__).parent.parent / ".cfg_cache",
+        cfg_cache_ttl: float = 3600,
+        offline_first: bool = False,
+    ):
+        """Accesses secrets, including the user configuration, stored on Google Secret Manager.
+
+        Args:
+            user_id (IdentityManager): Identity of the user who owns the secrets.
+            cfg_cache_path (Optional[Path  |  str], optional): Path to the encrypted local cache of the configuration. Set to None to disable the cache.
+            cfg_cache_ttl (float, optional): Seconds during which the cached configuration is used without revalidation. Defaults to 3600.
+            offline_first (bool, optional): get_cfg returns the cached configuration whatever its age, without any request;
+                Secret Manager is only called if there is no cache. Defaults to False.
+        """
         # Public attributes
         self.user_id = user_id
         self.PROJECT_ID = self.user_id.PROJECT_ID
-        self.client = secretmanager.SecretManagerServiceClient(
-            credentials=self.user_id.creds
-        )
+        self.offline_first = offline_first
+        self._client = None
+        self.cfg_cache = None
+        if cfg_cache_path is not None:
+            creds = self.user_id.creds
+            key_material = f"{creds.client_id}:{creds.refresh_token}:{self.PROJECT_ID}"
+            self.cfg_cache = CfgCache(cfg_cache_path, key_material, ttl=cfg_cache_ttl)
+
+    @property
+    def client(self) -> secretmanager.SecretManagerServiceClient:
+        """Secret Manager client, created on first use."""
+        if self._client is None:
+            self._client = self._shared_client(self.user_id.creds)
+        return self._client
+
+    @classmethod
+    def _shared_client(cls, creds) -> secretmanager.SecretManagerServiceClient:
+        """Returns the process-wide Secret Manager client for `creds`, creating it on first use."""
+        with cls._clients_lock:
+            entry = cls._clients.get(id(creds))
+            # Keep a reference to creds so that its id cannot be reused by another object
+            if entry is None or entry[0] is not creds:
+                client = secretmanager.SecretManagerServiceClient(credentials=creds)
+                entry = cls._clients[id(creds)] = (creds, client)
+            return entry[1]
 
     def create_secret(self, secret_id: str):
         """Creates a secret hosted on Google Secret Manager, which has a descriptive secret_id.
@@ -27,13 +81,16 @@ class SecretManagerCaller:
         secret = {"replication": {"automatic": {}}}
 
         # Create the secret
-        response = self.client.create_secret(
-            request={
-                "parent": parent,
-                "secret_id": secret_id,
-                "secret": secret,
-            }
-        )
+        with telemetry.span("secret_manager", "create_secret"):
+            response = resilience.call(
+                "secret_manager",
+                self.client.create_secret,
+                request={
+                    "parent": parent,
+                    "secret_id": secret_id,
+                    "secret": secret,
+                }
+            )
 
         # Print the new secret name.
         print(f"Created secret: {response.name}")
@@ -42,14 +99,14 @@ class SecretManagerCaller:
         self, secret_id: str, payload: str
     ) -> secretmanager.SecretVersion:
         """Adds a value for a secret on Google Secret Manager. The secret value is appended as a version for the secret corresponding to secret_id.
-        If the secret value is not a str object, the function will attempt to convert the payload to a json string.
+        If the secret value is not a str object, the function will attempt to convert the payload to a compact json string.
         Args:
             secret_id (str): _description_
             secret_value (str): _description_
         """
         # Check if payload is type str or try to convert to json string otherwise.
         if not isinstance(payload, str):
-            payload = json.dumps(payload)
+            payload = json.dumps(payload, separators=(",", ":"))
 
         # Build the resource name of the parent secret.
         parent = self.client.secret_path(self.PROJECT_ID, secret_id)
@@ -59,17 +116,22 @@ class SecretManagerCaller:
         payload_bytes = payload.encode("UTF-8")
 
         # Add the secret version.
-        response = self.client.add_secret_version(
-            request={
-                "parent": parent,
-                "payload": {
-                    "data": payload_bytes,
-                },
-            }
-        )
+        with telemetry.span("secret_manager", "add_secret_version") as span:
+            span.bytes_sent = len(payload_bytes)
+            response = resilience.call(
+                "secret_manager",
+                self.client.add_secret_version,
+                request={
+                    "parent": parent,
+                    "payload": {
+                        "data": payload_bytes,
+                    },
+                }
+            )
 
         # Print the new secret version name.
         print(f"Added secret version: {response.name}")
+        return response
 
     def access_secret_version(self, secret_id: str, version_id: str = "latest"):
         """Accesses the API key or other credential stored in the secret on Google Secret Manager. Attempts to deserialize json string object before returning secret value.
@@ -81,81 +143,174 @@ class SecretManagerCaller:
         name = f"projects/{self.PROJECT_ID}/secrets/{secret_id}/versions/{version_id}"
 
         # Access the secret version.
-        response = self.client.access_secret_version(name=name)
+        with telemetry.span("secret_manager", "access_secret_version") as span:
+            response = resilience.call(
+                "secret_manager", self.client.access_secret_version, name=name
+            )
+            span.bytes_received = len(response.payload.data)
 
         # Decode payload and deserialize json string to python object.
         response_decoded = response.payload.data.decode("UTF-8")
         response_decoded = json.loads(response_decoded)
         return response_decoded
 
-    def _cfg_exists(self):
-        """Checks if configuration file exists as client secret. Config file must be saved with secret_id 'cfg' upon secret creation."""
-        # Build list of all secrets viewable with current permissions
-        parent = f"projects/{self.PROJECT_ID}"
-        secrets_list = [
-            secret.name.rsplit("/", 1)[-1]
-            for secret in self.client.list_secrets(request={"parent": parent})
-        ]
-
-        # Check if cfg in secrets list
-        if "cfg" in secrets_list:
-            return True
-        else:
+    def get_many(
+        self, secret_ids: list, version_id: str = "latest", max_workers: int = 8
+    ) -> dict:
+        """Accesses several secrets concurrently over the shared gRPC channel.
+        The configuration, API keys included, lives in the single cfg secret read by get_cfg; this is for secrets kept
+        outside of it.
+
+        Args:
+            secret_ids (list): The secrets' ids.
+            version_id (str, optional): Identifies which value of the secrets to access. Defaults to "latest".
+            max_workers (int, optional): Maximum number of requests in flight. Defaults to 8.
+
+        Returns:
+            dict: Deserialized secret value for every secret id; None for secrets which don't exist.
+        """
+
+        def access(secret_id):
+            try:
+                return self.access_secret_version(secret_id, version_id)
+            except api_exceptions.NotFound:
+                return None
+
+        secret_ids = list(secret_ids)
+        if not secret_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(secret_ids))) as pool:
+            values = pool.map(access, secret_ids)
+        return dict(zip(secret_ids, values))
+
+    def secret_exists(self, secret_id: str) -> bool:
+        """Checks if a secret exists with a direct lookup of its metadata, without listing the project's secrets.
+
+        Args:
+            secret_id (str): The secret's id
+        """
+        try:
+            with telemetry.span("secret_manager", "get_secret"):
+                resilience.call(
+                    "secret_manager",
+                    self.client.get_secret,
+                    name=self.client.secret_path(self.PROJECT_ID, secret_id),
+                )
+        except api_exceptions.NotFound:
             return False
+        return True
+
+    def _cfg_version_up_to_date(self, current_cfg: Optional[dict] = None):
+        """Checks if current configuration file version is the latest configuration version, i.e. it uses the current
+        schema version and has every parameter of the schema. Assumes the configuration file already exists as a client secret.
 
-    def _cfg_version_up_to_date(self):
-        """Checks if current configuration file version is the latest configuration version.
-        Assumes the configuration file already exists as a client secret. Assumes every field in UserCfg is uniquely named."""
-
-        current_cfg = self.access_secret_version("cfg")
-        current_cfg_parameters = list(current_cfg.keys())
-        for param in current_cfg:
-            if type(param) is dict:
-                current_cfg_parameters += list(param.keys())
-        # Check if every cfg parameter exists
-        test = True
-        for a in UserCfg.list_cfg_parameters():
-            if a not in current_cfg_parameters:
-                test = False
-        return test
-
-    def _create_or_update_cfg(self):
+        Args:
+            current_cfg (Optional[dict], optional): The current configuration, if already downloaded. Defaults to None.
+        """
+        if current_cfg is None:
+            current_cfg = self.access_secret_version("cfg")
+        return UserCfg.is_up_to_date(current_cfg)
+
+    def _create_or_update_cfg(self, cfg_dict: Optional[dict] = None):
         """Updates missing records in configuration file.
-        Uploads the new configuration file as client secret.
+        Uploads the new configuration file as client secret. Only called for a configuration which is missing or not
+        up to date, so the update always yields a new version.
 
         Args:
-            create (bool, optional): Set create=True if cfg does not exist so that new Google Secret Manager secret is created first. Defaults to False.
+            cfg_dict (Optional[dict], optional): The current configuration. If None, the cfg secret is created first. Defaults to None.
 
         Returns:
-            bool: True if successful
+            UserCfg: the updated configuration
 
         """
         # Create new secret if cfg does not already exist
-        if not self._cfg_exists():
-            self.create_secret("cfg")
-            self.add_secret_version(
-                "cfg", {}
-            )  # this is needed to later check existing dict for missing values
-
-        # Access current cfg
-        cfg_dict = self.access_secret_version("cfg")
+        if cfg_dict is None:
+            try:
+                self.create_secret("cfg")
+            except api_exceptions.AlreadyExists:
+                # The secret exists but has no enabled version, e.g. the first upload failed: add one
+                pass
+            cfg_dict = {}
 
         # Update cfg for any missing records
         new_cfg_dict = UserCfg.update_cfg_dict(old_cfg_dict=cfg_dict)
 
         # Upload new record to Google Secret Manager and return UserCfg
-        self.add_secret_version("cfg", new_cfg_dict)
+        version = self.add_secret_version("cfg", UserCfg.encode(new_cfg_dict))
+        if self.cfg_cache is not None:
+            self.cfg_cache.save(version.name, version.etag, new_cfg_dict)
         return UserCfg.from_dict(dict_obj=new_cfg_dict)
 
+    def _fetch_cfg(self, version_name: str) -> tuple:
+        """Downloads the configuration stored in a version of the cfg secret.
+
+        Returns:
+            tuple: (resolved version name, configuration dict); (None, None) if the cfg secret or the version doesn't
+                exist.
+        """
+        try:
+            with telemetry.span("secret_manager", "access_secret_version") as span:
+                span.cache = None if self.cfg_cache is None else "miss"
+                response = resilience.call(
+                    "secret_manager", self.client.access_secret_version, name=version_name
+                )
+                span.bytes_received = len(response.payload.data)
+        except api_exceptions.NotFound:
+            return None, None
+        return response.name, json.loads(response.payload.data.decode("UTF-8"))
+
     def get_cfg(self) -> UserCfg:
         """Gets the configuration file stored on Google Secret Manager.
         If the existing configuration file is not up to date, requests missing information from the user via the command line.
 
+        A cached configuration younger than the cache TTL is used without any request. An older one is revalidated with a
+        metadata-only lookup of the latest secret version, and only downloaded again if its name or etag changed.
+        Without a cache, the latest version is downloaded in a single request. In offline first mode any cached
+        configuration is used without revalidation.
+
         Returns:
-            Dict: configuration information stored as a dictionary.
+            UserCfg: configuration information.
         """
-        if not self._cfg_exists() or not self._cfg_version_up_to_date():
-            self.cfg = self._create_or_update_cfg()
+        latest_name = f"projects/{self.PROJECT_ID}/secrets/cfg/versions/latest"
+        cached = None if self.cfg_cache is None else self.cfg_cache.load()
+
+        if cached is not None:
+            if self.offline_first or self.cfg_cache.is_fresh(cached):
+                telemetry.cache_lookup("secret_manager", "cfg", "hit" if self.cfg_cache.is_fresh(cached) else "stale")
+                self.cfg = UserCfg.from_dict(cached["cfg"])
+                return self.cfg
+            try:
+                with telemetry.span("secret_manager", "get_secret_version") as span:
+                    span.cache = "revalidate"
+                    version = resilience.call(
+                        "secret_manager", self.client.get_secret_version, name=latest_name
+                    )
+            except api_exceptions.NotFound:
+                version = None
+            if (
+                version is not None
+                and version.name == cached["name"]
+                and cached["etag"] in (None, version.etag)
+            ):
+                telemetry.cache_lookup("secret_manager", "cfg", "revalidated")
+                self.cfg_cache.save(version.name, version.etag, cached["cfg"])
+                self.cfg = UserCfg.from_dict(cached["cfg"])
+                return self.cfg
+            if version is None:
+                self.cfg_cache.invalidate()
+                self.cfg = self._create_or_update_cfg()
+                return self.cfg
+            version_name, etag = version.name, version.etag
+        else:
+            version_name, etag = latest_name, None
+        if self.cfg_cache is not None:
+            telemetry.cache_lookup("secret_manager", "cfg", "miss")
+
+        version_name, cfg_dict = self._fetch_cfg(version_name)
+        if cfg_dict is None or not self._cfg_version_up_to_date(cfg_dict):
+            self.cfg = self._create_or_update_cfg(cfg_dict)
         else:
-            self.cfg = UserCfg.from_dict(self.access_secret_version("cfg"))
+            if self.cfg_cache is not None:
+                self.cfg_cache.save(version_name, etag, cfg_dict)
+            self.cfg = UserCfg.from_dict(cfg_dict)
         return self.cfg
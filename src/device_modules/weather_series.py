@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+KELVIN_OFFSET = 273.15
+
+
+def convert_temperature(kelvin, unit: str = "C"):
+    """Converts temperatures in Kelvin to `unit`.
+
+    Args:
+        kelvin (float | np.ndarray): Temperatures in Kelvin.
+        unit (str, optional): "K", "C" or "F". Defaults to "C".
+
+    Returns:
+        float | np.ndarray: Converted temperatures, with the same shape as `kelvin`.
+    """
+    if unit == "K":
+        return kelvin
+    if unit == "C":
+        return kelvin - KELVIN_OFFSET
+    if unit == "F":
+        return (kelvin - KELVIN_OFFSET) * 1.8 + 32
+    raise ValueError(f"{unit=} must be one of K, C, F")
+
+
+def _to_kelvin(value: float, unit: str) -> float:
+    if unit == "K":
+        return value
+    if unit == "C":
+        return value + KELVIN_OFFSET
+    if unit == "F":
+        return (value - 32) / 1.8 + KELVIN_OFFSET
+    raise ValueError(f"{unit=} must be one of K, C, F")
+
+
+@dataclass(frozen=True)
+class WeatherSeries:
+    """Compact, array-backed form of a One Call response.
+    Timestamps are POSIX seconds (int64) and temperatures are in Kelvin (float32), as returned by the API.
+    """
+
+    current_dt: int
+    current_temp: float
+    hourly_dt: np.ndarray
+    hourly_temp: np.ndarray
+    daily_dt: np.ndarray
+    daily_temp_min: np.ndarray
+    daily_temp_max: np.ndarray
+
+    # Blocks of the One Call response which are not parsed, and so shouldn't be requested
+    EXCLUDED_BLOCKS = "minutely,alerts"
+
+    @classmethod
+    def from_response(cls, response: dict) -> WeatherSeries:
+        """Parses the current, hourly and daily blocks of a One Call response."""
+        hourly = response.get("hourly", [])
+        daily = response.get("daily", [])
+        return cls(
+            current_dt=int(response["current"]["dt"]),
+            current_temp=float(response["current"]["temp"]),
+            hourly_dt=np.fromiter((h["dt"] for h in hourly), np.int64, len(hourly)),
+            hourly_temp=np.fromiter(
+                (h["temp"] for h in hourly), np.float32, len(hourly)
+            ),
+            daily_dt=np.fromiter((d["dt"] for d in daily), np.int64, len(daily)),
+            daily_temp_min=np.fromiter(
+                (d["temp"]["min"] for d in daily), np.float32, len(daily)
+            ),
+            daily_temp_max=np.fromiter(
+                (d["temp"]["max"] for d in daily), np.float32, len(daily)
+            ),
+        )
+
+    def save(self, path) -> None:
+        """Writes the series to the .npz file `path`, replacing it atomically."""
+        import dataclasses
+        import os
+        from pathlib import Path
+
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp_path, **{f.name: getattr(self, f.name) for f in dataclasses.fields(self)})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> WeatherSeries:
+        """Reads a series written by save."""
+        with np.load(path) as data:
+            return cls(
+                current_dt=int(data["current_dt"]),
+                current_temp=float(data["current_temp"]),
+                hourly_dt=data["hourly_dt"],
+                hourly_temp=data["hourly_temp"],
+                daily_dt=data["daily_dt"],
+                daily_temp_min=data["daily_temp_min"],
+                daily_temp_max=data["daily_temp_max"],
+            )
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays of the series."""
+        return sum(
+            a.nbytes
+            for a in (
+                self.hourly_dt,
+                self.hourly_temp,
+                self.daily_dt,
+                self.daily_temp_min,
+                self.daily_temp_max,
+            )
+        )
+
+    def _hourly_window(self, start: Optional[float], end: Optional[float]) -> slice:
+        """Slice of the hourly arrays with timestamps in [start, end); the arrays are sorted so this is two binary searches."""
+        lo, hi = 0, len(self.hourly_dt)
+        if start is not None:
+            lo = int(np.searchsorted(self.hourly_dt, start, "left"))
+        if end is not None:
+            hi = int(np.searchsorted(self.hourly_dt, end, "left"))
+        return slice(lo, hi)
+
+    def max_temp(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        unit: str = "C",
+    ) -> Optional[float]:
+        """Maximum hourly temperature forecast in [start, end).
+
+        Args:
+            start (Optional[float], optional): POSIX timestamp of the start of the window. Defaults to the first hour.
+            end (Optional[float], optional): POSIX timestamp of the end of the window. Defaults to the last hour.
+            unit (str, optional): "K", "C" or "F". Defaults to "C".
+
+        Returns:
+            Optional[float]: The maximum temperature; None if no hour falls in the window.
+        """
+        temps = self.hourly_temp[self._hourly_window(start, end)]
+        if temps.size == 0:
+            return None
+        return float(convert_temperature(temps.max(), unit))
+
+    def hours_above(
+        self,
+        threshold: float,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        unit: str = "C",
+    ) -> np.ndarray:
+        """Timestamps of the forecast hours in [start, end) whose temperature is above `threshold`.
+
+        Args:
+            threshold (float): Temperature threshold, in `unit`.
+            start (Optional[float], optional): POSIX timestamp of the start of the window. Defaults to the first hour.
+            end (Optional[float], optional): POSIX timestamp of the end of the window. Defaults to the last hour.
+            unit (str, optional): "K", "C" or "F". Defaults to "C".
+
+        Returns:
+            np.ndarray: POSIX timestamps of the matching hours.
+        """
+        window = self._hourly_window(start, end)
+        mask = self.hourly_temp[window] > _to_kelvin(threshold, unit)
+        return self.hourly_dt[window][mask]
+
+    def hourly(self, unit: str = "C") -> tuple:
+        """Hourly forecast as (timestamps, temperatures in `unit`)."""
+        return self.hourly_dt, convert_temperature(self.hourly_temp, unit)
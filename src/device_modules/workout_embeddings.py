@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from device_modules.exercise_classifier import normalize
+
+_WORKOUT_TYPES = ("push", "pull")
+
+
+class HashingEmbedder:
+    def __init__(self, dim: int = 512):
+        """Embeds text into `dim` dimensions without a vocabulary or a model (the hashing trick).
+
+        The words of the normalized text and the pairs of consecutive words are hashed to a dimension and a sign, with
+        log-scaled counts, and the vector is L2-normalized, so a dot product is a cosine similarity. Word pairs keep
+        "bench press" apart from "leg press".
+
+        Args:
+            dim (int, optional): Number of dimensions. Defaults to 512.
+        """
+        self.dim = dim
+
+    def _features(self, text: str) -> list:
+        words = normalize(text).split()
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def _bucket(self, feature: str) -> tuple:
+        """(dimension, sign) of a feature; stable across processes, unlike hash()."""
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        return h % self.dim, 1.0 if (h >> 63) & 1 else -1.0
+
+    def embed(self, text: str) -> np.ndarray:
+        """Unit float32 vector of `text`; all zeros if it has no word."""
+        counts = {}
+        for feature in self._features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+        vector = np.zeros(self.dim, np.float32)
+        for feature, n in counts.items():
+            index, sign = self._bucket(feature)
+            vector[index] += sign * (1 + np.log(n))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_many(self, texts) -> np.ndarray:
+        """Embeddings of `texts`, one row per text."""
+        return np.stack([self.embed(t) for t in texts]) if texts else np.empty((0, self.dim), np.float32)
+
+
+class WorkoutEmbeddingIndex:
+    def __init__(self, dir_path: Path | str, embedder: Optional[HashingEmbedder] = None):
+        """Embeddings of past workout descriptions, for similarity search.
+
+        Each workout is embedded once, when it is added, and appended as a row of a float32 matrix stored raw in
+        vectors.f32 and memory-mapped for queries, so only the pages actually touched are read. Queries are a single
+        matrix-vector product.
+
+        Args:
+            dir_path (Path | str): Directory holding the index. Created if it doesn't exist.
+            embedder (Optional[HashingEmbedder], optional): Defaults to HashingEmbedder() with the dimension stored in
+                the index, if any.
+        """
+        self.dir_path = Path(dir_path)
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.dir_path / "vectors.f32"
+        self._meta_path = self.dir_path / "meta.json"
+        self._lock = threading.Lock()
+        meta = json.loads(self._meta_path.read_text()) if self._meta_path.exists() else {}
+        self.embedder = embedder or HashingEmbedder(meta.get("dim", 512))
+        if meta and meta["dim"] != self.embedder.dim:
+            raise ValueError(f"index has {meta['dim']} dimensions, embedder {self.embedder.dim}")
+        self.event_ids = meta.get("event_ids", [])  # row -> calendar event id
+        self._event_id_set = set(self.event_ids)
+        self.ts = np.asarray(meta.get("ts", []), np.float64)
+        self.labels = np.asarray(meta.get("labels", []), np.int8)  # index in ("push", "pull")
+        # Rows past the metadata were written by an add which didn't complete
+        row_bytes = self.embedder.dim * 4
+        if self._vectors_path.exists() and self._vectors_path.stat().st_size != len(self) * row_bytes:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(len(self) * row_bytes)
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.event_ids)
+
+    @property
+    def last_ts(self) -> float:
+        """Start of the latest workout added; 0 if there is none."""
+        return float(self.ts.max()) if len(self) else 0.0
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Read-only memory map of the embeddings, one row per workout."""
+        if self._matrix is None:
+            if not len(self):
+                return np.empty((0, self.embedder.dim), np.float32)
+            self._matrix = np.memmap(self._vectors_path, np.float32, "r", shape=(len(self), self.embedder.dim))
+        return self._matrix
+
+    def add(self, events: list, classify: Optional[Callable[[str], str]] = None) -> int:
+        """Embeds and appends workout events which were not added yet. Events without a description are skipped.
+
+        Args:
+            events (list): Stored events (see CalendarEventStore) with keys id, description and start_ts.
+            classify (Optional[Callable[[str], str]], optional): Returns "push" or "pull" for a workout description; the
+                label used by detect_workout_type. Defaults to None, which uses GoogleAICaller's keyword detection.
+
+        Returns:
+            int: Number of workouts added.
+        """
+        if classify is None:
+            from device_modules.googleai_caller import GoogleAICaller
+
+            classify = GoogleAICaller._detect_workout_type
+
+        with self._lock:
+            new = [e for e in events if e.get("description") and e["id"] not in self._event_id_set]
+            new = list({e["id"]: e for e in new}.values())
+            if not new:
+                return 0
+            vectors = self.embedder.embed_many([e["description"] for e in new])
+            labels = np.asarray([_WORKOUT_TYPES.index(classify(e["description"])) for e in new], np.int8)
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.astype(np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.event_ids.extend(e["id"] for e in new)
+            self._event_id_set.update(e["id"] for e in new)
+            self.ts = np.concatenate([self.ts, [e["start_ts"] for e in new]])
+            self.labels = np.concatenate([self.labels, labels])
+            tmp_path = self._meta_path.with_name(self._meta_path.name + ".tmp")
+            tmp_path.write_text(
+                json.dumps(
+                    {
+                        "dim": self.embedder.dim,
+                        "event_ids": self.event_ids,
+                        "ts": self.ts.tolist(),
+                        "labels": self.labels.tolist(),
+                    },
+                    separators=(",", ":"),
+                )
+            )
+            os.replace(tmp_path, self._meta_path)
+            self._matrix = None
+        return len(new)
+
+    def sync(self, event_store, classify: Optional[Callable[[str], str]] = None) -> int:
+        """Adds the past workout events of a CalendarEventStore which started since the latest workout added.
+
+        Returns:
+            int: Number of workouts added.
+        """
+        events = event_store.events_between(self.last_ts, time.time(), summary_contains="WORKOUT")
+        return self.add(events, classify=classify)
+
+    def search(self, text: str, k: int = 5) -> list:
+        """The `k` past workouts most similar to `text`.
+
+        Returns:
+            list: (event id, cosine similarity) tuples, most similar first.
+        """
+        matrix = self.matrix
+        if not len(matrix) or k <= 0:
+            return []
+        similarities = matrix @ self.embedder.embed(text)
+        top = self._top_k(similarities, k)
+        return [(self.event_ids[i], float(similarities[i])) for i in top]
+
+    @staticmethod
+    def _top_k(values: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the `k` largest values, largest first; a partial sort instead of a full one."""
+        if k < len(values):
+            top = np.argpartition(values, -k)[-k:]
+        else:
+            top = np.arange(len(values))
+        return top[np.argsort(values[top])[::-1]]
+
+    def detect_workout_type(
+        self, text: str, k: int = 7, min_similarity: float = 0.2, exclude_id: Optional[str] = None
+    ) -> Optional[str]:
+        """Type of the workout described by `text`, by a similarity weighted vote of its `k` nearest past workouts.
+
+        Args:
+            text (str): Workout description.
+            k (int, optional): Number of neighbours voting. Defaults to 7.
+            min_similarity (float, optional): Neighbours less similar than this don't vote. Defaults to 0.2.
+            exclude_id (Optional[str], optional): Event id of the workout described by `text`, which doesn't vote: its
+                label is the keyword detection of `text` itself. Past sessions with the same text still vote. Defaults
+                to None.
+
+        Returns:
+            Optional[str]: "push" or "pull"; None if no other past workout is similar enough.
+        """
+        matrix = self.matrix
+        if not len(matrix):
+            return None
+        similarities = matrix @ self.embedder.embed(text)
+        if exclude_id in self._event_id_set:
+            similarities[self.event_ids.index(exclude_id)] = -np.inf
+        top = self._top_k(similarities, k)
+        top = top[similarities[top] >= min_similarity]
+        if not len(top):
+            return None
+        votes = np.bincount(self.labels[top], weights=similarities[top], minlength=len(_WORKOUT_TYPES))
+        return _WORKOUT_TYPES[int(np.argmax(votes))]
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from device_modules.exercise_classifier import normalize
+
+LBS_TO_KG = 0.45359237
+
+# "Bench press: 80 kg. 3 sets, 5 repetitions in each set." and common variations of Gemini's output, e.g.
+# "**Bench Press:** 80 kg, 3 sets of 5 reps" or "Bench press: 175 lbs - 3 x 5"
+_SET_RE = re.compile(
+    r"^[\s\-*•\d.)]*(?P<name>[A-Za-z][A-Za-z0-9 '()/-]*?)\s*:\s*"
+    r"(?P<weight>\d+(?:\.\d+)?)\s*(?P<unit>kgs?|kilograms?|lbs?|pounds?)?[\s.,;\-–]*"
+    r"(?:(?P<sets>\d+)\s*sets?\D*?(?P<reps>\d+)\s*(?:rep|repetition|repition|repetion)"
+    r"|(?P<sets_x>\d+)\s*[x×]\s*(?P<reps_x>\d+))",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+_WORKOUT_TYPES = ("push", "pull")
+
+
+def parse_workout(text: str) -> list:
+    """Extracts the exercises of a workout description, one per line.
+
+    Args:
+        text (str): Workout description, e.g. a generated workout.
+
+    Returns:
+        list: (exercise, weight in kg, sets, reps) tuples; exercise names are normalized (see exercise_classifier.normalize).
+            Lines which don't describe an exercise are skipped.
+    """
+    records = []
+    for match in _SET_RE.finditer(text.replace("**", "")):
+        weight = float(match["weight"])
+        if match["unit"] and match["unit"].lower().startswith(("lb", "pound")):
+            weight *= LBS_TO_KG
+        sets = match["sets"] or match["sets_x"]
+        reps = match["reps"] or match["reps_x"]
+        records.append((normalize(match["name"]).strip(), weight, int(sets), int(reps)))
+    return records
+
+
+def estimated_one_rep_max(weight, reps):
+    """Epley estimate of the one repetition maximum. Works on scalars and arrays."""
+    return weight * (1 + reps / 30.0)
+
+
+class WorkoutHistory:
+    # One .npy file per column; row i of every column describes one exercise of one session
+    _SET_COLUMNS = {
+        "session": np.int32,
+        "exercise": np.int32,
+        "weight": np.float32,
+        "sets": np.int16,
+        "reps": np.int16,
+    }
+    _SESSION_COLUMNS = {"ts": np.float64, "workout_type": np.int8}
+
+    def __init__(self, dir_path: Path | str):
+        """Structured history of the workouts, stored as NumPy columns and indexed by exercise.
+
+        Workout events are parsed once, when they are ingested, into one row per exercise (weight, sets, reps) plus one
+        row per session (start time, push or pull). Queries are vectorized over the columns, and the rows of an exercise
+        are located through an index (rows sorted by exercise then time, with the offset of each exercise), so they cost
+        about the same with years of history.
+
+        Args:
+            dir_path (Path | str): Directory holding the columns. Created if it doesn't exist.
+        """
+        self.dir_path = Path(dir_path)
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        meta_path = self.dir_path / "meta.json"
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        self.exercises = meta.get("exercises", [])  # exercise code -> name
+        self._exercise_codes = {name: i for i, name in enumerate(self.exercises)}
+        self.event_ids = meta.get("event_ids", [])  # session -> calendar event id
+        self._event_id_set = set(self.event_ids)
+        self.columns = {}
+        for name, dtype in {**self._SET_COLUMNS, **self._SESSION_COLUMNS}.items():
+            path = self.dir_path / f"{name}.npy"
+            self.columns[name] = np.load(path) if path.exists() else np.empty(0, dtype)
+        self._index = None
+
+    def __len__(self) -> int:
+        """Number of sessions."""
+        return len(self.columns["ts"])
+
+    @property
+    def last_ts(self) -> float:
+        """Start of the latest ingested session; 0 if there is none."""
+        return float(self.columns["ts"].max()) if len(self) else 0.0
+
+    def _save(self):
+        """Writes every column and the metadata, each file atomically. Caller holds the lock."""
+        for name, values in self.columns.items():
+            tmp_path = self.dir_path / f"{name}.tmp.npy"
+            np.save(tmp_path, values)
+            os.replace(tmp_path, self.dir_path / f"{name}.npy")
+        tmp_path = self.dir_path / "meta.json.tmp"
+        tmp_path.write_text(
+            json.dumps({"exercises": self.exercises, "event_ids": self.event_ids}, separators=(",", ":"))
+        )
+        os.replace(tmp_path, self.dir_path / "meta.json")
+
+    def _exercise_code(self, name: str) -> int:
+        code = self._exercise_codes.get(name)
+        if code is None:
+            code = self._exercise_codes[name] = len(self.exercises)
+            self.exercises.append(name)
+        return code
+
+    def ingest(self, events: list, classify: Optional[Callable[[str], str]] = None) -> int:
+        """Parses and appends workout events which were not ingested yet. Events without any parsable exercise are skipped.
+
+        Args:
+            events (list): Stored events (see CalendarEventStore) with keys id, description and start_ts.
+            classify (Optional[Callable[[str], str]], optional): Returns "push" or "pull" for a workout description.
+                Defaults to None, which uses GoogleAICaller's workout type detection.
+
+        Returns:
+            int: Number of sessions added.
+        """
+        if classify is None:
+            from device_modules.googleai_caller import GoogleAICaller
+
+            classify = GoogleAICaller._detect_workout_type
+
+        new_sets = {name: [] for name in self._SET_COLUMNS}
+        new_sessions = {name: [] for name in self._SESSION_COLUMNS}
+        with self._lock:
+            for event in events:
+                if event["id"] in self._event_id_set:
+                    continue
+                records = parse_workout(event.get("description") or "")
+                if not records:
+                    continue
+                session = len(self.event_ids)
+                self.event_ids.append(event["id"])
+                self._event_id_set.add(event["id"])
+                new_sessions["ts"].append(event["start_ts"])
+                new_sessions["workout_type"].append(_WORKOUT_TYPES.index(classify(event["description"])))
+                for exercise, weight, sets, reps in records:
+                    new_sets["session"].append(session)
+                    new_sets["exercise"].append(self._exercise_code(exercise))
+                    new_sets["weight"].append(weight)
+                    new_sets["sets"].append(sets)
+                    new_sets["reps"].append(reps)
+            if not new_sessions["ts"]:
+                return 0
+            for new in (new_sets, new_sessions):
+                for name, values in new.items():
+                    column = self.columns[name]
+                    self.columns[name] = np.concatenate([column, np.asarray(values, column.dtype)])
+            self._index = None
+            self._save()
+        return len(new_sessions["ts"])
+
+    def sync(self, event_store, classify: Optional[Callable[[str], str]] = None) -> int:
+        """Ingests the past workout events of a CalendarEventStore which started since the latest ingested session.
+
+        Returns:
+            int: Number of sessions added.
+        """
+        import time
+
+        events = event_store.events_between(self.last_ts, time.time(), summary_contains="WORKOUT")
+        return self.ingest(events, classify=classify)
+
+    def _exercise_rows(self, exercise: str) -> np.ndarray:
+        """Indices of the rows of `exercise`, in chronological order."""
+        code = self._exercise_codes.get(normalize(exercise).strip())
+        if code is None:
+            return np.empty(0, np.intp)
+        if self._index is None:
+            session_ts = self.columns["ts"][self.columns["session"]]
+            order = np.lexsort((self.columns["session"], session_ts, self.columns["exercise"]))
+            offsets = np.searchsorted(
+                self.columns["exercise"][order], np.arange(len(self.exercises) + 1)
+            )
+            self._index = (order, offsets)
+        order, offsets = self._index
+        return order[offsets[code] : offsets[code + 1]]
+
+    def _per_session(self, rows: np.ndarray, values: np.ndarray, reduce: np.ufunc) -> tuple:
+        """Reduces `values` (one per row of `rows`) per session. Returns (session start times, reduced values)."""
+        if not len(rows):
+            return np.empty(0, np.float64), np.empty(0, np.float64)
+        sessions = self.columns["session"][rows]
+        # rows are chronological, so the rows of a session are contiguous
+        starts = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1]])
+        return self.columns["ts"][sessions[starts]], reduce.reduceat(values, starts)
+
+    def volume(self, exercise: str) -> tuple:
+        """Training volume (weight x sets x reps, in kg) of `exercise` per session.
+
+        Returns:
+            tuple: (session start times as POSIX timestamps, volumes), both arrays in chronological order.
+        """
+        rows = self._exercise_rows(exercise)
+        c = self.columns
+        values = c["weight"][rows] * c["sets"][rows] * c["reps"][rows]
+        return self._per_session(rows, values.astype(np.float64), np.add)
+
+    def one_rep_max_trend(self, exercise: str) -> tuple:
+        """Estimated one repetition maximum (kg) of `exercise` per session.
+
+        Returns:
+            tuple: (session start times as POSIX timestamps, estimates), both arrays in chronological order.
+        """
+        rows = self._exercise_rows(exercise)
+        values = estimated_one_rep_max(self.columns["weight"][rows], self.columns["reps"][rows])
+        return self._per_session(rows, values.astype(np.float64), np.maximum)
+
+    def last_sessions(self, workout_type: str, n: int = 3) -> list:
+        """The last `n` sessions of type `workout_type` ("push" or "pull"), oldest first.
+
+        Returns:
+            list: One dict per session with keys ts and exercises, a list of (exercise, weight, sets, reps) tuples.
+        """
+        c = self.columns
+        sessions = np.flatnonzero(c["workout_type"] == _WORKOUT_TYPES.index(workout_type))
+        sessions = sessions[np.argsort(c["ts"][sessions], kind="stable")][-n:] if n > 0 else sessions[:0]
+        rows = np.flatnonzero(np.isin(c["session"], sessions))
+        by_session = {int(s): [] for s in sessions}
+        for row in rows:
+            by_session[int(c["session"][row])].append(
+                (self.exercises[c["exercise"][row]], float(c["weight"][row]), int(c["sets"][row]), int(c["reps"][row]))
+            )
+        return [{"ts": float(c["ts"][s]), "exercises": by_session[int(s)]} for s in sessions]
+
+    def progression_summary(self, workout_type: str, n: int = 3) -> Optional[str]:
+        """Describes the recent progression of the exercises of the last `n` sessions of `workout_type`, for a prompt.
+
+        Returns:
+            Optional[str]: One line per exercise; None if there is no session of that type.
+        """
+        import datetime
+
+        sessions = self.last_sessions(workout_type, n)
+        if not sessions:
+            return None
+        lines = []
+        seen = set()
+        for session in reversed(sessions):
+            date = datetime.date.fromtimestamp(session["ts"]).isoformat()
+            for exercise, weight, sets, reps in session["exercises"]:
+                if exercise in seen:
+                    continue
+                seen.add(exercise)
+                _, e1rm = self.one_rep_max_trend(exercise)
+                trend = " -> ".join(f"{v:.0f}" for v in e1rm[-n:])
+                lines.append(
+                    f"{exercise.capitalize()}: last done {date} with {round(weight, 1):g} kg, {sets} sets of {reps} repetitions; "
+                    f"estimated one repetition maximum over the last sessions: {trend} kg."
+                )
+        return "\n".join(lines)
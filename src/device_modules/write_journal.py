@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import resilience
+
+
+class WriteJournal:
+    def __init__(self, path: Path | str, compact_after: int = 100):
+        """Durable on-disk queue of calendar event inserts, as a JSON-lines journal.
+
+        Every insert is appended (and fsynced) before the caller goes on, then marked done or failed by a
+        JournalFlusher. The pending inserts are replayed from the file when it is opened, so a write survives the
+        process dying or the Calendar API being unreachable. Inserts are identified by their client generated event id,
+        which also makes them idempotent: an id already in the journal is not queued again.
+
+        Args:
+            path (Path | str): Path to the journal file. Created if it doesn't exist.
+            compact_after (int, optional): Number of completed inserts after which the file is rewritten with the
+                pending ones only. Defaults to 100.
+        """
+        self.path = Path(path)
+        self.compact_after = compact_after
+        self.appended = threading.Event()  # set whenever an insert is queued
+        self._lock = threading.Lock()
+        self._pending = {}  # event id -> entry, in queue order
+        self._completed = set()  # ids done or failed since the last compaction
+        self._failed = []  # failed entries, kept for inspection
+        self._load()
+        self._file = open(self.path, "a")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        data = self.path.read_bytes()
+        if data and not data.endswith(b"\n"):
+            # Last record cut short by a crash while it was written: drop it, so the next one starts on its own line
+            data = data[: data.rfind(b"\n") + 1]
+            with open(self.path, "r+b") as f:
+                f.truncate(len(data))
+        for line in data.decode().splitlines():
+            record = json.loads(line)
+            if record["op"] == "insert":
+                self._pending[record["id"]] = record
+            else:
+                entry = self._pending.pop(record["id"], None)
+                self._completed.add(record["id"])
+                if record["op"] == "failed" and entry is not None:
+                    self._failed.append({**entry, "error": record["error"]})
+
+    def _write(self, record: dict):
+        """Appends a record and forces it to disk. Caller holds the lock."""
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, calendar_id: str, body: dict) -> bool:
+        """Queues the insert of event `body`, which must have a client generated id.
+
+        Returns:
+            bool: False if an insert of this id was already queued.
+        """
+        with self._lock:
+            if body["id"] in self._pending or body["id"] in self._completed:
+                return False
+            record = {"op": "insert", "id": body["id"], "calendar_id": calendar_id, "body": body, "queued_at": time.time()}
+            self._write(record)
+            self._pending[body["id"]] = record
+        self.appended.set()
+        return True
+
+    def pending(self) -> list:
+        """Queued inserts which are neither done nor failed, oldest first."""
+        with self._lock:
+            return list(self._pending.values())
+
+    @property
+    def failed(self) -> list:
+        """Inserts which failed with a permanent error, with the error under "error"."""
+        with self._lock:
+            return list(self._failed)
+
+    def _complete(self, event_id: str, record: dict):
+        with self._lock:
+            entry = self._pending.pop(event_id, None)
+            if entry is None:
+                return
+            self._write(record)
+            self._completed.add(event_id)
+            if record["op"] == "failed":
+                self._failed.append({**entry, "error": record["error"]})
+            if len(self._completed) >= self.compact_after:
+                self._compact()
+
+    def mark_done(self, event_id: str):
+        """Records that the insert of `event_id` reached the calendar."""
+        self._complete(event_id, {"op": "done", "id": event_id, "at": time.time()})
+
+    def mark_failed(self, event_id: str, error: str):
+        """Records that the insert of `event_id` failed with a permanent error; it won't be retried."""
+        self._complete(event_id, {"op": "failed", "id": event_id, "error": error, "at": time.time()})
+
+    def _compact(self):
+        """Rewrites the journal with the pending inserts only, atomically. Caller holds the lock.
+        The ids of the completed inserts are forgotten, so deduplication only covers the recent ones."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            for record in self._pending.values():
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a")
+        self._completed.clear()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class JournalFlusher:
+    def __init__(
+        self,
+        journal: WriteJournal,
+        insert: Callable[[str, dict], dict],
+        interval: float = 30,
+        retry_policy: Optional[resilience.RetryPolicy] = None,
+    ):
+        """Drains a WriteJournal in a background thread: inserts the pending events in order, and keeps the ones which
+        failed transiently for a later attempt, backing off while the upstream is failing.
+
+        Args:
+            journal (WriteJournal): The journal drained.
+            insert (Callable[[str, dict], dict]): Inserts an event, called with the calendar id and the event body,
+                e.g. GcalendarManager.insert_event. A conflict on the event id must count as a success.
+            interval (float, optional): Seconds between two passes when nothing is queued. Defaults to 30.
+            retry_policy (Optional[resilience.RetryPolicy], optional): Backoff between passes after a transient
+                failure. Defaults to the Calendar upstream's policy.
+        """
+        self.journal = journal
+        self.insert = insert
+        self.interval = interval
+        self.retry_policy = retry_policy or resilience.get_upstream("calendar").retry_policy
+        self.stats = {"inserted": 0, "failed": 0, "transient_errors": 0}
+        self._failures = 0  # consecutive passes ended by a transient error
+        self._stop = threading.Event()
+        self._thread = None
+
+    def flush(self) -> int:
+        """Inserts the pending events, stopping at the first transient error.
+
+        Returns:
+            int: Number of events still pending.
+        """
+        for entry in self.journal.pending():
+            try:
+                self.insert(entry["calendar_id"], entry["body"])
+            except Exception as e:
+                retryable, _ = resilience.classify_error(e)
+                if retryable or isinstance(e, resilience.CircuitOpenError):
+                    # The upstream is struggling; the following inserts would fail the same way
+                    self.stats["transient_errors"] += 1
+                    self._failures += 1
+                    return len(self.journal.pending())
+                self.journal.mark_failed(entry["id"], repr(e))
+                self.stats["failed"] += 1
+                continue
+            self.journal.mark_done(entry["id"])
+            self.stats["inserted"] += 1
+        self._failures = 0
+        return len(self.journal.pending())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.journal.appended.clear()
+            if self.flush() == 0:
+                self.journal.appended.wait(self.interval)
+            else:
+                self._stop.wait(self.retry_policy.delay(self._failures))
+
+    def start(self) -> JournalFlusher:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def drain(self, timeout: float) -> bool:
+        """Waits up to `timeout` seconds for every queued insert to be done or failed.
+
+        Returns:
+            bool: True if nothing is pending anymore.
+        """
+        deadline = time.monotonic() + timeout
+        if self._thread is not None:
+            self.journal.appended.set()  # wake the thread up
+        while self.journal.pending():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._thread is None:
+                if self.flush():
+                    time.sleep(min(remaining, self.retry_policy.delay(self._failures)))
+            else:
+                time.sleep(min(remaining, 0.05))
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self.journal.appended.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
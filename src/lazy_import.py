@@ -0,0 +1,29 @@
+import importlib
+import sys
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """Stand-in for a module which is imported on first attribute access."""
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        # Later lookups find the module's attributes directly, without coming back here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str):
+    """Returns module `name` without looking it up or executing it; the module is imported on first attribute access.
+    Used for heavy SDKs so that runs which never call them don't pay for importing them, and so that a missing SDK
+    only fails the code which actually uses it.
+
+    Args:
+        name (str): Fully qualified module name, e.g. "google.generativeai".
+
+    Returns:
+        ModuleType: The module, or a lazy stand-in which imports it on first use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
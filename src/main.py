@@ -1,20 +1,122 @@
 import argparse
-from scripts import debug
+import sys
+from scripts import debug, plan_block, serve
 
 
 def main(args):
     pass
 
 
+def check_startup(args):
+    """Fails (exit code 1) if importing the modules of the start up path exceeds the import-time budget."""
+    from startup_profiler import STARTUP_IMPORT_BUDGETS_MS, check_import_budget
+
+    budgets = {
+        module: budget_ms * args.budget_scale
+        for module, budget_ms in STARTUP_IMPORT_BUDGETS_MS.items()
+    }
+    if not check_import_budget(budgets, repeat=args.repeat):
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="report import time per module and wall time of the run",
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="append a JSON line per outbound request (latency, bytes, retries, cache) to this file",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="write request counters and latency histograms to this file in the Prometheus text format",
+    )
     subparsers = parser.add_subparsers()
 
     parser_debug = subparsers.add_parser("debug")
+    parser_debug.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="run the start up flow as an async pipeline and print per-stage timings",
+    )
+    parser_debug.add_argument("--stage-timeout", type=float, default=60.0)
+    parser_debug.add_argument(
+        "--offline-first",
+        action="store_true",
+        help="decide from the local configuration cache and event store, then refresh them after the run",
+    )
+    parser_debug.add_argument(
+        "--flush-timeout",
+        type=float,
+        default=3.0,
+        help="seconds spent inserting queued calendar events after the run (default: 3); the rest stays queued for "
+        "the next run",
+    )
     parser_debug.set_defaults(func=debug)
 
+    parser_plan = subparsers.add_parser("plan")
+    parser_plan.add_argument("--days", type=int, default=7)
+    parser_plan.add_argument("--hour", type=int, default=18)
+    parser_plan.add_argument(
+        "--concurrency", type=int, default=4, help="maximum Gemini requests in flight"
+    )
+    parser_plan.set_defaults(func=plan_block)
+
+    parser_serve = subparsers.add_parser("serve")
+    parser_serve.add_argument(
+        "--users-dir",
+        required=True,
+        help="directory with one sub-directory (holding credentials.json) per user",
+    )
+    parser_serve.add_argument("--run-at", default="06:00", help="daily run time, HH:MM")
+    parser_serve.add_argument("--workers", type=int, default=4)
+    parser_serve.add_argument("--calendar-limit", type=int, default=4)
+    parser_serve.add_argument("--secret-manager-limit", type=int, default=4)
+    parser_serve.add_argument("--gemini-limit", type=int, default=2)
+    parser_serve.add_argument("--stats-interval", type=float, default=60)
+    parser_serve.add_argument("--run-now", action="store_true")
+    parser_serve.add_argument(
+        "--watch-address",
+        help="public HTTPS URL forwarded to the local notification receiver; enables calendar push notifications",
+    )
+    parser_serve.add_argument(
+        "--watch-port", type=int, default=8080, help="local port of the notification receiver"
+    )
+    parser_serve.set_defaults(func=serve)
+
+    parser_check_startup = subparsers.add_parser("check-startup")
+    parser_check_startup.add_argument(
+        "--budget-scale",
+        type=float,
+        default=1.0,
+        help="multiplier applied to every module's import-time budget, e.g. for slow machines",
+    )
+    parser_check_startup.add_argument("--repeat", type=int, default=3)
+    parser_check_startup.set_defaults(func=check_startup)
+
     parser.set_defaults(func=main)
 
     args = parser.parse_args()
 
-    args.func(args)
+    if args.profile_startup:
+        from startup_profiler import profile_startup
+
+        sys.exit(
+            profile_startup([a for a in sys.argv[1:] if a != "--profile-startup"])
+        )
+
+    if args.trace_file or args.metrics_file:
+        import json
+        import telemetry
+
+        telemetry.enable(trace_path=args.trace_file, metrics_path=args.metrics_file)
+        try:
+            args.func(args)
+        finally:
+            print(json.dumps({"latency_by_upstream": telemetry.get().summary()}))
+            telemetry.disable()
+    else:
+        args.func(args)
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+class StageSkipped(Exception):
+    """Raised for a stage which didn't run because its condition was false or a required dependency failed."""
+
+
+@dataclass
+class Stage:
+    """One step of an AsyncPipeline.
+
+    Attributes:
+        name (str): Unique name of the stage; its result is stored under this name.
+        func (Callable): Called with the dict of results of the stage's dependencies. Blocking functions are run in a
+            worker thread; coroutine functions are awaited.
+        deps (tuple): Names of the stages which must complete before this one starts.
+        timeout (Optional[float]): Seconds after which the stage is abandoned and counted as failed.
+        required (bool): If False, failure of this stage doesn't prevent dependent stages from running; they see None.
+        condition (Optional[Callable]): Called with the results of the dependencies; the stage is skipped if it returns False.
+    """
+
+    name: str
+    func: Callable
+    deps: tuple = ()
+    timeout: Optional[float] = None
+    required: bool = True
+    condition: Optional[Callable] = None
+
+
+class AsyncPipeline:
+    def __init__(self, stages: list):
+        """Runs stages concurrently as soon as their dependencies are done, so the end-to-end latency is the critical path.
+
+        Args:
+            stages (list): List of Stage objects. Dependencies must refer to stages in the list.
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"{stage.name=} depends on unknown stage {dep=}")
+        self.results = {}
+        self.errors = {}
+        self.timings = {}
+
+    async def _run_stage(self, stage: Stage, tasks: dict, t0: float):
+        for dep in stage.deps:
+            try:
+                await tasks[dep]
+            except Exception as e:
+                if self.stages[dep].required:
+                    self.timings[stage.name] = {"status": "skipped"}
+                    raise StageSkipped(f"dependency {dep} failed") from e
+        dep_results = {dep: self.results.get(dep) for dep in stage.deps}
+        if stage.condition is not None and not stage.condition(dep_results):
+            self.timings[stage.name] = {"status": "skipped"}
+            raise StageSkipped("condition is false")
+
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            if asyncio.iscoroutinefunction(stage.func):
+                coro = stage.func(dep_results)
+            else:
+                coro = asyncio.to_thread(stage.func, dep_results)
+            result = await asyncio.wait_for(coro, stage.timeout)
+            self.results[stage.name] = result
+            return result
+        except asyncio.TimeoutError as e:
+            status = "timeout"
+            self.errors[stage.name] = e
+            raise
+        except Exception as e:
+            status = "error"
+            self.errors[stage.name] = e
+            raise
+        finally:
+            end = time.perf_counter()
+            self.timings[stage.name] = {
+                "status": status,
+                "start": start - t0,
+                "end": end - t0,
+                "duration": end - start,
+            }
+
+    async def run(self) -> dict:
+        """Runs every stage.
+
+        Returns:
+            dict: Result of every stage which completed successfully, by stage name.
+        """
+        t0 = time.perf_counter()
+        tasks = {}
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.ensure_future(self._run_stage(stage, tasks, t0))
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        self.timings["total"] = {"status": "ok", "duration": time.perf_counter() - t0}
+        return self.results
+
+    def format_timings(self) -> str:
+        """Formats the per-stage timing breakdown of the last run as a table."""
+        lines = [f"{'stage':<20}{'status':<10}{'start':>9}{'end':>9}{'duration':>10}"]
+        for name, t in sorted(
+            self.timings.items(), key=lambda item: item[1].get("start", float("inf"))
+        ):
+            start = f"{t['start']:.3f}" if "start" in t else "-"
+            end = f"{t['end']:.3f}" if "end" in t else "-"
+            duration = f"{t['duration']:.3f}" if "duration" in t else "-"
+            lines.append(f"{name:<20}{t['status']:<10}{start:>9}{end:>9}{duration:>10}")
+        return "\n".join(lines)
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import telemetry
+
+# HTTP statuses worth retrying: rate limited, or the upstream is temporarily unable to answer
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Google APIs report some quota errors as 403 with one of these reasons
+_RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """Rate limiter allowing bursts of `capacity` calls and `rate` calls per second on average.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum number of tokens, i.e. the largest burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Takes `tokens` tokens, sleeping until they are available. Callers are served in arrival order.
+
+        Returns:
+            float: Seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens may go negative: later callers then wait for the debt to be repaid first
+            self._tokens -= tokens
+            wait = max(0.0, -self._tokens / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """Fails fast while an upstream is down.
+
+        After `failure_threshold` consecutive failures the circuit opens and calls are refused for `reset_timeout`
+        seconds. Then a single trial call is let through (half open): its success closes the circuit, its failure
+        opens it again.
+
+        Args:
+            failure_threshold (int, optional): Consecutive failures opening the circuit. Defaults to 5.
+            reset_timeout (float, optional): Seconds the circuit stays open. Defaults to 30.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """"closed", "open" or "half_open"."""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be made."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_in_progress:
+                raise CircuitOpenError(f"circuit open, retry in {max(remaining, 0):.1f} s")
+            self._trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_progress = False
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header, given as seconds or as an HTTP date. None if unusable."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def http_status(exc: BaseException) -> Optional[int]:
+    """HTTP status of an error raised by requests or googleapiclient, without importing them. None if it has none."""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status
+    return getattr(getattr(exc, "resp", None), "status", None)
+
+
+def classify_error(exc: BaseException) -> tuple:
+    """Tells whether an exception raised by one of the upstream clients is transient.
+    Understands requests, googleapiclient and google.api_core (gRPC and Gemini) errors without importing them.
+
+    Returns:
+        tuple: (retryable, seconds requested by Retry-After or None)
+    """
+    # requests.HTTPError
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES, parse_retry_after(response.headers.get("Retry-After"))
+    # googleapiclient.errors.HttpError
+    resp = getattr(exc, "resp", None)
+    status = getattr(resp, "status", None)
+    if status is not None:
+        retryable = status in RETRYABLE_STATUSES or (
+            status == 403 and any(r in str(getattr(exc, "content", b"")) for r in _RATE_LIMIT_REASONS)
+        )
+        return retryable, parse_retry_after(resp.get("retry-after"))
+    # google.api_core.exceptions.GoogleAPICallError
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUSES, None
+    # Connection resets, timeouts (requests' ConnectionError and Timeout derive from OSError)
+    if isinstance(exc, (ConnectionError, TimeoutError)) or any(
+        cls.__name__ in ("ConnectionError", "Timeout") for cls in type(exc).__mro__
+    ):
+        return True, None
+    return False, None
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    Attributes:
+        max_retries (int): Retries after the first attempt.
+        base_delay (float): Upper bound of the first delay, in seconds; doubled at every retry.
+        max_delay (float): Upper bound of any delay, in seconds. Also caps Retry-After.
+    """
+
+    max_retries: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number `attempt` (starting at 1)."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            # Honour the server's request, plus some jitter so that waiting clients don't come back all at once
+            return min(self.max_delay, retry_after + backoff / 2)
+        return backoff
+
+
+class Upstream:
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        capacity: float,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        """Resilience settings and state of one upstream service, shared by all of its callers in the process.
+
+        Args:
+            name (str): Name of the upstream, e.g. "calendar".
+            rate (float): Calls per second allowed on average.
+            capacity (float): Largest burst of calls.
+            retry_policy (Optional[RetryPolicy], optional): Defaults to RetryPolicy().
+            breaker (Optional[CircuitBreaker], optional): Defaults to CircuitBreaker().
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate, capacity)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0, "throttled_seconds": 0.0}
+
+    def _count(self, name: str, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Calls func(*args, **kwargs) within the rate limit, retrying transient errors with backoff.
+
+        Raises:
+            CircuitOpenError: The upstream's circuit is open.
+            Exception: The error of the last attempt, or the first non-transient one.
+        """
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count("rejected")
+                raise
+            self._count("throttled_seconds", self.bucket.acquire())
+            self._count("calls")
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                retryable, retry_after = classify_error(e)
+                if not retryable:
+                    # The upstream answered; the request itself was wrong
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self._count("failures")
+                attempt += 1
+                if attempt > self.retry_policy.max_retries:
+                    raise
+                self._count("retries")
+                telemetry.current_span().retries = attempt
+                time.sleep(self.retry_policy.delay(attempt, retry_after))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, func: Callable, *args, **kwargs):
+        """Like call, for a coroutine function; waits without blocking the event loop."""
+        import asyncio
+
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count("rejected")
+                raise
+            self._count("throttled_seconds", await asyncio.to_thread(self.bucket.acquire))
+            self._count("calls")
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                retryable, retry_after = classify_error(e)
+                if not retryable:
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self._count("failures")
+                attempt += 1
+                if attempt > self.retry_policy.max_retries:
+                    raise
+                self._count("retries")
+                await asyncio.sleep(self.retry_policy.delay(attempt, retry_after))
+                continue
+            self.breaker.record_success()
+            return result
+
+
+# Default rates, from each service's quota for a single project
+DEFAULT_QUOTAS = {
+    # Calendar API: 600 requests per minute per user
+    "calendar": {"rate": 10.0, "capacity": 20},
+    # Secret Manager: 90,000 access requests per minute per project; leave room for other clients of the project
+    "secret_manager": {"rate": 50.0, "capacity": 100},
+    # Gemini free tier: 15 requests per minute for gemini-1.5-flash
+    "gemini": {"rate": 0.25, "capacity": 15},
+    # OpenWeather One Call 3.0 free plan: 60 calls per minute
+    "openweather": {"rate": 1.0, "capacity": 10},
+}
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def configure(name: str, rate: float, capacity: float, retry_policy: Optional[RetryPolicy] = None,
+              breaker: Optional[CircuitBreaker] = None) -> Upstream:
+    """Replaces the process-wide settings of upstream `name`. See Upstream for the arguments."""
+    upstream = Upstream(name, rate, capacity, retry_policy=retry_policy, breaker=breaker)
+    with _upstreams_lock:
+        _upstreams[name] = upstream
+    return upstream
+
+
+def get_upstream(name: str) -> Upstream:
+    """Returns the process-wide Upstream `name`, created from DEFAULT_QUOTAS on first use."""
+    with _upstreams_lock:
+        upstream = _upstreams.get(name)
+        if upstream is None:
+            quota = DEFAULT_QUOTAS.get(name, {"rate": 10.0, "capacity": 10})
+            upstream = _upstreams[name] = Upstream(name, **quota)
+        return upstream
+
+
+def call(upstream: str, func: Callable, *args, **kwargs):
+    """Shortcut for get_upstream(upstream).call(func, *args, **kwargs)."""
+    return get_upstream(upstream).call(func, *args, **kwargs)
@@ -1,40 +1,388 @@
-def start_up(args: dict):
-    """Flow for starting the app.
+def _login():
+    """Authenticates the locally logged in user.
 
-    Args:
-        args (dict): a dictionary of key word arguments to alter the start up.
+    Returns:
+        IdentityManager: the user's identity.
     """
-    # Authenticate user
     from device_modules.identity_manager import IdentityManager
     from pathlib import Path
 
     credential_json_path = Path(__file__).parent / "credentials.json"
-    user_id = IdentityManager.google_oauth2_login(
+    return IdentityManager.google_oauth2_login(
         credential_json_path=credential_json_path
     )
 
-    # Get user configuration data
+
+def _data_dir(data_dir=None):
+    """Directory holding a user's local state (caches and stores). Defaults to the src folder."""
+    from pathlib import Path
+
+    return Path(__file__).parent if data_dir is None else Path(data_dir)
+
+
+def _get_cfg(user_id, data_dir=None, offline_first=False):
+    """Fetches the configuration of the user identified by `user_id`; from the local cache only if `offline_first`."""
     from device_modules.secret_manager_caller import SecretManagerCaller
 
-    smc = SecretManagerCaller(user_id=user_id)
-    usercfg = smc.get_cfg()
+    smc = SecretManagerCaller(
+        user_id=user_id,
+        cfg_cache_path=_data_dir(data_dir) / ".cfg_cache",
+        offline_first=offline_first,
+    )
+    return smc.get_cfg()
 
-    # Check if workout event scheduled for today
+
+def _login_and_get_cfg():
+    """Authenticates the locally logged in user and fetches their configuration.
+
+    Returns:
+        tuple: (IdentityManager, UserCfg)
+    """
+    # Authenticate user
+    user_id = _login()
+
+    # Get user configuration data
+    usercfg = _get_cfg(user_id)
+    return user_id, usercfg
+
+
+def _write_journal(data_dir=None):
+    """Opens the user's local write journal of calendar inserts. Open it once per process and share it: every
+    WriteJournal object of a file keeps its own view of the queue."""
+    from device_modules.write_journal import WriteJournal
+
+    return WriteJournal(_data_dir(data_dir) / "calendar_journal.jsonl")
+
+
+def _open_store(stores, name, open_store):
+    """The store `name` of `stores`, opened with open_store() and added to it if missing. Without `stores` (None), a
+    new store is opened."""
+    if stores is None:
+        return open_store()
+    store = stores.get(name)
+    if store is None:
+        store = stores[name] = open_store()
+    return store
+
+
+def _calendar_manager(user_id, usercfg, data_dir=None, journal=None, offline_first=False, stores=None):
+    """Creates a GcalendarManager backed by the local calendar event store and, if `journal` (a WriteJournal) is
+    given, queuing its inserts in it. The event store is taken from, or added to, `stores` if given (see run_user_job)."""
     from device_modules.googlecalendar_manager import GcalendarManager
+    from device_modules.calendar_event_store import CalendarEventStore
+
+    calendar_id = usercfg.google_calendar_cfg.calender_id
+    if stores is not None and getattr(stores.get("event_store"), "calendar_id", calendar_id) != calendar_id:
+        # The user switched calendars; the store starts over with the new one
+        stores.pop("event_store").close()
+    event_store = _open_store(
+        stores,
+        "event_store",
+        lambda: CalendarEventStore(db_path=_data_dir(data_dir) / "calendar_events.sqlite3", calendar_id=calendar_id),
+    )
+    return GcalendarManager(
+        user_id=user_id,
+        usercfg=usercfg,
+        event_store=event_store,
+        journal=journal,
+        offline_first=offline_first,
+    )
+
+
+def _weather_caller(usercfg, data_dir=None, offline_first=False):
+    """Creates an OpenWeatherCaller keeping the latest forecast in the local weather snapshot."""
+    from device_modules.openweather_caller import OpenWeatherCaller
+
+    ow_cfg = usercfg.open_weather_cfg
+    return OpenWeatherCaller(
+        api_key=ow_cfg.api_key,
+        lat=ow_cfg.lat,
+        lon=ow_cfg.long,
+        snapshot_path=_data_dir(data_dir) / "weather_snapshot.npz",
+        offline_first=offline_first,
+    )
+
+
+def _ai_caller(user_id, usercfg, data_dir=None, event_store=None, stores=None):
+    """Creates a GoogleAICaller backed by the local response cache and, if an event store is given, by the workout
+    history and workout embedding index brought up to date with the store's past workouts. These are taken from, or
+    added to, `stores` if given (see run_user_job)."""
+    from device_modules.googleai_caller import GoogleAICaller
+    from device_modules.response_cache import ResponseCache
+
+    response_cache = _open_store(
+        stores, "response_cache", lambda: ResponseCache(_data_dir(data_dir) / "gemini_cache.sqlite3")
+    )
+    workout_history = None
+    workout_index = None
+    if event_store is not None:
+        from device_modules.workout_embeddings import WorkoutEmbeddingIndex
+        from device_modules.workout_history import WorkoutHistory
+
+        workout_history = _open_store(
+            stores, "workout_history", lambda: WorkoutHistory(_data_dir(data_dir) / "workout_history")
+        )
+        workout_history.sync(event_store)
+        workout_index = _open_store(
+            stores, "workout_index", lambda: WorkoutEmbeddingIndex(_data_dir(data_dir) / "workout_embeddings")
+        )
+        workout_index.sync(event_store)
+    return GoogleAICaller(
+        user_id=user_id,
+        usercfg=usercfg,
+        response_cache=response_cache,
+        workout_history=workout_history,
+        workout_index=workout_index,
+    )
+
+
+def run_user_job(user_id, data_dir=None, limit=None, offline_first=False, journal=None, stores=None):
+    """Checks the user's calendar for a workout and generates and schedules one if there is none.
+    The new event is queued in the user's write journal; insert it with the returned calendar manager's flusher.
+
+    Args:
+        user_id (IdentityManager): Identity of the user.
+        data_dir (Path, optional): Directory holding the user's local state. Defaults to the src folder.
+        limit (Callable, optional): Called with an upstream name ("secret_manager", "calendar" or "gemini"); must return a
+            context manager held while that upstream is called. Defaults to None (no limits).
+        offline_first (bool, optional): Decide from the local state (cached configuration and event store as last
+            synced) without calling Secret Manager or Calendar, and book the workout at the current time rather than
+            looking up free slots; see refresh_local_state. Defaults to False.
+        journal (WriteJournal, optional): The user's write journal, kept open by callers which run several jobs of the
+            user so that one flusher drains all of them. Defaults to None, which opens it from `data_dir`.
+        stores (dict, optional): The user's local stores by name (calendar event store, Gemini response cache, workout
+            history and embedding index), kept open by callers which run several jobs of the user. The job opens the
+            missing ones and adds them. Defaults to None, which opens them from `data_dir` for this job; they stay open
+            as long as the returned calendar manager (and its flusher) is used.
+
+    Returns:
+        GcalendarManager: The user's calendar manager.
+    """
+    import contextlib
 
-    gcm = GcalendarManager(user_id=user_id, usercfg=usercfg)
-    workout_scheduled_bool = gcm.check_for_workout()
+    if limit is None:
+
+        def limit(upstream):
+            return contextlib.nullcontext()
+
+    # Get user configuration data
+    with limit("secret_manager"):
+        usercfg = _get_cfg(user_id, data_dir, offline_first=offline_first)
+
+    # Check if workout event scheduled for today
+    if journal is None:
+        journal = _write_journal(data_dir)
+    gcm = _calendar_manager(user_id, usercfg, data_dir, journal=journal, offline_first=offline_first, stores=stores)
+    schedule = None
+    with limit("calendar"):
+        if not offline_first:
+            # Answers both whether a workout is planned and when the user is free
+            schedule = gcm.schedule()
+        workout_scheduled_bool = gcm.check_for_workout(schedule=schedule)
 
     # Generate workout using generative AI; store in calendar
     if not workout_scheduled_bool:
-        from device_modules.googleai_caller import GoogleAICaller
+        with limit("calendar"):
+            last_workout = gcm.get_last_workout_event() or {}
+        gai_caller = _ai_caller(user_id, usercfg, data_dir, gcm.event_store, stores=stores)
+        start = None
+        if schedule is not None:
+            # Book the first free hour of the user's calendars rather than "now"; now if they are fully booked
+            start = gcm.find_free_slot(schedule=schedule)
+        with limit("gemini"):
+            workout_text = gai_caller.get_workout_after(last_workout.get("description"), last_workout.get("id"))
+        # Durable once queued, whatever happens to the insert
+        gcm.create_workout_event(workout_text, start=start)
+    return gcm
+
+
+def refresh_local_state(user_id, gcm, data_dir=None):
+    """Brings the local state used by offline first runs up to date: event store, cached configuration and weather
+    snapshot. Upstreams which can't be reached are reported and skipped; the previous state stays in use."""
+    for name, refresh in (
+        ("calendar", lambda: gcm.sync_event_store(force=True)),
+        ("configuration", lambda: _get_cfg(user_id, data_dir)),
+        ("weather", lambda: _weather_caller(gcm.cfg, data_dir)),
+    ):
+        try:
+            refresh()
+        except Exception as e:
+            print(f"Could not refresh the local {name} state: {e!r}")
+
+
+def start_up(args: dict):
+    """Flow for starting the app.
+
+    Args:
+        args (dict): a dictionary of key word arguments to alter the start up.
+    """
+    # Authenticate user
+    user_id = _login()
+    offline_first = getattr(args, "offline_first", False)
+    gcm = run_user_job(user_id, offline_first=offline_first)
+
+    # The decision is made; insert the queued events (including those left by earlier runs) and refresh the local state.
+    # The journal is durable, so don't keep the user waiting on a struggling Calendar API: what isn't inserted within
+    # a few seconds is retried by the next run
+    if not gcm.flusher().drain(timeout=getattr(args, "flush_timeout", 3.0)):
+        print(f"{len(gcm.journal.pending())} calendar insert(s) still queued; they will be retried by the next run")
+    if offline_first:
+        refresh_local_state(user_id, gcm)
+
+
+def serve(args):
+    """Runs the multi-user scheduler daemon until interrupted.
+
+    Args:
+        args (Namespace): parsed command line arguments of the serve subcommand.
+    """
+    from daemon import SchedulerDaemon
 
-        gai_caller = GoogleAICaller(user_id=user_id, usercfg=usercfg)
-        workout_text = gai_caller.get_new_workout()
-        gcm.create_workout_event(workout_text)
+    daemon = SchedulerDaemon(
+        users_dir=args.users_dir,
+        run_at=args.run_at,
+        max_workers=args.workers,
+        upstream_limits={
+            "calendar": args.calendar_limit,
+            "secret_manager": args.secret_manager_limit,
+            "gemini": args.gemini_limit,
+        },
+        stats_interval=args.stats_interval,
+        watch_address=args.watch_address,
+        watch_port=args.watch_port,
+    )
+    daemon.run_forever(run_now=args.run_now)
+
+
+def _start_up_stages(stage_timeout: float = 60.0) -> list:
+    """Stages of the start up flow, with their dependencies made explicit for AsyncPipeline."""
+    from pipeline import Stage
+
+    def calendar(r):
+        gcm = _calendar_manager(r["login"], r["cfg"])
+        gcm.sync_event_store()
+        return gcm
+
+    def weather(r):
+        return _weather_caller(r["cfg"])
+
+    def ai_caller(r):
+        return _ai_caller(r["login"], r["cfg"], event_store=r["calendar"].event_store)
+
+    return [
+        Stage("login", lambda r: _login(), timeout=stage_timeout),
+        Stage("cfg", lambda r: _get_cfg(r["login"]), ("login",), stage_timeout),
+        Stage("calendar", calendar, ("login", "cfg"), stage_timeout),
+        # Prefetched for later use; the flow doesn't depend on it
+        Stage("weather", weather, ("cfg",), stage_timeout, required=False),
+        Stage("ai_caller", ai_caller, ("login", "cfg", "calendar"), stage_timeout),
+        Stage("schedule", lambda r: r["calendar"].schedule(), ("calendar",), stage_timeout),
+        Stage(
+            "workout_scheduled",
+            lambda r: r["calendar"].check_for_workout(schedule=r["schedule"]),
+            ("calendar", "schedule"),
+            stage_timeout,
+        ),
+        Stage(
+            "last_workout",
+            lambda r: r["calendar"].get_last_workout_event() or {},
+            ("calendar",),
+            stage_timeout,
+        ),
+        Stage(
+            "generate",
+            lambda r: r["ai_caller"].get_workout_after(
+                r["last_workout"].get("description"), r["last_workout"].get("id")
+            ),
+            ("ai_caller", "last_workout", "workout_scheduled"),
+            stage_timeout,
+            condition=lambda r: not r["workout_scheduled"],
+        ),
+        Stage(
+            "slot",
+            lambda r: r["calendar"].find_free_slot(schedule=r["schedule"]),
+            ("calendar", "schedule", "workout_scheduled"),
+            stage_timeout,
+            condition=lambda r: not r["workout_scheduled"],
+        ),
+        Stage(
+            "create_event",
+            lambda r: r["calendar"].create_workout_event(r["generate"], start=r["slot"]),
+            ("calendar", "generate", "slot"),
+            stage_timeout,
+        ),
+    ]
+
+
+def start_up_pipeline(args) -> dict:
+    """Flow for starting the app, run as an asyncio pipeline which overlaps the independent I/O stages.
+    Prints the per-stage timing breakdown.
+
+    Args:
+        args (Namespace): parsed command line arguments; `stage_timeout` sets the per-stage timeout in seconds.
+
+    Returns:
+        dict: results of the stages which completed, by stage name.
+    """
+    import asyncio
+    from pipeline import AsyncPipeline
+
+    pipeline = AsyncPipeline(_start_up_stages(getattr(args, "stage_timeout", 60.0)))
+    results = asyncio.run(pipeline.run())
+    print(pipeline.format_timings())
+    for name, error in pipeline.errors.items():
+        print(f"Stage {name} failed: {error!r}")
+    return results
+
+
+def plan_block(args):
+    """Generates a block of workouts, one per day at the first free hour from `args.hour` local time, and schedules all
+    of them in batched requests. The free hours of every day come from a single freeBusy query.
+
+    Args:
+        args (Namespace): parsed command line arguments with `days` and `hour`.
+    """
+    import datetime
+    from zoneinfo import ZoneInfo
+    user_id, usercfg = _login_and_get_cfg()
+    gcm = _calendar_manager(user_id, usercfg)
+
+    tz = ZoneInfo(usercfg.timezone_cfg.timezone)
+    first_day = datetime.datetime.now(tz).date() + datetime.timedelta(days=1)
+    schedule = gcm.schedule(days=args.days + 1)
+    start_times = []
+    for d in range(args.days):
+        preferred = datetime.datetime.combine(
+            first_day + datetime.timedelta(days=d), datetime.time(args.hour), tzinfo=tz
+        )
+        start = schedule.first_free_slot(after=preferred, days=1, day_start=datetime.time(args.hour))
+        start_times.append(preferred if start is None else start)
+
+    gai_caller = _ai_caller(user_id, usercfg, event_store=gcm.event_store)
+    workouts = gai_caller.plan_workout_block(
+        start_times, gcm=gcm, max_concurrency=args.concurrency
+    )
+    for result in gai_caller.last_batch_results:
+        if result.error is not None:
+            print(
+                f"{result.request.date.isoformat()}: not generated after {result.latency:.2f} s "
+                f"({result.error!r}), not scheduled"
+            )
+            continue
+        print(
+            f"{result.request.date.isoformat()}: generated in {result.latency:.2f} s, "
+            f"{result.prompt_tokens} prompt + {result.output_tokens} output tokens"
+        )
+    results = gcm.create_workout_events(workouts)
+    for (start, _), result in zip(workouts, results):
+        status = "scheduled" if result["event"] else f"failed ({result['error']})"
+        print(f"{start.isoformat()}: {status} after {result['attempts']} attempt(s)")
 
 
 def debug(args):
-    start_up(args)
+    if getattr(args, "pipeline", False):
+        start_up_pipeline(args)
+    else:
+        start_up(args)
 
     pass
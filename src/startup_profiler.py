@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+_SRC_DIR = Path(__file__).parent
+
+
+def parse_importtime(stderr: str) -> tuple:
+    """Splits the stderr of a `python -X importtime` run into import timings and the other lines.
+
+    Returns:
+        tuple: (dict of module name -> (self seconds, cumulative seconds), list of the other stderr lines)
+    """
+    timings = {}
+    other_lines = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, _, module = match.groups()
+            timings[module] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+        elif not line.startswith("import time:"):
+            other_lines.append(line)
+    return timings, other_lines
+
+
+def format_report(timings: dict, wall_time: float, top: int = 25) -> str:
+    """Formats the slowest imports and the wall time of a run."""
+    lines = [f"{'module':<60}{'self (ms)':>12}{'cumulative (ms)':>18}"]
+    slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)
+    for module, (self_s, cumulative_s) in slowest[:top]:
+        lines.append(f"{module:<60}{self_s * 1e3:>12.1f}{cumulative_s * 1e3:>18.1f}")
+    total_import = sum(self_s for self_s, _ in timings.values())
+    lines.append(f"total import time: {total_import * 1e3:.1f} ms")
+    lines.append(f"wall time: {wall_time * 1e3:.1f} ms")
+    return "\n".join(lines)
+
+
+def profile_startup(argv: list, top: int = 25) -> int:
+    """Re-runs main.py with `argv` under `python -X importtime` and reports import time per module and the wall time.
+
+    Args:
+        argv (list): Command line arguments for main.py, without --profile-startup.
+        top (int, optional): Number of modules to report. Defaults to 25.
+
+    Returns:
+        int: exit code of the profiled run.
+    """
+    start = time.perf_counter()
+    # stdin and stdout are inherited so interactive prompts keep working
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", str(_SRC_DIR / "main.py"), *argv],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    wall_time = time.perf_counter() - start
+    timings, other_lines = parse_importtime(completed.stderr)
+    for line in other_lines:
+        print(line, file=sys.stderr)
+    print(format_report(timings, wall_time, top=top))
+    return completed.returncode
+
+
+def import_timings(module: str) -> dict:
+    """Imports `module` in a fresh interpreter and returns the cumulative import time in seconds of every module this
+    imported, `module` included.
+
+    Raises:
+        ImportError: `module` can't be imported.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        text=True,
+        cwd=_SRC_DIR,
+    )
+    timings, other_lines = parse_importtime(completed.stderr)
+    if completed.returncode != 0 or module not in timings:
+        raise ImportError(f"importing {module} failed: {other_lines[-1:]}")
+    return {name: cumulative for name, (_, cumulative) in timings.items()}
+
+
+def measure_import_time(module: str) -> float:
+    """Imports `module` in a fresh interpreter and returns its cumulative import time in seconds.
+
+    Raises:
+        ImportError: `module` can't be imported.
+    """
+    return import_timings(module)[module]
+
+
+def check_import_budget(budgets: dict, repeat: int = 3) -> bool:
+    """Checks that importing each module stays within its time budget. The best of `repeat` fresh imports is used to
+    limit noise. Prints one line per module.
+
+    Args:
+        budgets (dict): Budget in milliseconds by module name, e.g. {"scripts": 50}.
+        repeat (int, optional): Number of measurements per module. Defaults to 3.
+
+    Returns:
+        bool: True if every module is within its budget.
+    """
+    ok = True
+    for module, budget_ms in budgets.items():
+        try:
+            elapsed_ms = min(measure_import_time(module) for _ in range(repeat)) * 1e3
+        except ImportError as e:
+            print(f"{module:<50}{'failed':>10}  {e}")
+            ok = False
+            continue
+        within = elapsed_ms <= budget_ms
+        ok = ok and within
+        status = "ok" if within else "OVER BUDGET"
+        print(f"{module:<50}{elapsed_ms:>10.1f} ms / {budget_ms:>7.1f} ms  {status}")
+    return ok
+
+
+# Modules on the "workout already scheduled, exit" path, which must not pull in the heavy SDKs when imported
+STARTUP_IMPORT_BUDGETS_MS = {
+    "scripts": 20,
+    "device_modules.identity_manager": 60,
+    "device_modules.secret_manager_caller": 150,
+    "device_modules.googlecalendar_manager": 80,
+    "device_modules.googleai_caller": 80,
+}
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import bisect
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+
+class Span:
+    """One outbound request. Attributes may be set inside the with block that times it.
+
+    Attributes:
+        upstream (str): Service called, e.g. "calendar", "secret_manager", "gemini", "openweather" or "oauth".
+        operation (str): Call made, e.g. "calendar.events.list".
+        bytes_sent (int): Size of the request payload.
+        bytes_received (int): Size of the response payload.
+        retries (int): Number of attempts beyond the first one.
+        cache (Optional[str]): "miss" if the request was made because of a cache miss, "revalidate" if it
+            revalidates a cached value. None if no cache was involved. Only written to the trace; cache lookups are
+            counted by cache_lookup.
+        status (Optional[str]): Outcome; "ok" or the name of the exception raised.
+        duration (float): Seconds spent in the with block.
+        detached (bool): The span is not made the current span of its thread while open (see span).
+    """
+
+    __slots__ = (
+        "upstream", "operation", "bytes_sent", "bytes_received", "retries", "cache", "status",
+        "start", "duration", "attempts", "attrs", "detached", "_telemetry", "_t0",
+    )
+
+    def __init__(self, telemetry: Telemetry, upstream: str, operation: str, detached: bool = False):
+        self._telemetry = telemetry
+        self.upstream = upstream
+        self.operation = operation
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.attempts = 0  # transport level attempts, counted by the HTTP transports
+        self.cache = None
+        self.status = None
+        self.start = None
+        self.duration = None
+        self.attrs = {}
+        self.detached = detached
+
+    def __enter__(self) -> Span:
+        self.start = time.time()
+        if not self.detached:
+            self._telemetry._push(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._t0
+        if self.status is None:
+            self.status = "ok" if exc_type is None else exc_type.__name__
+        self.retries = max(self.retries, self.attempts - 1)
+        if not self.detached:
+            self._telemetry._pop(self)
+        self._telemetry._record(self)
+        return False
+
+    def to_dict(self) -> dict:
+        record = {
+            "ts": self.start,
+            "upstream": self.upstream,
+            "operation": self.operation,
+            "duration": self.duration,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "retries": self.retries,
+            "cache": self.cache,
+            "status": self.status,
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        return record
+
+
+class _NoopSpan:
+    """Stand-in returned while telemetry is disabled; every attribute set on it is discarded."""
+
+    __slots__ = ()
+    bytes_sent = bytes_received = retries = attempts = 0
+    cache = status = None
+
+    @property
+    def attrs(self) -> dict:
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Telemetry:
+    def __init__(self, trace_path: Optional[Path | str] = None, metrics_path: Optional[Path | str] = None):
+        """Aggregates spans of outbound requests into counters and latency histograms, and optionally writes every span
+        (and cache lookup) to a JSON-lines trace. Use enable to install the process-wide instance used by `span`.
+
+        Args:
+            trace_path (Optional[Path | str], optional): JSON-lines file to which spans are appended. Defaults to None.
+            metrics_path (Optional[Path | str], optional): File written with the metrics in the Prometheus text format
+                by flush. Defaults to None.
+        """
+        self.trace_path = None if trace_path is None else Path(trace_path)
+        self.metrics_path = None if metrics_path is None else Path(metrics_path)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._trace_file = None if self.trace_path is None else open(self.trace_path, "a")
+        self._requests = {}  # (upstream, operation, status) -> count
+        self._histograms = {}  # (upstream, operation) -> [bucket counts, sum, count]
+        self._durations = {}  # upstream -> recent durations, for percentiles
+        self._bytes = {}  # (upstream, operation, direction) -> bytes
+        self._retries = {}  # (upstream, operation) -> retries
+        self._cache = {}  # (upstream, operation, result) -> count
+
+    def span(self, upstream: str, operation: str, detached: bool = False) -> Span:
+        return Span(self, upstream, operation, detached=detached)
+
+    def current_span(self) -> Optional[Span]:
+        """Innermost span open in the calling thread."""
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    def _push(self, span: Span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+
+    def _pop(self, span: Span):
+        stack = self._local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            # Spans of coroutines interleaved on one thread don't close in order
+            stack.remove(span)
+
+    def _record(self, span: Span):
+        op = (span.upstream, span.operation)
+        with self._lock:
+            key = op + (span.status,)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._histograms.get(op)
+            if histogram is None:
+                histogram = self._histograms[op] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            histogram[0][bisect.bisect_left(LATENCY_BUCKETS, span.duration)] += 1
+            histogram[1] += span.duration
+            histogram[2] += 1
+            durations = self._durations.setdefault(span.upstream, [])
+            durations.append(span.duration)
+            del durations[:-10000]
+            for direction, n in (("sent", span.bytes_sent), ("received", span.bytes_received)):
+                if n:
+                    key = op + (direction,)
+                    self._bytes[key] = self._bytes.get(key, 0) + n
+            if span.retries:
+                self._retries[op] = self._retries.get(op, 0) + span.retries
+            if self._trace_file is not None:
+                self._trace_file.write(json.dumps(span.to_dict()) + "\n")
+
+    def cache_lookup(self, upstream: str, operation: str, result: str):
+        """Counts a cache lookup ("hit", "miss", "coalesced", ...) which did not necessarily lead to a request."""
+        key = (upstream, operation, result)
+        with self._lock:
+            self._cache[key] = self._cache.get(key, 0) + 1
+            if self._trace_file is not None and result != "miss":
+                record = {"ts": time.time(), "upstream": upstream, "operation": operation, "cache": result}
+                self._trace_file.write(json.dumps(record) + "\n")
+
+    def summary(self) -> dict:
+        """Request count and p50/p95/p99/max latency (seconds) of the recent requests, by upstream."""
+        with self._lock:
+            durations = {upstream: sorted(values) for upstream, values in self._durations.items()}
+        summary = {}
+        for upstream, values in durations.items():
+            n = len(values)
+            summary[upstream] = {
+                "requests": n,
+                "p50": values[n // 2],
+                "p95": values[min(n - 1, int(n * 0.95))],
+                "p99": values[min(n - 1, int(n * 0.99))],
+                "max": values[-1],
+            }
+        return summary
+
+    def to_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+
+        def labels(**kwargs):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in kwargs.items()) + "}"
+
+        lines = []
+        with self._lock:
+            lines.append("# TYPE outbound_requests_total counter")
+            for (upstream, operation, status), n in sorted(self._requests.items()):
+                lines.append(f"outbound_requests_total{labels(upstream=upstream, operation=operation, status=status)} {n}")
+            lines.append("# TYPE outbound_request_duration_seconds histogram")
+            for (upstream, operation), (buckets, total, count) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f"outbound_request_duration_seconds_bucket{labels(upstream=upstream, operation=operation, le=le)} {cumulative}"
+                    )
+                lines.append(f"outbound_request_duration_seconds_sum{labels(upstream=upstream, operation=operation)} {total}")
+                lines.append(f"outbound_request_duration_seconds_count{labels(upstream=upstream, operation=operation)} {count}")
+            lines.append("# TYPE outbound_request_bytes_total counter")
+            for (upstream, operation, direction), n in sorted(self._bytes.items()):
+                lines.append(
+                    f"outbound_request_bytes_total{labels(upstream=upstream, operation=operation, direction=direction)} {n}"
+                )
+            lines.append("# TYPE outbound_request_retries_total counter")
+            for (upstream, operation), n in sorted(self._retries.items()):
+                lines.append(f"outbound_request_retries_total{labels(upstream=upstream, operation=operation)} {n}")
+            lines.append("# TYPE cache_lookups_total counter")
+            for (upstream, operation, result), n in sorted(self._cache.items()):
+                lines.append(f"cache_lookups_total{labels(upstream=upstream, operation=operation, result=result)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Flushes the trace file and rewrites the metrics file (atomically, for the Prometheus textfile collector)."""
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.flush()
+        if self.metrics_path is not None:
+            tmp_path = self.metrics_path.with_name(self.metrics_path.name + ".tmp")
+            tmp_path.write_text(self.to_prometheus())
+            tmp_path.replace(self.metrics_path)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+
+_telemetry: Optional[Telemetry] = None
+
+
+def enable(trace_path: Optional[Path | str] = None, metrics_path: Optional[Path | str] = None) -> Telemetry:
+    """Installs a process-wide Telemetry; spans are recorded from now on. See Telemetry for the arguments."""
+    global _telemetry
+    if _telemetry is not None:
+        _telemetry.close()
+    _telemetry = Telemetry(trace_path=trace_path, metrics_path=metrics_path)
+    return _telemetry
+
+
+def disable():
+    """Closes the process-wide Telemetry; spans are no-ops from now on."""
+    global _telemetry
+    if _telemetry is not None:
+        _telemetry.close()
+        _telemetry = None
+
+
+def get() -> Optional[Telemetry]:
+    """The process-wide Telemetry; None while disabled."""
+    return _telemetry
+
+
+def span(upstream: str, operation: str, detached: bool = False):
+    """Returns a context manager timing one outbound request, yielding the Span to annotate.
+    While telemetry is disabled this returns a shared no-op object, so instrumented code pays one function call.
+
+    Args:
+        upstream (str): Service called, e.g. "calendar".
+        operation (str): Call made, e.g. "calendar.events.list".
+        detached (bool, optional): Don't make the span the current one of the thread. Needed for spans held open across
+            generator yields: the consumer runs between two chunks, may open spans of its own, and may resume the
+            generator from another thread, which would corrupt the thread's stack of open spans. Defaults to False.
+    """
+    telemetry = _telemetry
+    if telemetry is None:
+        return _NOOP_SPAN
+    return telemetry.span(upstream, operation, detached=detached)
+
+
+def current_span():
+    """Innermost span open in the calling thread; a no-op span if there is none or telemetry is disabled."""
+    telemetry = _telemetry
+    if telemetry is None:
+        return _NOOP_SPAN
+    return telemetry.current_span() or _NOOP_SPAN
+
+
+def cache_lookup(upstream: str, operation: str, result: str):
+    """Counts a cache lookup; see Telemetry.cache_lookup. Does nothing while telemetry is disabled."""
+    telemetry = _telemetry
+    if telemetry is not None:
+        telemetry.cache_lookup(upstream, operation, result)
@@ -0,0 +1,76 @@
+import datetime
+import types
+
+import pytest
+
+import resilience
+from configurations.config_dataclasses import (
+    BaselineWeightsCfg,
+    GoogleAICfg,
+    GoogleCalendarCfg,
+    OpenWeatherCfg,
+    TimezoneCfg,
+    UserCfg,
+)
+from fakes import FakeCalendarService
+
+
+def workout_event(event_id: str, start: datetime.datetime, summary: str = "WORKOUT", description: str = "") -> dict:
+    """One hour event resource starting at `start` (timezone-aware)."""
+    return {
+        "id": event_id,
+        "summary": summary,
+        "description": description,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": (start + datetime.timedelta(hours=1)).isoformat()},
+    }
+
+
+@pytest.fixture(autouse=True)
+def default_upstreams():
+    """Restores the process-wide upstream settings a test may have replaced."""
+    yield
+    for name, quota in resilience.DEFAULT_QUOTAS.items():
+        resilience.configure(name, **quota)
+
+
+@pytest.fixture
+def fast_retries():
+    """Calendar upstream without rate limiting and with millisecond backoff."""
+    policy = resilience.RetryPolicy(max_retries=3, base_delay=0.001, max_delay=0.01)
+    return resilience.configure("calendar", rate=1000, capacity=1000, retry_policy=policy)
+
+
+@pytest.fixture
+def now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+
+@pytest.fixture
+def usercfg():
+    return UserCfg(
+        open_weather_cfg=OpenWeatherCfg(lat=0.0, long=0.0, api_key="key"),
+        google_calendar_cfg=GoogleCalendarCfg(calender_id="calendar"),
+        google_ai_cfg=GoogleAICfg(google_ai_id="key"),
+        timezone_cfg=TimezoneCfg(timezone="Europe/Paris"),
+        version="test",
+        baseline_weights_cfg=BaselineWeightsCfg(bp_weight=60.0, sq_weight=80.0, dl_weight=100.0),
+    )
+
+
+@pytest.fixture
+def calendar():
+    return FakeCalendarService()
+
+
+@pytest.fixture
+def make_gcm(calendar, usercfg, monkeypatch):
+    """Builds GcalendarManagers talking to the `calendar` fake instead of the Calendar API."""
+    from device_modules.googlecalendar_manager import GcalendarManager
+
+    monkeypatch.setattr(GcalendarManager, "service", property(lambda self: calendar))
+
+    def make(**kwargs):
+        return GcalendarManager(types.SimpleNamespace(creds=None), usercfg, **kwargs)
+
+    return make
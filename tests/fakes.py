@@ -0,0 +1,448 @@
+"""Local stand-ins for the upstream APIs: an HTTP API which injects errors, to exercise the retry, rate limiting and
+circuit breaking of resilience.py, and in-memory Calendar, Secret Manager and Gemini clients, so that the tests
+neither call (nor are billed by) the real services nor need the Google SDKs.
+"""
+from __future__ import annotations
+
+import json
+import random
+import re
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+class FakeUpstream:
+    def __init__(
+        self,
+        body: dict,
+        script: Optional[list] = None,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        retry_after: Optional[float] = None,
+        seed: int = 0,
+        batch_script: Optional[list] = None,
+        etag: Optional[str] = None,
+        delay: float = 0.0,
+    ):
+        """JSON API on 127.0.0.1 answering every GET with `body` (or 304 Not Modified, see etag), or with an injected error. A POST is a batch request
+        (multipart/mixed, like the Google APIs batch endpoint): it fails as a whole like a GET would, or answers each
+        of its sub-requests, echoing the sub-request's body on success.
+
+        Args:
+            body (dict): Response body of successful requests.
+            script (Optional[list], optional): HTTP statuses of the first requests, in order, e.g. [503, 429, 200].
+                Used before error_rate applies. Defaults to None.
+            error_rate (float, optional): Probability that a request (after the script) fails. Defaults to 0.0.
+            error_status (int, optional): Status of the failures drawn with error_rate. Defaults to 503.
+            retry_after (Optional[float], optional): Retry-After header (seconds) sent with 429 and 503 errors. Defaults to None.
+            seed (int, optional): Seed of the error draws. Defaults to 0.
+            batch_script (Optional[list], optional): HTTP statuses of the first sub-requests of batch requests, in
+                order; the following ones succeed. Defaults to None.
+            etag (Optional[str], optional): ETag header of successful GETs; a GET whose If-None-Match matches it is
+                answered 304 Not Modified. Defaults to None.
+            delay (float, optional): Seconds to wait before answering, e.g. to overlap concurrent requests. Defaults to 0.0.
+        """
+        self.body = json.dumps(body).encode()
+        self.batch_script = list(batch_script or [])
+        self.sub_requests = []  # (request line, status) of every sub-request of a batch
+        self.script = list(script or [])
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.etag = etag
+        self.delay = delay
+        self.requests = []  # (time, path, status) of every request
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _next_status(self) -> int:
+        with self._lock:
+            if self.script:
+                return self.script.pop(0)
+            return self.error_status if self._random.random() < self.error_rate else 200
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(upstream.delay)
+                status = upstream._next_status()
+                if status == 200 and upstream.etag is not None and self.headers.get("If-None-Match") == upstream.etag:
+                    status = 304
+                with upstream._lock:
+                    upstream.requests.append((time.monotonic(), self.path, status))
+                body = {200: upstream.body, 304: b""}.get(status) or json.dumps({"error": status}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status in (200, 304) and upstream.etag is not None:
+                    self.send_header("ETag", upstream.etag)
+                if status in (429, 503) and upstream.retry_after is not None:
+                    self.send_header("Retry-After", str(upstream.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                time.sleep(upstream.delay)
+                status = upstream._next_status()
+                with upstream._lock:
+                    upstream.requests.append((time.monotonic(), self.path, status))
+                content = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if status != 200:
+                    body = json.dumps({"error": status}).encode()
+                    content_type = "application/json"
+                else:
+                    body = upstream._batch_response(self.headers["Content-Type"], content)
+                    content_type = "multipart/mixed; boundary=batch_response"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _batch_response(self, content_type: str, content: bytes) -> bytes:
+        """multipart/mixed answer to the sub-requests of a batch request."""
+        from email.parser import BytesParser
+
+        message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + content)
+        parts = []
+        for part in message.get_payload():
+            head, sub_body = re.split(r"\r?\n\r?\n", part.get_payload(), maxsplit=1)
+            request_line = head.splitlines()[0]
+            with self._lock:
+                status = self.batch_script.pop(0) if self.batch_script else 200
+                self.sub_requests.append((request_line, status))
+            sub_body = sub_body if status == 200 else json.dumps({"error": {"code": status}})
+            parts.append(
+                "--batch_response\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                "Content-Type: application/json\r\n\r\n"
+                f"{sub_body}\r\n"
+            )
+        return ("".join(parts) + "--batch_response--\r\n").encode()
+
+    def start(self) -> FakeUpstream:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> FakeUpstream:
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def synthetic_onecall(rng: random.Random) -> dict:
+    """One Call 3.0 response shaped like the real ones (48 hourly and 8 daily forecasts), with random temperatures."""
+    import datetime
+
+    now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    return {
+        "current": {"dt": now, "temp": 280 + rng.random() * 10},
+        "hourly": [{"dt": now + 3600 * i, "temp": 270 + rng.random() * 30} for i in range(48)],
+        "daily": [
+            {"dt": now + 86400 * i, "temp": {"min": 265 + rng.random() * 5, "max": 285 + rng.random() * 10}}
+            for i in range(8)
+        ],
+    }
+
+
+class FakeHttpError(Exception):
+    def __init__(self, status: int, content: bytes = b""):
+        """Error shaped like googleapiclient.errors.HttpError (a `resp` dict with a `status`), for code which
+        inspects errors without importing the SDK (see resilience.classify_error)."""
+        super().__init__(f"HTTP {status}")
+        self.resp = _FakeResponse(status=status)
+        self.content = content
+
+
+class _FakeResponse(dict):
+    def __init__(self, status: int):
+        super().__init__()
+        self.status = status
+
+
+class _FakeRequest:
+    def __init__(self, execute: Callable[[], dict]):
+        self.headers = {}
+        self._execute = execute
+
+    def execute(self):
+        return self._execute()
+
+
+class _FakeBatch:
+    def __init__(self, callback: Callable):
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: _FakeRequest, request_id: str):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self._requests:
+            try:
+                response, exception = request.execute(), None
+            except Exception as e:
+                response, exception = None, e
+            self._callback(request_id, response, exception)
+
+
+class FakeCalendarService:
+    def __init__(self, events: Optional[list] = None):
+        """In-memory stand-in for the parts of the Calendar API service object this project uses: events().list (with
+        time bounds, ordering, pagination and sync tokens), events().insert, events().watch, channels().stop,
+        freebusy().query and batches of inserts. Every calendar id shares the same events.
+
+        Args:
+            events (Optional[list], optional): Initial event resources, with id, start and end. Defaults to None.
+        """
+        self.calls = []  # (method, kwargs) of every request built
+        self.stopped = []  # ids of the stopped channels
+        self.insert_errors = []  # statuses raised by the next inserts, in order, e.g. [503, 400]
+        self.expire_sync_tokens = False  # answer 410 Gone to requests carrying a sync token
+        self._events = {}  # id -> event resource
+        self._changed_at = {}  # id -> version of its last change
+        self._version = 0
+        self._lock = threading.Lock()
+        for event in events or []:
+            self._store(event)
+
+    def _store(self, event: dict):
+        self._version += 1
+        self._events[event["id"]] = event
+        self._changed_at[event["id"]] = self._version
+
+    def add_event(self, event: dict):
+        """Adds or changes an event, as done from another client."""
+        with self._lock:
+            self._store(event)
+
+    def delete_event(self, event_id: str):
+        with self._lock:
+            self._store({**self._events[event_id], "status": "cancelled"})
+
+    @property
+    def events_by_id(self) -> dict:
+        with self._lock:
+            return {i: e for i, e in self._events.items() if e.get("status") != "cancelled"}
+
+    def events(self) -> FakeCalendarService:
+        return self
+
+    def channels(self) -> FakeCalendarService:
+        return self
+
+    def freebusy(self) -> FakeCalendarService:
+        return self
+
+    def new_batch_http_request(self, callback: Callable) -> _FakeBatch:
+        return _FakeBatch(callback)
+
+    def list(self, **kwargs) -> _FakeRequest:
+        self.calls.append(("events.list", kwargs))
+        return _FakeRequest(lambda: self._list(**kwargs))
+
+    def _list(self, calendarId: str, syncToken: Optional[str] = None, timeMin: Optional[str] = None,
+              timeMax: Optional[str] = None, q: Optional[str] = None, maxResults: int = 250,
+              pageToken: Optional[str] = None, **kwargs) -> dict:
+        from device_modules.calendar_event_store import parse_event_time
+
+        with self._lock:
+            if syncToken is not None:
+                if self.expire_sync_tokens:
+                    raise FakeHttpError(410)
+                since = int(syncToken.split("-")[1])
+                events = [e for i, e in self._events.items() if self._changed_at[i] > since]
+            else:
+                events = [e for e in self._events.values() if e.get("status") != "cancelled"]
+            version = self._version
+        # Like the API, timeMin bounds the end of the events and timeMax their start
+        if timeMin is not None:
+            events = [e for e in events if parse_event_time(e["end"]) > parse_event_time({"dateTime": timeMin})]
+        if timeMax is not None:
+            events = [e for e in events if parse_event_time(e["start"]) < parse_event_time({"dateTime": timeMax})]
+        if q is not None:
+            events = [e for e in events if q.lower() in (e.get("summary", "") + e.get("description", "")).lower()]
+        if kwargs.get("orderBy") == "startTime":
+            events.sort(key=lambda e: parse_event_time(e["start"]))
+        offset = int(pageToken or 0)
+        page = {"items": events[offset : offset + maxResults]}
+        if offset + maxResults < len(events):
+            page["nextPageToken"] = str(offset + maxResults)
+        elif timeMin is None and timeMax is None and q is None and "orderBy" not in kwargs:
+            page["nextSyncToken"] = f"token-{version}"
+        return page
+
+    def insert(self, calendarId: str, body: dict) -> _FakeRequest:
+        self.calls.append(("events.insert", {"calendarId": calendarId, "body": body}))
+
+        def execute():
+            with self._lock:
+                if self.insert_errors:
+                    raise FakeHttpError(self.insert_errors.pop(0))
+                if body["id"] in self._events:
+                    raise FakeHttpError(409)
+                self._store(body)
+            return body
+
+        return _FakeRequest(execute)
+
+    def query(self, body: dict) -> _FakeRequest:
+        self.calls.append(("freebusy.query", {"body": body}))
+
+        def execute():
+            from device_modules.calendar_event_store import parse_event_time
+
+            time_min = parse_event_time({"dateTime": body["timeMin"]})
+            time_max = parse_event_time({"dateTime": body["timeMax"]})
+            busy = [
+                {"start": e["start"]["dateTime"], "end": e["end"]["dateTime"]}
+                for e in self.events_by_id.values()
+                if parse_event_time(e["end"]) > time_min and parse_event_time(e["start"]) < time_max
+            ]
+            busy.sort(key=lambda b: b["start"])
+            return {"calendars": {item["id"]: {"busy": busy} for item in body["items"]}}
+
+        return _FakeRequest(execute)
+
+    def watch(self, calendarId: str, body: dict) -> _FakeRequest:
+        self.calls.append(("events.watch", {"calendarId": calendarId, "body": body}))
+        expiration_ms = int((time.time() + int(body["params"]["ttl"])) * 1000)
+        return _FakeRequest(lambda: {"kind": "api#channel", "id": body["id"], "resourceId": f"resource-{body['id']}",
+                                     "expiration": str(expiration_ms)})
+
+    def stop(self, body: dict) -> _FakeRequest:
+        self.calls.append(("channels.stop", {"body": body}))
+        self.stopped.append(body["id"])
+        return _FakeRequest(dict)
+
+
+class FakeNotFound(Exception):
+    """Stand-in for google.api_core.exceptions.NotFound."""
+
+    code = 404
+
+
+class FakeAlreadyExists(Exception):
+    """Stand-in for google.api_core.exceptions.AlreadyExists."""
+
+    code = 409
+
+
+class FakeSecretManagerClient:
+    def __init__(self):
+        """In-memory stand-in for the methods of secretmanager.SecretManagerServiceClient used by SecretManagerCaller.
+        It raises FakeNotFound and FakeAlreadyExists, which the caller module's api_exceptions must be pointed at.
+        """
+        self.calls = []  # method name of every request
+        self.secrets = {}  # secret id -> list of versions, each a dict with data (bytes) and enabled
+
+    @staticmethod
+    def secret_path(project_id: str, secret_id: str) -> str:
+        return f"projects/{project_id}/secrets/{secret_id}"
+
+    def _version(self, name: str) -> tuple:
+        """(full version name, version) of a version name, resolving "latest" to the last enabled version."""
+        _, project_id, _, secret_id, _, version_id = name.split("/")
+        versions = self.secrets.get(secret_id)
+        if versions is None:
+            raise FakeNotFound(name)
+        numbers = range(len(versions), 0, -1) if version_id == "latest" else [int(version_id)]
+        for number in numbers:
+            if 0 < number <= len(versions) and versions[number - 1]["enabled"]:
+                return f"{self.secret_path(project_id, secret_id)}/versions/{number}", versions[number - 1]
+        raise FakeNotFound(name)
+
+    def create_secret(self, request: dict):
+        self.calls.append("create_secret")
+        if request["secret_id"] in self.secrets:
+            raise FakeAlreadyExists(request["secret_id"])
+        self.secrets[request["secret_id"]] = []
+        return types.SimpleNamespace(name=f"{request['parent']}/secrets/{request['secret_id']}")
+
+    def add_secret_version(self, request: dict):
+        self.calls.append("add_secret_version")
+        versions = self.secrets.get(request["parent"].split("/")[-1])
+        if versions is None:
+            raise FakeNotFound(request["parent"])
+        versions.append({"data": request["payload"]["data"], "enabled": True})
+        return types.SimpleNamespace(name=f"{request['parent']}/versions/{len(versions)}", etag=f'"{len(versions)}"')
+
+    def get_secret(self, name: str):
+        self.calls.append("get_secret")
+        if name.split("/")[-1] not in self.secrets:
+            raise FakeNotFound(name)
+        return types.SimpleNamespace(name=name)
+
+    def get_secret_version(self, name: str):
+        self.calls.append("get_secret_version")
+        full_name, _ = self._version(name)
+        return types.SimpleNamespace(name=full_name, etag=f'"{full_name.split("/")[-1]}"')
+
+    def access_secret_version(self, name: str):
+        self.calls.append("access_secret_version")
+        full_name, version = self._version(name)
+        return types.SimpleNamespace(name=full_name, payload=types.SimpleNamespace(data=version["data"]))
+
+
+class FakeGenerativeModel:
+    def __init__(self, text: str = "Bench press: 80 kg. 3 sets, 5 repetitions in each set.", chunk_size: int = 16):
+        """Stand-in for genai.GenerativeModel answering every prompt with `text`, streamed in chunks of `chunk_size`
+        characters, and counting a token per 4 characters.
+
+        Attributes:
+            fail_when (Callable[[str], Optional[Exception]]): Called with every prompt; the exception returned, if
+                any, is raised instead of answering.
+        """
+        self.text = text
+        self.chunk_size = chunk_size
+        self.prompts = []  # every prompt received
+        self.fail_when = lambda prompt: None
+
+    def _response(self, prompt: str, text: str):
+        return types.SimpleNamespace(
+            text=text,
+            usage_metadata=types.SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4),
+        )
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        self.prompts.append(prompt)
+        error = self.fail_when(prompt)
+        if error is not None:
+            raise error
+        if not stream:
+            return self._response(prompt, self.text)
+        return iter(
+            [self._response(prompt, self.text[i : i + self.chunk_size]) for i in range(0, len(self.text), self.chunk_size)]
+        )
+
+    async def generate_content_async(self, prompt: str, **kwargs):
+        return self.generate_content(prompt, **kwargs)
+
+    def count_tokens(self, text: str):
+        self.prompts.append(text)
+        return types.SimpleNamespace(total_tokens=-(-len(text) // 4))
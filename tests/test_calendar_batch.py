@@ -0,0 +1,75 @@
+import datetime
+import json
+
+import pytest
+
+import resilience
+from fakes import FakeUpstream
+
+googleapiclient_http = pytest.importorskip("googleapiclient.http")
+httplib2 = pytest.importorskip("httplib2")
+
+
+class CalendarHttpService:
+    """Calendar service whose events().insert builds real googleapiclient requests to `url`, so that batches go
+    through BatchHttpRequest and HTTP."""
+
+    def __init__(self, url: str):
+        from googleapiclient.model import JsonModel
+
+        self.url = url
+        self.http = httplib2.Http()
+        self._model = JsonModel(data_wrapper=False)
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId: str, body: dict):
+        return googleapiclient_http.HttpRequest(
+            self.http,
+            self._model.response,
+            f"{self.url}/calendar/v3/calendars/{calendarId}/events",
+            method="POST",
+            body=json.dumps(body),
+            headers={"content-type": "application/json"},
+            methodId="calendar.events.insert",
+        )
+
+
+@pytest.fixture
+def server():
+    with FakeUpstream({}) as server:
+        yield server
+
+
+@pytest.fixture
+def calendar(server):
+    return CalendarHttpService(server.url)
+
+
+@pytest.fixture
+def workouts(now):
+    return [(now + datetime.timedelta(days=d), f"day {d}") for d in range(3)]
+
+
+def test_batch_goes_through_the_batch_endpoint(make_gcm, server, workouts, fast_retries):
+    server.batch_script = [503, 400]  # first batch: workout 0 unavailable, workout 1 invalid
+
+    results = make_gcm().create_workout_events(workouts, batch_uri=f"{server.url}/batch/calendar/v3")
+
+    assert [r["attempts"] for r in results] == [2, 1, 1]
+    assert [r["event"]["summary"] for r in (results[0], results[2])] == ["WORKOUT", "WORKOUT"]
+    assert results[1]["event"] is None and resilience.http_status(results[1]["error"]) == 400
+    assert [path for _, path, _ in server.requests] == ["/batch/calendar/v3"] * 2
+    assert len(server.sub_requests) == 4
+
+
+def test_failed_batch_request_fails_each_workout(make_gcm, server, workouts, fast_retries):
+    server.error_rate = 1.0
+
+    results = make_gcm().create_workout_events(workouts, batch_uri=f"{server.url}/batch/calendar/v3", max_retries=0)
+
+    assert all(r["event"] is None and resilience.http_status(r["error"]) == 503 for r in results)
+    assert [r["attempts"] for r in results] == [1, 1, 1]
+    assert len(server.requests) == 4  # the batch request and the Calendar upstream's 3 retries
+    assert server.sub_requests == []
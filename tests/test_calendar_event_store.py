@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+
+from conftest import workout_event
+from device_modules.calendar_event_store import CalendarEventStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CalendarEventStore(tmp_path / "events.sqlite3", "calendar")
+    yield store
+    store.close()
+
+
+def test_sync_downloads_only_the_changes(store, calendar, now):
+    calendar.add_event(workout_event("a", now - datetime.timedelta(days=2)))
+    calendar.add_event(workout_event("b", now - datetime.timedelta(days=1)))
+    assert store.sync(calendar) == 2
+
+    calendar.add_event(workout_event("c", now + datetime.timedelta(hours=2)))
+    calendar.delete_event("a")
+    assert store.sync(calendar) == 2
+    assert [e["id"] for e in store.events_between(0, now.timestamp() + 86400)] == ["b", "c"]
+    assert "syncToken" in calendar.calls[-1][1]
+
+
+def test_expired_sync_token_triggers_a_full_sync(store, calendar, now):
+    calendar.add_event(workout_event("a", now))
+    store.sync(calendar)
+    calendar.expire_sync_tokens = True
+    calendar.add_event(workout_event("b", now))
+
+    store.sync(calendar)
+
+    assert "syncToken" not in calendar.calls[-1][1]
+    assert {e["id"] for e in store.events_between(0, now.timestamp() + 86400)} == {"a", "b"}
+
+
+def test_failed_sync_leaves_the_store_changed(store, calendar, now, monkeypatch):
+    store.sync(calendar)
+    store.set_watched_until(now.timestamp() + 3600)
+    assert store.up_to_date
+
+    def fail(**kwargs):
+        raise ConnectionError("reset")
+
+    monkeypatch.setattr(calendar, "list", fail)
+    with pytest.raises(ConnectionError):
+        store.sync(calendar)
+    assert not store.up_to_date
+
+
+def test_last_workout_skips_other_events(make_gcm, calendar, store, now):
+    calendar.add_event(workout_event("w", now - datetime.timedelta(days=3), description="bench press 5x5"))
+    calendar.add_event(workout_event("d", now - datetime.timedelta(days=1), summary="Dentist", description="checkup"))
+    gcm = make_gcm(event_store=store)
+
+    assert gcm.get_last_workout() == "bench press 5x5"
+
+
+def test_summary_queries_use_the_start_time_index(tmp_path):
+    import sqlite3
+
+    path = tmp_path / "events.sqlite3"
+    with sqlite3.connect(path) as conn:
+        # Created by earlier versions
+        conn.executescript(CalendarEventStore._SCHEMA)
+        conn.execute("CREATE INDEX events_summary_start_ts ON events (summary, start_ts)")
+    conn.close()
+    store = CalendarEventStore(path, "calendar")
+
+    indices = [row[0] for row in store._conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    plan = store._conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM events WHERE start_ts < ? AND instr(summary, ?) > 0 "
+        "ORDER BY start_ts DESC LIMIT 1",
+        (0.0, "WORKOUT"),
+    ).fetchall()
+    store.close()
+
+    assert "events_summary_start_ts" not in indices
+    assert any("USING INDEX events_start_ts" in row[-1] for row in plan)
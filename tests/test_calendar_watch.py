@@ -0,0 +1,104 @@
+import types
+
+import pytest
+
+from device_modules.calendar_event_store import CalendarEventStore
+from device_modules.calendar_watch import CalendarWatcher, NotificationReceiver, post_notification
+
+
+@pytest.fixture
+def receiver():
+    with NotificationReceiver() as receiver:
+        yield receiver
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CalendarEventStore(tmp_path / "events.sqlite3", "calendar")
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def gcm(calendar, store):
+    return types.SimpleNamespace(CALENDAR_ID="calendar", service=calendar, event_store=store)
+
+
+@pytest.fixture
+def make_watcher(gcm, receiver, tmp_path):
+    def make(**kwargs):
+        return CalendarWatcher(gcm, receiver, receiver.url, tmp_path / "channel.json", **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def watched(make_watcher, calendar, store, receiver):
+    """A watcher whose channel's sync message was received after the store was synced."""
+    watcher = make_watcher(ttl=3600, renew_before=60)
+    channel = watcher.watch()
+    store.sync(calendar)
+    assert post_notification(receiver.url, channel, state="sync") == 200
+    return watcher
+
+
+def test_unwatched_store_is_always_synced(calendar, store):
+    store.sync(calendar)
+
+    assert not store.up_to_date
+
+
+def test_new_channel_forces_a_sync(make_watcher, calendar, store):
+    store.sync(calendar)
+
+    make_watcher().watch()
+
+    assert not store.up_to_date
+
+
+def test_sync_message_marks_the_store_up_to_date(watched, store):
+    assert store.up_to_date
+
+
+def test_change_notification_invalidates_the_store(watched, store, receiver):
+    assert post_notification(receiver.url, watched.channel, state="exists", message_number=2) == 200
+
+    assert not store.up_to_date
+
+
+def test_bad_token_and_unknown_channel_are_refused(watched, store, receiver):
+    unknown = types.SimpleNamespace(**{**vars(watched.channel), "id": "unknown"})
+
+    assert post_notification(receiver.url, watched.channel, token="wrong") == 403
+    assert post_notification(receiver.url, unknown) == 403
+    assert store.up_to_date
+
+
+def test_channel_is_renewed_before_expiry(watched, calendar, receiver):
+    old_channel = watched.channel
+    watched.renew_before = 7200
+
+    assert watched.renew_if_due()
+
+    assert watched.channel.id != old_channel.id
+    assert calendar.stopped == [old_channel.id]
+    assert post_notification(receiver.url, old_channel) == 403
+
+
+def test_channel_token_is_readable_by_the_user_only(watched, tmp_path):
+    assert (tmp_path / "channel.json").stat().st_mode & 0o777 == 0o600
+
+
+def test_restored_channel_forces_a_sync(watched, make_watcher, store):
+    restored = make_watcher()
+
+    assert restored.channel == watched.channel
+    assert not store.up_to_date
+
+
+def test_stopped_channel_no_longer_skips_syncs(watched, calendar, store, tmp_path):
+    watched.stop()
+    store.sync(calendar)
+
+    assert not store.up_to_date
+    assert not (tmp_path / "channel.json").exists()
@@ -0,0 +1,27 @@
+import threading
+import types
+
+from device_modules.credential_store import CredentialRefresher
+
+
+def test_refresher_keeps_running_after_an_unexpected_error(monkeypatch):
+    refresher = CredentialRefresher(types.SimpleNamespace(expiry=None), store=None, retry_interval=0.01)
+    errors = [ValueError("corrupt token file")]
+    refreshed = threading.Event()
+    recorded = []
+
+    def refresh_if_needed():
+        if errors:
+            raise errors.pop()
+        recorded.append(refresher.last_error)
+        refreshed.set()
+
+    monkeypatch.setattr(refresher, "refresh_if_needed", refresh_if_needed)
+
+    refresher.start()
+    try:
+        assert refreshed.wait(5)
+    finally:
+        refresher.stop()
+    assert isinstance(recorded[0], ValueError)
+    assert refresher.last_error is None
@@ -0,0 +1,93 @@
+import datetime
+import time
+import types
+from zoneinfo import ZoneInfo
+
+from daemon import SchedulerDaemon, UserSession
+
+NEW_YORK = ZoneInfo("America/New_York")
+
+
+def session(timezone=None, run_at=datetime.time(6)):
+    return UserSession(name="user", user_dir=None, run_at=run_at, timezone=timezone)
+
+
+def test_next_run_is_in_the_users_timezone():
+    after = datetime.datetime(2026, 6, 1, 12, tzinfo=datetime.timezone.utc)  # 08:00 in New York
+
+    run = SchedulerDaemon._next_run(session("America/New_York"), after)
+
+    assert datetime.datetime.fromtimestamp(run, NEW_YORK) == datetime.datetime(2026, 6, 2, 6, tzinfo=NEW_YORK)
+
+
+def test_next_run_follows_daylight_saving_time():
+    # Clocks go forward on March 8, 2026 in New York: that day is 23 hours long
+    after = datetime.datetime(2026, 3, 7, 6, 30, tzinfo=NEW_YORK)
+
+    run = SchedulerDaemon._next_run(session("America/New_York"), after)
+
+    assert run - after.timestamp() == 22.5 * 3600
+    assert datetime.datetime.fromtimestamp(run, NEW_YORK).time() == datetime.time(6)
+
+
+def test_next_run_uses_the_host_timezone_until_the_users_is_known():
+    after = datetime.datetime.now().astimezone()
+
+    run = datetime.datetime.fromtimestamp(SchedulerDaemon._next_run(session(), after)).astimezone()
+
+    assert run.time() == datetime.time(6) and 0 < run.timestamp() - after.timestamp() <= 86400
+
+
+def test_runs_are_planned_again_once_the_timezone_is_known(tmp_path):
+    (tmp_path / "user" / "credentials.json").parent.mkdir()
+    (tmp_path / "user" / "credentials.json").write_text("{}")
+    daemon = SchedulerDaemon(tmp_path)
+    daemon.load_users()
+
+    daemon._sessions["user"].timezone = "Pacific/Kiritimati"  # UTC+14
+    daemon._replan.add("user")
+    daemon._replan_runs()
+
+    (run, name), = daemon._heap
+    expected = SchedulerDaemon._next_run(daemon._sessions["user"])
+    assert name == "user" and run == expected
+    assert datetime.datetime.fromtimestamp(run, ZoneInfo("Pacific/Kiritimati")).time() == datetime.time(6)
+
+
+def test_jobs_of_a_user_share_one_journal_flusher_and_event_store(tmp_path, make_gcm, calendar, usercfg, monkeypatch):
+    import scripts
+    from device_modules.googlecalendar_manager import GcalendarManager
+
+    event_stores = []
+    calendar_manager = scripts._calendar_manager
+
+    def recording_calendar_manager(*args, **kwargs):
+        gcm = calendar_manager(*args, **kwargs)
+        event_stores.append(gcm.event_store)
+        return gcm
+
+    monkeypatch.setattr(scripts, "_calendar_manager", recording_calendar_manager)
+    monkeypatch.setattr(scripts, "_get_cfg", lambda user_id, data_dir=None, offline_first=False: usercfg)
+    monkeypatch.setattr(
+        scripts, "_ai_caller", lambda *args, **kwargs: types.SimpleNamespace(get_workout_after=lambda last, last_id=None: "Squat")
+    )
+    # Every job generates a workout, even if the previous one was booked
+    monkeypatch.setattr(GcalendarManager, "check_for_workout", lambda self, **kwargs: False)
+    daemon = SchedulerDaemon(tmp_path)
+    user = UserSession(name="user", user_dir=tmp_path, run_at=datetime.time(6), user_id=types.SimpleNamespace(creds=None))
+
+    try:
+        for _ in range(2):
+            daemon._queued += 1
+            daemon._run_job(user, time.perf_counter())
+        assert daemon._completed == 2 and user.flusher.journal is user.journal
+        assert event_stores == [user.stores["event_store"]] * 2
+        assert user.flusher.drain(timeout=5)
+    finally:
+        user.flusher.stop()
+        user.journal.close()
+        for store in user.stores.values():
+            store.close()
+
+    assert len(calendar.events_by_id) == 2
+    assert scripts._write_journal(tmp_path).pending() == []
@@ -0,0 +1,110 @@
+import json
+import os
+import re
+
+import pytest
+
+from device_modules.exercise_classifier import ExerciseClassifier, _singular, load_classifier, normalize
+
+CATALOG = {
+    "push": ["bench press", "press", "dip"],
+    "pull": ["row", "pull up", "bicep curl"],
+    "legs": ["squat", "leg press"],
+}
+
+
+@pytest.fixture
+def classifier():
+    return ExerciseClassifier(CATALOG)
+
+
+@pytest.mark.parametrize(
+    "word, singular",
+    [
+        ("presses", "press"),
+        ("curls", "curl"),
+        ("flies", "fly"),
+        ("crunches", "crunch"),
+        ("pushes", "push"),
+        ("boxes", "box"),
+        ("press", "press"),
+        ("biceps", "bicep"),
+        ("abs", "ab"),
+        ("dips", "dip"),
+        ("ties", "tie"),
+        ("hiss", "hiss"),
+        ("us", "us"),
+        ("is", "is"),
+    ],
+)
+def test_singular_strips_plural_endings(word, singular):
+    assert _singular(word) == singular
+
+
+def test_normalize_folds_case_and_punctuation_and_pads_words():
+    assert normalize("Bench Presses: 80kg,  3x5\nPULL-UPS") == " bench press 80kg 3x5 pull up "
+
+
+def test_overlapping_keywords_all_match(classifier):
+    # "bench press" contains "press", and "leg press" too
+    assert classifier.score("Bench press then leg press") == {"push": 3, "pull": 0, "legs": 1}
+
+
+def test_keywords_only_match_whole_words(classifier):
+    assert classifier.score("Rowing, dipping, expressive squatting") == {"push": 0, "pull": 0, "legs": 0}
+
+
+def test_plural_and_case_variants_match(classifier):
+    assert classifier.score("BENCH PRESSES, Dips, bicep CURLS, rows, Pull-ups") == {"push": 3, "pull": 3, "legs": 0}
+
+
+def test_classify_returns_the_unique_best_category(classifier):
+    assert classifier.classify("Squats. Leg press. Rows.") == "legs"
+    assert classifier.classify("Squats. Rows.", default="rest") == "rest"
+    assert classifier.classify("Running", default="rest") == "rest"
+    assert classifier.classify_many(["dips", "rows"]) == ["push", "pull"]
+
+
+def test_matches_agree_with_a_naive_scan(classifier):
+    text = "bench press, row, pull up, dip, squat, leg press, bicep curl, press, row row"
+    padded = normalize(text)
+    # Padded keywords share their spaces with neighbouring matches, hence the lookahead
+    naive = {
+        c: sum(len(re.findall(f"(?={re.escape(normalize(k))})", padded)) for k in kws) for c, kws in CATALOG.items()
+    }
+
+    assert classifier.score(text) == naive
+
+
+def test_catalog_is_reloaded_only_when_the_file_changes(tmp_path):
+    path = tmp_path / "exercises.json"
+    path.write_text(json.dumps({"push": ["dip"]}))
+
+    classifier = load_classifier(path)
+    assert load_classifier(str(path)) is classifier
+
+    path.write_text(json.dumps({"pull": ["row"]}))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    reloaded = load_classifier(path)
+
+    assert reloaded is not classifier
+    assert reloaded.categories == ["pull"]
+    assert load_classifier(path) is reloaded
+
+
+def test_default_catalog_is_found_next_to_the_sources(tmp_path, monkeypatch):
+    from device_modules import exercise_classifier
+
+    src = tmp_path / "src"
+    (src / "device_modules").mkdir(parents=True)
+    (src / "exercises.json").write_text(json.dumps({"push": ["dip"]}))
+    monkeypatch.setattr(exercise_classifier, "__file__", str(src / "device_modules" / "exercise_classifier.py"))
+    monkeypatch.chdir(src / "device_modules")
+
+    assert load_classifier().categories == ["push"]
+
+
+def test_missing_catalog_is_reported(tmp_path):
+    with pytest.raises(FileNotFoundError, match="Exercise catalog .*missing.json not found"):
+        load_classifier(tmp_path / "missing.json")
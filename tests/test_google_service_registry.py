@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from device_modules.google_service_registry import GoogleServiceRegistry
+from fakes import FakeUpstream
+
+pytest.importorskip("googleapiclient")
+pytest.importorskip("google_auth_httplib2")
+credentials = pytest.importorskip("google.oauth2.credentials")
+
+
+@pytest.fixture
+def registry():
+    return GoogleServiceRegistry()
+
+
+def creds():
+    return credentials.Credentials(token="token")
+
+
+def in_thread(func):
+    """Result of `func` called in a new thread."""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def test_service_is_built_once_per_api_version_and_credentials(registry):
+    alice, bob = creds(), creds()
+
+    calendar = registry.get_service("calendar", "v3", alice)
+
+    assert registry.get_service("calendar", "v3", alice) is calendar
+    assert in_thread(lambda: registry.get_service("calendar", "v3", alice)) is calendar
+    assert registry.get_service("calendar", "v3", bob) is not calendar
+    assert registry.get_service("tasks", "v1", alice) is not calendar
+    assert registry.stats["builds"] == 3 and registry.stats["service_reuses"] == 2
+
+
+def test_each_thread_sends_requests_over_its_own_transport(registry):
+    alice = creds()
+    service = registry.get_service("calendar", "v3", alice)
+
+    request = service.events().list(calendarId="primary")
+    other_thread_request = in_thread(lambda: service.events().list(calendarId="primary"))
+
+    assert request.http is registry._thread_http(alice)
+    assert service.events().list(calendarId="primary").http is request.http
+    assert other_thread_request.http is not request.http
+    assert registry._thread_http(creds()) is not request.http
+
+
+def test_open_connections_are_reused_and_counted(registry):
+    http = registry._thread_http(creds())
+
+    with FakeUpstream({}) as server:
+        for _ in range(3):
+            response, _ = http.request(server.url + "/calendar/v3")
+            assert response.status == 200
+        in_thread(lambda: registry._thread_http(creds()).request(server.url + "/calendar/v3"))
+
+    stats = registry.stats
+    assert stats["requests"] == 4
+    assert stats["connections_opened"] == 2 and stats["connection_reuses"] == 2
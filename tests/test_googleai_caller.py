@@ -0,0 +1,59 @@
+import datetime
+import json
+import types
+
+import pytest
+
+from device_modules.googleai_caller import GoogleAICaller, format_workout
+from device_modules.response_cache import ResponseCache
+from fakes import FakeGenerativeModel
+
+
+@pytest.fixture
+def model():
+    return FakeGenerativeModel()
+
+
+@pytest.fixture
+def make_caller(usercfg, model):
+    def make(**kwargs):
+        caller = GoogleAICaller(types.SimpleNamespace(creds=None), usercfg, **kwargs)
+        caller._model = model
+        return caller
+
+    return make
+
+
+def test_workout_is_streamed_and_time_to_first_chunk_recorded(make_caller, model, tmp_path):
+    caller = make_caller(response_cache=ResponseCache(tmp_path / "cache.sqlite3"))
+
+    assert caller.get_workout_after(None) == model.text
+    assert caller.last_time_to_first_chunk is not None
+
+    # The streamed response was cached whole
+    assert caller.get_workout_after(None) == model.text
+    assert len(model.prompts) == 1
+
+
+def test_failed_day_of_a_block_does_not_prevent_scheduling_the_others(make_caller, model):
+    model.text = json.dumps({"exercises": [{"name": "Bench press", "weight_kg": 80, "sets": 3, "reps": 5}]})
+    model.fail_when = lambda prompt: ValueError("blocked") if "Tuesday" in prompt else None
+    start_times = [datetime.datetime(2026, 10, d, 18, tzinfo=datetime.timezone.utc) for d in (19, 20, 21)]
+    caller = make_caller()
+
+    workouts = caller.plan_workout_block(start_times, gcm=types.SimpleNamespace(get_last_workout_event=lambda: None))
+
+    text = format_workout(json.loads(model.text))
+    assert workouts == [(start_times[0], text), (start_times[2], text)]
+    failed = [r for r in caller.last_batch_results if r.error is not None]
+    assert [r.request.date for r in failed] == [start_times[1]]
+    assert isinstance(failed[0].error, ValueError)
+
+
+def test_last_workout_is_left_out_of_the_vote_on_its_type(make_caller):
+    votes = []
+    index = types.SimpleNamespace(detect_workout_type=lambda text, exclude_id=None: votes.append(exclude_id) or "pull")
+    gcm = types.SimpleNamespace(get_last_workout_event=lambda: {"id": "last", "description": "Squat: 100 kg. 5x5"})
+
+    assert make_caller(workout_index=index)._last_workout_type(gcm) == "pull"
+    assert votes == ["last"]
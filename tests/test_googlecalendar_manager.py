@@ -0,0 +1,60 @@
+import datetime
+
+from conftest import workout_event
+
+
+def list_calls(calendar):
+    return [kwargs for method, kwargs in calendar.calls if method == "events.list"]
+
+
+def test_last_workout_lists_only_the_recent_past(make_gcm, calendar, now):
+    calendar.add_event(workout_event("old", now - datetime.timedelta(days=400), description="old"))
+    calendar.add_event(workout_event("w", now - datetime.timedelta(days=2), description="squat 5x5"))
+    calendar.add_event(workout_event("d", now - datetime.timedelta(days=1), summary="Dentist"))
+
+    assert make_gcm().get_last_workout() == "squat 5x5"
+    (call,) = list_calls(calendar)
+    time_min = datetime.datetime.fromisoformat(call["timeMin"])
+    assert abs(time_min - (now - datetime.timedelta(days=30))) < datetime.timedelta(minutes=1)
+
+
+def test_last_workout_widens_the_window_until_it_finds_one(make_gcm, calendar, now):
+    calendar.add_event(workout_event("w", now - datetime.timedelta(days=100), description="deadlift"))
+
+    assert make_gcm().get_last_workout() == "deadlift"
+    windows = [(c["timeMin"], c["timeMax"]) for c in list_calls(calendar)]
+    # 30 days, then 60 and 120 days back, each time only the older part
+    assert len(windows) == 3
+    assert all(later[0] == earlier[1] for later, earlier in zip(windows, windows[1:]))
+
+
+def test_last_workout_gives_up_after_max_lookback(make_gcm, calendar, now):
+    calendar.add_event(workout_event("w", now - datetime.timedelta(days=50), description="too old"))
+
+    assert make_gcm().get_last_workout(lookback_days=10, max_lookback_days=40) is None
+    assert len(list_calls(calendar)) == 3
+
+
+def test_batch_insert_retries_only_transient_errors(make_gcm, calendar, now, fast_retries):
+    calendar.insert_errors = [503, 400]  # first attempt: workout 0 unavailable, workout 1 invalid
+    workouts = [(now + datetime.timedelta(days=d), f"day {d}") for d in range(3)]
+
+    results = make_gcm().create_workout_events(workouts)
+
+    assert [r["attempts"] for r in results] == [2, 1, 1]
+    assert results[0]["event"] is not None and results[2]["event"] is not None
+    assert results[1]["event"] is None and results[1]["error"].resp.status == 400
+    assert len(calendar.events_by_id) == 2
+
+
+def test_batch_insert_conflict_counts_as_success(make_gcm, calendar, now, fast_retries, monkeypatch):
+    gcm = make_gcm()
+    (result,) = gcm.create_workout_events([(now, "bench")])
+    # The response of the insert was lost: the retry hits the event it created
+    calendar.insert_errors = [503]
+    monkeypatch.setattr("uuid.uuid4", lambda: type("U", (), {"hex": result["event"]["id"]})())
+
+    (retried,) = gcm.create_workout_events([(now, "bench")])
+
+    assert retried["error"] is None and retried["attempts"] == 2
+    assert len(calendar.events_by_id) == 1
@@ -0,0 +1,24 @@
+from startup_profiler import STARTUP_IMPORT_BUDGETS_MS, import_timings, measure_import_time
+
+# Packages which must only be imported once a request is actually made
+HEAVY_SDKS = ("google.generativeai", "googleapiclient", "google.cloud.secretmanager", "grpc")
+
+
+def test_startup_imports_stay_within_budget():
+    # Each module is imported in its own interpreter, so that it is charged for all of its imports, even those an
+    # earlier module already made; best of three runs, to limit the noise of a busy machine
+    over = {}
+    for module, budget_ms in STARTUP_IMPORT_BUDGETS_MS.items():
+        elapsed_ms = min(measure_import_time(module) for _ in range(3)) * 1e3
+        if elapsed_ms > budget_ms:
+            over[module] = f"{elapsed_ms:.1f} ms > {budget_ms} ms"
+    assert not over
+
+
+def test_startup_imports_no_heavy_sdk():
+    heavy = {}
+    for module in ["main", *STARTUP_IMPORT_BUDGETS_MS]:
+        imported = [m for m in import_timings(module) if m.startswith(HEAVY_SDKS)]
+        if imported:
+            heavy[module] = imported
+    assert not heavy
@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+
+import pytest
+
+import resilience
+from device_modules import openweather_caller
+from device_modules.openweather_caller import OpenWeatherCaller
+from fakes import FakeUpstream, synthetic_onecall
+
+
+@pytest.fixture(autouse=True)
+def weather_cache(monkeypatch):
+    """A cache of One Call responses for this test only."""
+    cache = openweather_caller._WeatherCache()
+    monkeypatch.setattr(OpenWeatherCaller, "cache", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def no_retries():
+    """OpenWeather upstream without rate limiting or retries."""
+    return resilience.configure("openweather", rate=1000, capacity=1000, retry_policy=resilience.RetryPolicy(max_retries=0))
+
+
+@pytest.fixture
+def onecall():
+    return synthetic_onecall(random.Random(0))
+
+
+@pytest.fixture
+def server(onecall):
+    with FakeUpstream(onecall) as server:
+        yield server
+
+
+def caller(server, lat=48.85, lon=2.35, **kwargs):
+    return OpenWeatherCaller("key", lat, lon, base_url=server.url, **kwargs)
+
+
+def test_responses_are_reused_until_they_expire(server, weather_cache):
+    first = caller(server, ttl=0.2)
+    second = caller(server, ttl=0.2)
+
+    assert second.latest_series is first.latest_series
+    assert len(server.requests) == 1
+
+    time.sleep(0.25)
+    second.get_current_temp()
+
+    assert len(server.requests) == 2
+    assert weather_cache.stats == {"hits": 1, "misses": 2, "coalesced": 0, "not_modified": 0}
+
+
+def test_nearby_locations_share_a_grid_bucket(server):
+    paris = caller(server, 48.853, 2.349)
+    louvre = caller(server, 48.861, 2.336)
+    lyon = caller(server, 45.764, 4.836)
+
+    assert louvre.bucket == paris.bucket != lyon.bucket
+    assert louvre.latest_series is paris.latest_series
+    assert len(server.requests) == 2
+    # The API is asked for the center of the grid cell, so the response is the same for every location in it
+    assert "lat=48.9000&lon=2.3000" in server.requests[0][1]
+
+
+def test_concurrent_calls_for_a_bucket_share_one_request(onecall, weather_cache):
+    callers = []
+    with FakeUpstream(onecall, delay=0.2) as server:
+        threads = [threading.Thread(target=lambda: callers.append(caller(server))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(server.requests) == 1
+    assert len({id(c.latest_series) for c in callers}) == 1
+    assert weather_cache.stats["misses"] == 1
+    # The other callers waited for that request, then read its response from the cache
+    assert weather_cache.stats["coalesced"] == weather_cache.stats["hits"] == 4
+
+
+def test_expired_response_is_revalidated_with_its_etag(onecall, weather_cache):
+    with FakeUpstream(onecall, etag='"v1"') as server:
+        weather = caller(server, ttl=0)
+        series = weather.latest_series
+        weather.get_current_temp()
+
+    assert [status for _, _, status in server.requests] == [200, 304]
+    assert weather.latest_series is series
+    assert weather_cache.stats["not_modified"] == 1
+
+
+def test_snapshot_is_used_when_the_api_fails(server, weather_cache, tmp_path, onecall):
+    snapshot = tmp_path / "forecast.npz"
+    fresh = caller(server, snapshot_path=snapshot)
+    weather_cache.clear()
+    server.error_rate = 1.0
+
+    fallback = caller(server, snapshot_path=snapshot)
+
+    assert [status for _, _, status in server.requests] == [200, 503]
+    assert fallback.latest_series.current_dt == onecall["current"]["dt"]
+    assert fallback.get_daily_max() == pytest.approx(fresh.get_daily_max())
+    with pytest.raises(Exception):
+        caller(server, snapshot_path=tmp_path / "missing.npz")
+
+
+def test_offline_first_reads_the_snapshot_without_calling_the_api(server, weather_cache, tmp_path):
+    snapshot = tmp_path / "forecast.npz"
+    caller(server, snapshot_path=snapshot)
+    weather_cache.clear()
+
+    offline = caller(server, snapshot_path=snapshot, offline_first=True)
+
+    assert len(server.requests) == 1
+    assert offline.latest_series.current_dt == caller(server).latest_series.current_dt
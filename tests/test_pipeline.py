@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from pipeline import AsyncPipeline, Stage
+
+
+def run(stages):
+    pipeline = AsyncPipeline(stages)
+    return pipeline, asyncio.run(pipeline.run())
+
+
+def test_stages_start_after_their_dependencies_and_independent_ones_overlap():
+    def slow(name):
+        def func(results):
+            time.sleep(0.1)
+            return name
+
+        return func
+
+    pipeline, results = run(
+        [
+            Stage("a", slow("a")),
+            Stage("b", slow("b")),
+            Stage("c", lambda r: r["a"] + r["b"], ("a", "b")),
+        ]
+    )
+
+    assert results == {"a": "a", "b": "b", "c": "ab"}
+    timings = pipeline.timings
+    assert timings["c"]["start"] >= max(timings["a"]["end"], timings["b"]["end"])
+    # a and b ran concurrently: the run took about one of them, not both
+    assert timings["total"]["duration"] < 0.19
+
+
+def test_coroutine_stages_are_awaited():
+    async def double(results):
+        await asyncio.sleep(0)
+        return 2 * results["a"]
+
+    _, results = run([Stage("a", lambda r: 21), Stage("b", double, ("a",))])
+
+    assert results["b"] == 42
+
+
+def test_stage_exceeding_its_timeout_fails():
+    async def hang(results):
+        await asyncio.sleep(10)
+
+    pipeline, results = run([Stage("hang", hang, timeout=0.05)])
+
+    assert results == {}
+    assert isinstance(pipeline.errors["hang"], asyncio.TimeoutError)
+    assert pipeline.timings["hang"]["status"] == "timeout"
+    assert pipeline.timings["total"]["duration"] < 1
+
+
+def test_failed_dependency_skips_dependents_unless_not_required():
+    def fail(results):
+        raise ValueError("down")
+
+    pipeline, results = run(
+        [
+            Stage("required", fail),
+            Stage("optional", fail, required=False),
+            Stage("after_required", lambda r: "ran", ("required",)),
+            Stage("after_optional", lambda r: r, ("optional",)),
+        ]
+    )
+
+    assert "after_required" not in results
+    assert pipeline.timings["after_required"] == {"status": "skipped"}
+    assert "after_required" not in pipeline.errors
+    assert results["after_optional"] == {"optional": None}
+    assert set(pipeline.errors) == {"required", "optional"}
+
+
+def test_stage_is_skipped_when_its_condition_is_false():
+    pipeline, results = run(
+        [
+            Stage("scheduled", lambda r: True),
+            Stage("generate", lambda r: "workout", ("scheduled",), condition=lambda r: not r["scheduled"]),
+        ]
+    )
+
+    assert "generate" not in results
+    assert pipeline.timings["generate"] == {"status": "skipped"}
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        AsyncPipeline([Stage("a", lambda r: None, ("missing",))])
+
+
+def test_timings_table_lists_stages_in_start_order():
+    pipeline, _ = run(
+        [
+            Stage("first", lambda r: None),
+            Stage("second", lambda r: None, ("first",)),
+            Stage("never", lambda r: None, ("first",), condition=lambda r: False),
+        ]
+    )
+
+    header, *rows = pipeline.format_timings().splitlines()
+    assert header.split() == ["stage", "status", "start", "end", "duration"]
+    assert [row.split()[:2] for row in rows] == [
+        ["first", "ok"],
+        ["second", "ok"],
+        ["never", "skipped"],
+        ["total", "ok"],
+    ]
+    assert rows[2].split()[2:] == ["-", "-", "-"]
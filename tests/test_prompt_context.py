@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+from device_modules.prompt_context import PromptContextBuilder, RollingSummary, estimate_tokens
+from device_modules.workout_history import WorkoutHistory
+
+
+def session(event_id, day, description):
+    start = datetime.datetime(2026, 9, day, 18, tzinfo=datetime.timezone.utc)
+    return {"id": event_id, "description": description, "start_ts": start.timestamp()}
+
+
+@pytest.fixture
+def history(tmp_path):
+    return WorkoutHistory(tmp_path / "history")
+
+
+def ingest(history, *events):
+    history.ingest(list(events), classify=lambda description: "push")
+
+
+def test_summary_counts_sessions_not_sets(history):
+    ingest(
+        history,
+        session("a", 1, "Bench press: 80 kg. 3 sets, 5 repetitions in each set.\nBench press: 60 kg. 2 sets, 12 repetitions in each set."),
+    )
+    summary = RollingSummary(history)
+    summary.update()
+
+    entry = summary.exercises["bench press"]
+    assert entry["sessions"] == 1
+    assert entry["types"] == {"push": 1}
+    assert len(entry["recent_e1rm"]) == 1
+
+
+def test_incremental_update_matches_a_rebuild_and_orders_sessions_by_time(history):
+    ingest(history, session("b", 10, "Bench press: 85 kg. 3 sets, 5 repetitions in each set."))
+    summary = RollingSummary(history)
+    summary.update()
+    # An older workout ingested later, e.g. after a backfill
+    ingest(history, session("a", 3, "Bench press: 80 kg. 3 sets, 5 repetitions in each set."))
+    ingest(history, session("c", 17, "Bench press: 90 kg. 3 sets, 5 repetitions in each set."))
+
+    assert summary.update() == 2
+    entry = summary.exercises["bench press"]
+    assert [round(e1rm) for _, e1rm in entry["recent_e1rm"]] == [93, 99, 105]
+    assert entry["last"] == [90.0, 3, 5]
+
+    # Reloaded from summary.json, nothing left to fold in
+    assert RollingSummary(history).update() == 0
+    (history.dir_path / "summary.json").unlink()
+    rebuilt = RollingSummary(history)
+    rebuilt.update()
+    assert rebuilt.exercises == summary.exercises
+
+
+def test_context_fits_the_measured_budget_with_few_counts(history):
+    exercises = [f"Exercise {chr(ord('a') + i)}" for i in range(20)]
+    for day, name in enumerate(exercises, start=1):
+        ingest(history, session(name, day, f"{name}: 50 kg. 3 sets, 8 repetitions in each set."))
+    counted = []
+
+    def count_tokens(text):
+        # The remote tokenizer counts twice the local estimate
+        counted.append(text)
+        return 2 * estimate_tokens(text)
+
+    context = PromptContextBuilder(history, token_budget=200, count_tokens=count_tokens).build("push")
+
+    assert 2 * estimate_tokens(context) <= 200
+    assert context.count("\n") >= 2
+    assert len(counted) <= 3
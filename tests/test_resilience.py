@@ -0,0 +1,79 @@
+import random
+import time
+
+import pytest
+
+import resilience
+from device_modules.openweather_caller import OpenWeatherCaller
+from fakes import FakeHttpError, FakeUpstream, synthetic_onecall
+
+POLICY = resilience.RetryPolicy(max_retries=4, base_delay=0.05, max_delay=2)
+
+
+@pytest.fixture
+def body():
+    return synthetic_onecall(random.Random(0))
+
+
+def fresh_caller(server):
+    OpenWeatherCaller.cache.clear()
+    return OpenWeatherCaller(api_key="fake", lat=0, lon=0, base_url=server.url)
+
+
+def statuses(server):
+    return [status for _, _, status in server.requests]
+
+
+def test_transient_errors_are_retried(body):
+    resilience.configure("openweather", rate=100, capacity=10, retry_policy=POLICY)
+    with FakeUpstream(body, script=[503, 502, 200]) as server:
+        assert fresh_caller(server).latest_series is not None
+    assert statuses(server) == [503, 502, 200]
+
+
+def test_retry_after_is_honoured(body):
+    resilience.configure("openweather", rate=100, capacity=10, retry_policy=POLICY)
+    with FakeUpstream(body, script=[429, 200], retry_after=1) as server:
+        fresh_caller(server)
+    (t0, _, _), (t1, _, _) = server.requests
+    assert t1 - t0 >= 1
+
+
+def test_circuit_opens_when_the_upstream_is_down(body):
+    breaker = resilience.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    resilience.configure("openweather", rate=100, capacity=10, retry_policy=POLICY, breaker=breaker)
+    errors = []
+    with FakeUpstream(body, error_rate=1.0) as server:
+        for _ in range(3):
+            with pytest.raises(Exception) as excinfo:
+                fresh_caller(server)
+            errors.append(excinfo.type)
+    assert breaker.state == "open"
+    assert errors[-1] is resilience.CircuitOpenError
+    assert len(server.requests) == 3
+
+
+def test_calls_are_rate_limited(body):
+    resilience.configure("openweather", rate=5, capacity=1, retry_policy=POLICY)
+    with FakeUpstream(body) as server:
+        start = time.monotonic()
+        for _ in range(6):
+            fresh_caller(server)
+        elapsed = time.monotonic() - start
+    assert elapsed >= 0.9
+
+
+@pytest.mark.parametrize(
+    "status, retryable",
+    [(429, True), (503, True), (400, False), (404, False), (409, False)],
+)
+def test_googleapiclient_errors_are_classified_by_status(status, retryable):
+    error = FakeHttpError(status)
+
+    assert resilience.classify_error(error) == (retryable, None)
+    assert resilience.http_status(error) == status
+
+
+def test_rate_limited_403_is_retryable():
+    assert resilience.classify_error(FakeHttpError(403, b'{"reason": "rateLimitExceeded"}'))[0]
+    assert not resilience.classify_error(FakeHttpError(403, b'{"reason": "forbidden"}'))[0]
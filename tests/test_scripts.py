@@ -0,0 +1,78 @@
+import datetime
+import types
+
+import pytest
+
+import scripts
+from conftest import workout_event
+
+
+@pytest.fixture
+def run_job(make_gcm, usercfg, tmp_path, monkeypatch):
+    """Runs scripts.run_user_job against the fake calendar, with a stand-in Gemini caller."""
+    monkeypatch.setattr(scripts, "_get_cfg", lambda user_id, data_dir=None, offline_first=False: usercfg)
+    monkeypatch.setattr(
+        scripts,
+        "_ai_caller",
+        lambda *args, **kwargs: types.SimpleNamespace(get_workout_after=lambda last, last_id=None: "Bench press: 80 kg. 3 sets, 5 repetitions in each set."),
+    )
+
+    def run(**kwargs):
+        return scripts.run_user_job(types.SimpleNamespace(creds=None), data_dir=tmp_path, **kwargs)
+
+    return run
+
+
+def calls(calendar, method):
+    return [kwargs for name, kwargs in calendar.calls if name == method]
+
+
+def test_job_checks_and_books_from_a_single_schedule(run_job, calendar):
+    gcm = run_job()
+
+    assert len(calls(calendar, "freebusy.query")) == 1
+    (queued,) = gcm.journal.pending()
+    assert queued["body"]["summary"].startswith("WORKOUT")
+
+
+def test_workout_in_progress_counts_as_scheduled(run_job, calendar, now):
+    calendar.add_event(workout_event("w", now - datetime.timedelta(minutes=30)))
+
+    gcm = run_job()
+
+    assert gcm.journal.pending() == []
+    assert len(calls(calendar, "freebusy.query")) == 1
+
+
+def test_schedule_without_event_store_lists_from_the_workout_window(make_gcm, calendar, now):
+    calendar.add_event(workout_event("w", now - datetime.timedelta(minutes=30)))
+
+    schedule = make_gcm().schedule()
+
+    assert schedule.has_workout(now, now + datetime.timedelta(hours=24))
+    (call,) = calls(calendar, "events.list")
+    time_min = datetime.datetime.fromisoformat(call["timeMin"])
+    assert time_min < now - datetime.timedelta(minutes=30)
+
+
+def test_start_up_leaves_inserts_the_calendar_refuses_queued(run_job, calendar, tmp_path, monkeypatch, capsys):
+    import time
+
+    calendar.insert_errors = [503] * 1000
+    monkeypatch.setattr(scripts, "_login", lambda: types.SimpleNamespace(creds=None))
+    gcms = []
+    run_user_job = scripts.run_user_job
+
+    def run_once(user_id, **kwargs):
+        gcms.append(run_user_job(user_id, data_dir=tmp_path, **kwargs))
+        return gcms[-1]
+
+    monkeypatch.setattr(scripts, "run_user_job", run_once)
+
+    start = time.perf_counter()
+    scripts.start_up(types.SimpleNamespace())
+
+    assert time.perf_counter() - start < 5
+    assert len(gcms[0].journal.pending()) == 1
+    assert "1 calendar insert(s) still queued" in capsys.readouterr().out
+    gcms[0].journal.close()
@@ -0,0 +1,87 @@
+import dataclasses
+import json
+import types
+
+import pytest
+
+from configurations.config_dataclasses import UserCfg
+from device_modules import secret_manager_caller
+from device_modules.secret_manager_caller import SecretManagerCaller
+from fakes import FakeAlreadyExists, FakeNotFound, FakeSecretManagerClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(
+        secret_manager_caller,
+        "api_exceptions",
+        types.SimpleNamespace(NotFound=FakeNotFound, AlreadyExists=FakeAlreadyExists),
+    )
+    return FakeSecretManagerClient()
+
+
+@pytest.fixture
+def make_caller(client):
+    def make(**kwargs):
+        creds = types.SimpleNamespace(client_id="client", refresh_token="refresh")
+        caller = SecretManagerCaller(types.SimpleNamespace(PROJECT_ID="project", creds=creds), **kwargs)
+        caller._client = client
+        return caller
+
+    return make
+
+
+@pytest.fixture
+def cfg_dict(usercfg, monkeypatch):
+    """Configuration the prompts would produce."""
+    cfg_dict = dataclasses.asdict(usercfg)
+    monkeypatch.setattr(UserCfg, "update_cfg_dict", classmethod(lambda cls, old_cfg_dict: {**old_cfg_dict, **cfg_dict}))
+    return cfg_dict
+
+
+def test_first_run_creates_the_cfg_secret(make_caller, client, cfg_dict):
+    assert make_caller(cfg_cache_path=None).get_cfg() == UserCfg.from_dict(cfg_dict)
+    assert client.calls == ["access_secret_version", "create_secret", "add_secret_version"]
+
+
+def test_cfg_secret_without_version_is_not_created_again(make_caller, client, cfg_dict):
+    # A first run created the secret, then failed to upload the configuration
+    client.secrets["cfg"] = [{"data": b"{}", "enabled": False}]
+
+    assert make_caller(cfg_cache_path=None).get_cfg() == UserCfg.from_dict(cfg_dict)
+    assert json.loads(client.secrets["cfg"][-1]["data"]) == cfg_dict
+
+    client.calls.clear()
+    make_caller(cfg_cache_path=None).get_cfg()
+    assert client.calls == ["access_secret_version"]
+
+
+def test_cached_cfg_is_revalidated_without_download(make_caller, client, cfg_dict, tmp_path):
+    make_caller(cfg_cache_path=tmp_path / "cfg_cache").get_cfg()
+    client.calls.clear()
+
+    make_caller(cfg_cache_path=tmp_path / "cfg_cache", cfg_cache_ttl=0).get_cfg()
+
+    assert client.calls == ["get_secret_version"]
+
+
+def test_stale_cfg_is_migrated_and_uploaded_once(make_caller, client, usercfg):
+    stored = dataclasses.asdict(usercfg)
+    stored["schema_version"] = 1
+    stored["baseline_weights_cfg"] = {k: str(v) for k, v in stored["baseline_weights_cfg"].items()}
+    client.secrets["cfg"] = [{"data": json.dumps(stored).encode(), "enabled": True}]
+
+    cfg = make_caller(cfg_cache_path=None).get_cfg()
+
+    assert cfg.schema_version == 2
+    assert cfg.baseline_weights_cfg == usercfg.baseline_weights_cfg
+    assert client.calls == ["access_secret_version", "add_secret_version"]
+    client.calls.clear()
+    make_caller(cfg_cache_path=None).get_cfg()
+    assert client.calls == ["access_secret_version"]
+
+
+def test_get_many_returns_none_for_missing_secrets(make_caller, client):
+    client.secrets["a"] = [{"data": b'{"key": 1}', "enabled": True}]
+
+    assert make_caller(cfg_cache_path=None).get_many(["a", "b"]) == {"a": {"key": 1}, "b": None}
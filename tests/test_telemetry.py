@@ -0,0 +1,60 @@
+import json
+import threading
+import types
+
+import pytest
+
+import telemetry
+from device_modules.googleai_caller import GoogleAICaller
+from fakes import FakeGenerativeModel
+
+
+@pytest.fixture
+def trace_path(tmp_path):
+    telemetry.enable(trace_path=tmp_path / "trace.jsonl")
+    yield tmp_path / "trace.jsonl"
+    telemetry.disable()
+
+
+@pytest.fixture
+def caller(usercfg):
+    caller = GoogleAICaller(types.SimpleNamespace(creds=None), usercfg)
+    caller._model = FakeGenerativeModel(chunk_size=4)
+    return caller
+
+
+def records(trace_path):
+    telemetry.get().flush()
+    return [json.loads(line) for line in trace_path.read_text().splitlines()]
+
+
+def test_spans_nest_and_close(trace_path):
+    with telemetry.span("calendar", "outer") as outer:
+        with telemetry.span("calendar", "inner"):
+            assert telemetry.current_span() is not outer
+        assert telemetry.current_span() is outer
+    assert telemetry.get().current_span() is None
+    assert [r["operation"] for r in records(trace_path)] == ["inner", "outer"]
+
+
+def test_stream_span_does_not_capture_the_consumers_spans(trace_path, caller):
+    for chunk in caller.stream_response("prompt"):
+        with telemetry.span("calendar", "calendar.events.insert") as consumer_span:
+            assert telemetry.current_span() is consumer_span
+        assert telemetry.get().current_span() is None
+
+    stream = next(r for r in records(trace_path) if r["operation"] == "stream_generate_content")
+    assert stream["status"] == "ok" and "time_to_first_chunk" in stream["attrs"]
+    assert stream["bytes_received"] == len(caller._model.text)
+
+
+def test_stream_resumed_in_another_thread(trace_path, caller):
+    stream = caller.stream_response("prompt")
+    chunks = [next(stream)]
+    worker = threading.Thread(target=lambda: chunks.extend(stream))
+    worker.start()
+    worker.join()
+
+    assert "".join(chunks) == caller._model.text
+    assert telemetry.get().current_span() is None
+    assert "stream_generate_content" in [r["operation"] for r in records(trace_path)]
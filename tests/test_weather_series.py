@@ -0,0 +1,102 @@
+import random
+import urllib.parse
+
+import numpy as np
+import pytest
+
+import resilience
+from device_modules import openweather_caller
+from device_modules.openweather_caller import OpenWeatherCaller
+from device_modules.weather_series import WeatherSeries, convert_temperature
+from fakes import FakeUpstream, synthetic_onecall
+
+
+@pytest.fixture
+def onecall():
+    return synthetic_onecall(random.Random(0))
+
+
+@pytest.fixture
+def series(onecall):
+    return WeatherSeries.from_response(onecall)
+
+
+def hourly(onecall, start=None, end=None):
+    """(dt, temp) of the hourly forecasts in [start, end), from the raw response."""
+    return [
+        (h["dt"], h["temp"])
+        for h in onecall["hourly"]
+        if (start is None or h["dt"] >= start) and (end is None or h["dt"] < end)
+    ]
+
+
+def test_response_is_parsed_into_arrays(onecall, series):
+    assert series.current_dt == onecall["current"]["dt"]
+    assert series.current_temp == pytest.approx(onecall["current"]["temp"])
+    assert series.hourly_dt.dtype == np.int64 and series.hourly_temp.dtype == np.float32
+    assert series.hourly_dt.tolist() == [h["dt"] for h in onecall["hourly"]]
+    assert series.daily_temp_max == pytest.approx([d["temp"]["max"] for d in onecall["daily"]])
+    assert series.nbytes == 48 * (8 + 4) + 8 * (8 + 4 + 4)
+
+
+@pytest.mark.parametrize("unit, expected", [("K", 300.0), ("C", 26.85), ("F", 80.33)])
+def test_temperatures_are_converted_from_kelvin(unit, expected):
+    assert convert_temperature(300.0, unit) == pytest.approx(expected)
+    assert convert_temperature(np.array([300.0, 300.0]), unit) == pytest.approx([expected] * 2)
+
+
+def test_unknown_unit_is_rejected(series):
+    with pytest.raises(ValueError):
+        convert_temperature(300.0, "R")
+    with pytest.raises(ValueError):
+        series.hours_above(20, unit="R")
+
+
+def test_max_temp_in_a_window_matches_the_raw_forecast(onecall, series):
+    start, end = onecall["hourly"][3]["dt"], onecall["hourly"][20]["dt"]
+    expected = max(temp for _, temp in hourly(onecall, start, end))
+
+    assert series.max_temp(start, end, unit="K") == pytest.approx(expected)
+    assert series.max_temp(start, end) == pytest.approx(expected - 273.15, abs=1e-4)
+    # Window bounds between two hours
+    assert series.max_temp(start - 1, end + 1, unit="K") == pytest.approx(
+        max(temp for _, temp in hourly(onecall, start - 1, end + 1))
+    )
+    assert series.max_temp(unit="K") == pytest.approx(max(temp for _, temp in hourly(onecall)))
+    assert series.max_temp(end, start) is None
+
+
+@pytest.mark.parametrize("unit, threshold", [("K", 285.0), ("C", 11.85), ("F", 53.33)])
+def test_hours_above_a_threshold_in_any_unit(onecall, series, unit, threshold):
+    start = onecall["hourly"][10]["dt"]
+    expected = [dt for dt, temp in hourly(onecall, start) if temp > 285.0]
+
+    assert series.hours_above(threshold, start=start, unit=unit).tolist() == expected
+
+
+def test_hourly_forecast_in_celsius(onecall, series):
+    timestamps, temps = series.hourly()
+
+    assert timestamps is series.hourly_dt
+    assert temps == pytest.approx([temp - 273.15 for _, temp in hourly(onecall)], abs=1e-4)
+
+
+def test_snapshot_round_trip(series, tmp_path):
+    path = tmp_path / "forecast.npz"
+    series.save(path)
+    loaded = WeatherSeries.load(path)
+
+    assert loaded.current_dt == series.current_dt and loaded.current_temp == series.current_temp
+    np.testing.assert_array_equal(loaded.hourly_temp, series.hourly_temp)
+    np.testing.assert_array_equal(loaded.daily_dt, series.daily_dt)
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_unparsed_blocks_are_not_requested(onecall, monkeypatch):
+    monkeypatch.setattr(OpenWeatherCaller, "cache", openweather_caller._WeatherCache())
+    resilience.configure("openweather", rate=1000, capacity=1000)
+    with FakeUpstream(onecall) as server:
+        OpenWeatherCaller("key", 48.85, 2.35, base_url=server.url)
+
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(server.requests[0][1]).query)
+    assert query["exclude"] == ["minutely,alerts"]
@@ -0,0 +1,81 @@
+import pytest
+
+from device_modules.exercise_classifier import ExerciseClassifier
+from device_modules.workout_embeddings import WorkoutEmbeddingIndex
+
+CATALOG = {
+    "push": ["bench press", "overhead press", "dip"],
+    "pull": ["barbell row", "pull up", "bicep curl"],
+}
+
+PUSH_DAY = """Bench press: 80 kg. 3 sets, 5 repetitions in each set.
+Overhead press: 45 kg. 3 sets, 8 repetitions in each set.
+Cable fly: 15 kg. 3 sets, 12 repetitions in each set.
+Skull crusher: 30 kg. 3 sets, 10 repetitions in each set.
+Lateral raise: 10 kg. 3 sets, 15 repetitions in each set."""
+
+PULL_DAY = """Barbell row: 70 kg. 3 sets, 8 repetitions in each set.
+Pull-ups: 0 kg. 3 sets, 8 repetitions in each set.
+Face pull: 20 kg. 3 sets, 15 repetitions in each set.
+Hammer curl: 14 kg. 3 sets, 12 repetitions in each set.
+Shrug: 60 kg. 3 sets, 12 repetitions in each set."""
+
+# A push day of accessories only: none of them is in the catalog
+ACCESSORY_PUSH_DAY = """Cable fly: 17.5 kg. 4 sets, 12 repetitions in each set.
+Skull crusher: 32.5 kg. 4 sets, 10 repetitions in each set.
+Lateral raise: 12 kg. 4 sets, 15 repetitions in each set."""
+
+
+def keyword_type(text):
+    """GoogleAICaller's keyword fallback, with CATALOG as the exercise catalog."""
+    scores = ExerciseClassifier(CATALOG).score(text)
+    return "push" if scores["push"] > scores["pull"] else "pull"
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = WorkoutEmbeddingIndex(tmp_path / "workout_embeddings")
+    events = [
+        {"id": f"{name}{week}", "description": text, "start_ts": week * 604800.0 + offset}
+        for week in range(3)
+        for name, text, offset in (("push", PUSH_DAY, 0), ("pull", PULL_DAY, 172800))
+    ]
+    index.add(events, classify=keyword_type)
+    return index
+
+
+def test_neighbours_classify_a_workout_the_keywords_miss(index):
+    # The last workout is in the index too, labelled by the keyword fallback
+    index.add([{"id": "last", "description": ACCESSORY_PUSH_DAY, "start_ts": 3 * 604800.0}], classify=keyword_type)
+
+    assert keyword_type(ACCESSORY_PUSH_DAY) == "pull"
+    assert index.detect_workout_type(ACCESSORY_PUSH_DAY, exclude_id="last") == "push"
+
+
+def test_a_workout_does_not_vote_for_itself(tmp_path):
+    index = WorkoutEmbeddingIndex(tmp_path / "workout_embeddings")
+    index.add([{"id": "last", "description": ACCESSORY_PUSH_DAY, "start_ts": 0.0}], classify=keyword_type)
+
+    assert index.detect_workout_type(ACCESSORY_PUSH_DAY, exclude_id="last") is None
+
+
+def test_past_sessions_of_a_repeated_routine_still_vote(tmp_path):
+    # The user repeats the same routine word for word; its past sessions were labelled push, e.g. by hand
+    labels = {ACCESSORY_PUSH_DAY: "push", PULL_DAY: "pull"}
+    index = WorkoutEmbeddingIndex(tmp_path / "workout_embeddings")
+    index.add(
+        [
+            {"id": f"{name}{week}", "description": text, "start_ts": week * 604800.0 + offset}
+            for week in range(5)
+            for name, text, offset in (("push", ACCESSORY_PUSH_DAY, 0), ("pull", PULL_DAY, 172800))
+        ],
+        classify=labels.get,
+    )
+    index.add([{"id": "last", "description": ACCESSORY_PUSH_DAY, "start_ts": 5 * 604800.0}], classify=keyword_type)
+
+    assert index.detect_workout_type(ACCESSORY_PUSH_DAY, exclude_id="last") == "push"
+
+
+def test_detection_agrees_with_the_keywords_on_clear_workouts(index):
+    assert index.detect_workout_type(PUSH_DAY.replace("80 kg", "82.5 kg")) == "push"
+    assert index.detect_workout_type(PULL_DAY.replace("70 kg", "72.5 kg")) == "pull"
@@ -0,0 +1,147 @@
+import datetime
+
+import pytest
+
+from device_modules.workout_history import LBS_TO_KG, WorkoutHistory, estimated_one_rep_max, parse_workout
+
+DAY = 86400.0
+
+
+def push_day(bench, dip=0):
+    return f"""Bench press: {bench} kg. 3 sets, 5 repetitions in each set.
+Dips: {dip} kg. 3 sets, 10 repetitions in each set.
+Lateral raise: 10 kg. 3 sets, 15 repetitions in each set."""
+
+
+def pull_day(row):
+    return f"""Barbell row: {row} kg. 4 sets, 8 repetitions in each set.
+Pull-ups: 0 kg. 3 sets, 8 repetitions in each set."""
+
+
+def classify(text):
+    return "push" if "Bench press" in text else "pull"
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = WorkoutHistory(tmp_path / "history")
+    events = [
+        {"id": "push0", "description": push_day(80), "start_ts": 0 * DAY},
+        {"id": "pull0", "description": pull_day(70), "start_ts": 2 * DAY},
+        {"id": "push1", "description": push_day(82.5, dip=5), "start_ts": 7 * DAY},
+        {"id": "pull1", "description": pull_day(72.5), "start_ts": 9 * DAY},
+        # Ingested out of order: the queries sort sessions by time
+        {"id": "push3", "description": push_day(87.5, dip=10), "start_ts": 21 * DAY},
+        {"id": "push2", "description": push_day(85, dip=7.5), "start_ts": 14 * DAY},
+    ]
+    assert history.ingest(events, classify=classify) == 6
+    return history
+
+
+def test_parse_workout_reads_generated_lines():
+    assert parse_workout(push_day(82.5)) == [
+        ("bench press", 82.5, 3, 5),
+        ("dip", 0.0, 3, 10),
+        ("lateral raise", 10.0, 3, 15),
+    ]
+
+
+@pytest.mark.parametrize(
+    "line, record",
+    [
+        ("**Bench Press:** 80 kg, 3 sets of 5 reps", ("bench press", 80.0, 3, 5)),
+        ("1. Overhead press: 42.5kg - 3 x 8", ("overhead press", 42.5, 3, 8)),
+        ("- Cable flies: 17.5 kgs. 4 sets, 12 repetitions", ("cable fly", 17.5, 4, 12)),
+        ("Chin-ups: 0 kg. 3 sets, 6 repetitions in each set.", ("chin up", 0.0, 3, 6)),
+        ("Squat: 225 lbs - 5×5", ("squat", 225 * LBS_TO_KG, 5, 5)),
+        ("Deadlift: 100 pounds, 1 set of 5 repetitions", ("deadlift", 100 * LBS_TO_KG, 1, 5)),
+    ],
+)
+def test_parse_workout_variations(line, record):
+    [(name, weight, sets, reps)] = parse_workout(line)
+
+    assert (name, sets, reps) == (record[0], record[2], record[3])
+    assert weight == pytest.approx(record[1])
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Rest 2 minutes between sets.",
+        "Warm up: 10 minutes on the bike.",
+        "Bench press: heavy. 3 sets, 5 repetitions in each set.",
+        "Plank: 60 seconds",
+        "",
+    ],
+)
+def test_parse_workout_skips_lines_without_an_exercise(text):
+    assert parse_workout(text) == []
+
+
+def test_sessions_are_ingested_once(history):
+    again = [{"id": "push0", "description": push_day(80), "start_ts": 0.0}]
+    unparsable = [{"id": "run", "description": "Easy 5 km run", "start_ts": 30 * DAY}]
+
+    assert history.ingest(again + unparsable, classify=classify) == 0
+    assert len(history) == 6
+    assert history.last_ts == 21 * DAY
+
+
+def test_history_is_persisted(history, tmp_path):
+    reopened = WorkoutHistory(tmp_path / "history")
+
+    assert len(reopened) == 6
+    assert reopened.last_sessions("pull") == history.last_sessions("pull")
+
+
+def test_volume_per_session_in_chronological_order(history):
+    ts, volumes = history.volume("Bench Press")
+
+    assert ts.tolist() == [0, 7 * DAY, 14 * DAY, 21 * DAY]
+    assert volumes.tolist() == [w * 3 * 5 for w in (80, 82.5, 85, 87.5)]
+    # Bodyweight exercises have no volume in kg
+    assert history.volume("dips")[1].tolist() == [0, 5 * 30, 7.5 * 30, 10 * 30]
+
+
+def test_one_rep_max_trend(history):
+    ts, e1rm = history.one_rep_max_trend("barbell rows")
+
+    assert ts.tolist() == [2 * DAY, 9 * DAY]
+    assert e1rm == pytest.approx([estimated_one_rep_max(70, 8), estimated_one_rep_max(72.5, 8)])
+    assert estimated_one_rep_max(100, 10) == pytest.approx(100 * 4 / 3)
+
+
+def test_unknown_exercise_has_no_trend(history):
+    assert [len(a) for a in history.volume("squat")] == [0, 0]
+    assert [len(a) for a in history.one_rep_max_trend("squat")] == [0, 0]
+
+
+def test_last_sessions_of_a_type_oldest_first(history):
+    sessions = history.last_sessions("push", n=2)
+
+    assert [s["ts"] for s in sessions] == [14 * DAY, 21 * DAY]
+    assert sessions[-1]["exercises"] == [
+        ("bench press", 87.5, 3, 5),
+        ("dip", 10.0, 3, 10),
+        ("lateral raise", 10.0, 3, 15),
+    ]
+    assert len(history.last_sessions("push", n=10)) == 4
+    assert history.last_sessions("push", n=0) == []
+
+
+def test_progression_summary(history):
+    summary = history.progression_summary("push", n=3)
+    date = datetime.date.fromtimestamp(21 * DAY).isoformat()
+
+    assert summary.splitlines() == [
+        f"Bench press: last done {date} with 87.5 kg, 3 sets of 5 repetitions; "
+        "estimated one repetition maximum over the last sessions: 96 -> 99 -> 102 kg.",
+        f"Dip: last done {date} with 10 kg, 3 sets of 10 repetitions; "
+        "estimated one repetition maximum over the last sessions: 7 -> 10 -> 13 kg.",
+        f"Lateral raise: last done {date} with 10 kg, 3 sets of 15 repetitions; "
+        "estimated one repetition maximum over the last sessions: 15 -> 15 -> 15 kg.",
+    ]
+
+
+def test_progression_summary_without_sessions(tmp_path):
+    assert WorkoutHistory(tmp_path / "history").progression_summary("push") is None
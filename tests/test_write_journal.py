@@ -0,0 +1,67 @@
+import pytest
+
+import resilience
+from device_modules.write_journal import JournalFlusher, WriteJournal
+from fakes import FakeHttpError
+
+
+def body(event_id):
+    return {"id": event_id, "summary": "WORKOUT"}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "calendar_journal.jsonl"
+
+
+def test_pending_inserts_survive_a_torn_last_record(path):
+    journal = WriteJournal(path)
+    journal.append("calendar", body("a"))
+    journal.append("calendar", body("b"))
+    journal.mark_done("a")
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"op":"insert","id":"c"')  # the process died while writing
+
+    reopened = WriteJournal(path)
+
+    assert [entry["id"] for entry in reopened.pending()] == ["b"]
+    assert not reopened.append("calendar", body("a"))
+    assert reopened.append("calendar", body("c"))
+    reopened.close()
+    assert [entry["id"] for entry in WriteJournal(path).pending()] == ["b", "c"]
+
+
+def test_compaction_keeps_the_pending_inserts(path):
+    journal = WriteJournal(path, compact_after=2)
+    for event_id in "abc":
+        journal.append("calendar", body(event_id))
+    journal.mark_done("a")
+    journal.mark_failed("b", "invalid")
+    journal.append("calendar", body("d"))
+    journal.close()
+
+    assert len(path.read_text().splitlines()) == 2
+    assert [entry["id"] for entry in WriteJournal(path).pending()] == ["c", "d"]
+
+
+def test_flusher_keeps_transient_failures_and_drops_permanent_ones(path):
+    journal = WriteJournal(path)
+    for event_id in "abc":
+        journal.append("calendar", body(event_id))
+    errors = {"a": FakeHttpError(400), "b": FakeHttpError(503)}
+    inserted = []
+
+    def insert(calendar_id, event):
+        if event["id"] in errors:
+            raise errors.pop(event["id"])
+        inserted.append(event["id"])
+        return event
+
+    flusher = JournalFlusher(journal, insert, retry_policy=resilience.RetryPolicy(3, 0.001, 0.01))
+
+    assert flusher.flush() == 2  # stopped at the unavailable upstream
+    assert [entry["id"] for entry in journal.failed] == ["a"]
+    assert flusher.drain(timeout=5)
+    assert inserted == ["b", "c"]
+    assert flusher.stats == {"inserted": 2, "failed": 1, "transient_errors": 1}